@@ -83,6 +83,10 @@ WSGI_APPLICATION = 'prl2016.wsgi.application'
 #     }
 # }
 
+# The launcher keeps its tube and arm state in its own crash-safe state file
+# instead of a database.
+PRL2016_STATE_FILE = os.path.join(BASE_DIR, 'prl2016.state')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
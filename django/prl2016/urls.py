@@ -24,4 +24,11 @@ urlpatterns = [
     url(r'^launch/status/?$', views.LauncherStatus.as_view()),
     url(r'^launch/arm/?$', views.Armer.as_view()),
     url(r'^launch/disarm/?$', views.DisArmer.as_view()),
+    url(r'^launch/load/?$', views.Loader.as_view()),
+    url(r'^launch/fire/?$', views.Fire.as_view()),
+    url(r'^launch/fire/all/?$', views.FireAll.as_view()),
+    url(r'^move/start/?$', views.MoveStart.as_view()),
+    url(r'^move/stop/?$', views.MoveStop.as_view()),
+    url(r'^move/emergency/?$', views.Emergency.as_view()),
+    url(r'^jobs/(?P<job_id>[0-9]+)/?$', views.JobStatus.as_view()),
 ]
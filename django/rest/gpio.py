@@ -0,0 +1,36 @@
+import os
+import sys
+from threading import Lock
+from django.conf import settings
+
+# The launcher core lives next to the Flask server; the Django front end runs
+# the same Engine instead of keeping its own copy of the launcher state.
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'prl2016')
+if ENGINE_DIR not in sys.path:
+    sys.path.append(ENGINE_DIR)
+
+import frames  # noqa: E402
+from engine import Engine, BadCommand, acquire_hardware_lock  # noqa: E402
+from launcher import NotArmed, NotLoaded  # noqa: E402
+
+engine = Engine()
+lock = Lock()
+hardware_lock = None
+started = False
+
+
+def get_engine():
+    # Started on the first request rather than at import, so the autoreloader
+    # parent of runserver, which never serves requests, does not grab the pins.
+    global hardware_lock, started
+
+    if not started:
+        with lock:
+            if not started:
+                hardware_lock = acquire_hardware_lock()
+                if hardware_lock is None:
+                    raise RuntimeError('Another PRL2016 server already owns the hardware')
+                engine.start(state_path=getattr(settings, 'PRL2016_STATE_FILE', None))
+                started = True
+
+    return engine
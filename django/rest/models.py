@@ -1,23 +1,3 @@
+from django.db import models
 
-
-class Tube:
-
-    def __init__(self, _id):
-        self.loaded = False
-        self.id = _id
-
-    def __str__(self):
-        return str(self.loaded) + str(self.id)
-
-
-class LaunchingSystem:
-
-    def __init__(self):
-        self.armed = False
-        self.tubes = []
-
-        for i in range(20):
-            self.tubes.append(Tube(i))
-
-    def __str__(self):
-        return str(self.armed)
+# Create your models here.
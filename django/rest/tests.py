@@ -1,3 +1,90 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from rest_framework.test import APIRequestFactory
+
+from . import views
+from .gpio import Engine, frames
+
+from backend import SimulatedBackend  # noqa: E402, on the path set by .gpio
+
+
+class ViewTestCase(SimpleTestCase):
+    # The views on a fresh engine over the simulated backend, called
+    # directly so the tests do not depend on the URL configuration
+
+    def setUp(self):
+        self.engine = Engine()
+        self.engine.start(backend=SimulatedBackend())
+        self.engine.handler.LAUNCH_WAIT_TIME = 0.01
+        patcher = mock.patch.object(views, 'get_engine', return_value=self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def call(self, view, method, data=None, **kwargs):
+        request = getattr(self.factory, method)('/', data, **kwargs)
+        response = view.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+
+class StatusViewTest(ViewTestCase):
+
+    def test_not_modified_until_the_state_changes(self):
+        first = self.call(views.LauncherStatus, 'get')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        again = self.call(views.LauncherStatus, 'get', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.status_code, 304)
+
+        self.call(views.Armer, 'post')
+        changed = self.call(views.LauncherStatus, 'get', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+
+    def test_status_as_a_frame(self):
+        self.engine.load([2])
+        response = self.call(views.LauncherStatus, 'get', HTTP_ACCEPT=frames.MIME_TYPE)
+        self.assertEqual(response['Content-Type'], frames.MIME_TYPE)
+        self.assertEqual(frames.decode_status(response.content)['loaded'], [2])
+
+
+class CommandViewTest(ViewTestCase):
+
+    def test_fire_needs_arm_and_a_loaded_tube(self):
+        self.assertEqual(self.call(views.Loader, 'post', [1], format='json').status_code, 200)
+        self.assertEqual(self.call(views.Fire, 'post', [1], format='json').status_code, 403)
+        self.assertEqual(self.call(views.Loader, 'post', [99], format='json').status_code, 400)
+        self.assertEqual(self.call(views.Fire, 'post', [], format='json').status_code, 400)
+
+    def test_fire_is_accepted_with_a_location(self):
+        self.engine.load([1])
+        self.engine.arm()
+        response = self.call(views.Fire, 'post', [1], format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], '/jobs/%d' % response.data['id'])
+
+        job = self.engine.jobs.get(response.data['id'])
+        deadline = time.monotonic() + 5
+        while job.finished is None and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(job.state, 'done')
+
+    def test_directions_as_a_frame(self):
+        response = self.call(views.MoveStart, 'post', frames.encode_directions(['cw']),
+                             content_type=frames.MIME_TYPE)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.engine.handler.moving_cw)
+
+        response = self.call(views.MoveStart, 'post', b'\x01\x00', content_type=frames.MIME_TYPE)
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.call(views.Emergency, 'get').status_code, 200)
+        self.assertFalse(self.engine.handler.moving_cw)
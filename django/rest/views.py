@@ -1,11 +1,70 @@
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import LaunchingSystemerializer
-from .models import LaunchingSystem
+from .gpio import get_engine, frames, BadCommand, NotArmed, NotLoaded
 
 
-prl = LaunchingSystem()
+class FrameParser(BaseParser):
+    media_type = frames.MIME_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read()
+
+
+class FrameRenderer(BaseRenderer):
+    # Lets a frame client through content negotiation; the text answers of
+    # the commands go out as they are
+    media_type = frames.MIME_TYPE
+    format = 'frame'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or isinstance(data, bytes):
+            return data or b''
+        return str(data).encode()
+
+
+class FrameView(APIView):
+    # JSON stays the default, frames are used when the client asks for them
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [FrameParser]
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [FrameRenderer]
+
+
+def command(fn, *args):
+    # Same status codes and messages as the Flask front end
+    try:
+        return fn(*args), None
+    except BadCommand as e:
+        return None, Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+    except (NotArmed, NotLoaded) as e:
+        return None, Response(str(e), status=status.HTTP_403_FORBIDDEN)
+
+
+def command_body(request, decode, *args):
+    if request.content_type.split(';')[0].strip() == frames.MIME_TYPE:
+        return decode(request.data, *args)
+    return request.data
+
+
+def wants_frame(request):
+    return request.accepted_media_type == frames.MIME_TYPE
+
+
+def job_accepted(request, job):
+    if wants_frame(request):
+        response = HttpResponse(frames.encode_job(job), content_type=frames.MIME_TYPE, status=status.HTTP_202_ACCEPTED)
+    else:
+        response = Response(job.serialize(), status=status.HTTP_202_ACCEPTED)
+    response['Location'] = '/jobs/' + str(job._id)
+    return response
+
+
+def no_json():
+    return Response("No JSON received.", status=status.HTTP_400_BAD_REQUEST)
 
 
 class Index(APIView):
@@ -13,18 +72,99 @@ class Index(APIView):
         return Response("PRL 2016")
 
 
-class Armer(APIView):
+class Armer(FrameView):
     def post(self, request):
-        prl.armed = True
-        return Response(status=status.HTTP_200_OK)
+        _, error = command(get_engine().arm)
+        return error or Response(status=status.HTTP_200_OK)
 
 
-class DisArmer(APIView):
+class DisArmer(FrameView):
     def post(self, request):
-        prl.armed = False
-        return Response(status=status.HTTP_200_OK)
+        _, error = command(get_engine().disarm)
+        return error or Response(status=status.HTTP_200_OK)
 
 
-class LauncherStatus(APIView):
+class LauncherStatus(FrameView):
     def get(self, request):
-        return Response(LaunchingSystemerializer(prl).data)
+        if wants_frame(request):
+            version, etag, body = frames.status_frame(get_engine().prl)
+            content_type = frames.MIME_TYPE
+        else:
+            version, etag, body = get_engine().status()
+            content_type = 'application/json'
+        etag = '"' + etag + '"'
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=content_type)
+
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        return response
+
+
+class Loader(FrameView):
+    def post(self, request):
+        engine = get_engine()
+        tubes, error = command(command_body, request, frames.decode_tubes, engine.prl.bank)
+        if error or not tubes:
+            return error or no_json()
+
+        _, error = command(engine.load, tubes)
+        return error or Response("Tube(s) loaded", status=status.HTTP_200_OK)
+
+
+class Fire(FrameView):
+    def post(self, request):
+        engine = get_engine()
+        tubes, error = command(command_body, request, frames.decode_tubes, engine.prl.bank)
+        if error or not tubes:
+            return error or no_json()
+
+        job, error = command(engine.fire, tubes)
+        return error or job_accepted(request, job)
+
+
+class FireAll(FrameView):
+    def post(self, request):
+        job, error = command(get_engine().fire_all)
+        return error or job_accepted(request, job)
+
+
+class MoveStart(FrameView):
+    def post(self, request):
+        engine = get_engine()
+        directions, error = command(command_body, request, frames.decode_directions)
+        if error or not directions:
+            return error or no_json()
+
+        _, error = command(engine.move_start, directions)
+        return error or Response("Moving in given direction", status=status.HTTP_200_OK)
+
+
+class MoveStop(FrameView):
+    def post(self, request):
+        engine = get_engine()
+        directions, error = command(command_body, request, frames.decode_directions)
+        if error or not directions:
+            return error or no_json()
+
+        _, error = command(engine.move_stop, directions)
+        return error or Response("Moving in given direction", status=status.HTTP_200_OK)
+
+
+class Emergency(FrameView):
+    def get(self, request):
+        get_engine().emergency_stop()
+        return Response("Emergency eliminated", status=status.HTTP_200_OK)
+
+
+class JobStatus(APIView):
+    def get(self, request, job_id):
+        job = get_engine().jobs.get(int(job_id))
+        if job is None:
+            return Response("No such job", status=status.HTTP_404_NOT_FOUND)
+
+        return Response(job.serialize())
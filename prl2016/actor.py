@@ -0,0 +1,90 @@
+import itertools
+import time
+from queue import PriorityQueue
+from threading import Event, Thread, current_thread
+from metrics import REGISTRY
+
+ACTOR_QUEUE_SECONDS = REGISTRY.histogram('prl2016_actor_queue_seconds',
+                                         'Time a hardware command waits in the actor queue.', ('priority',))
+
+
+class Command:
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.enqueued = time.monotonic()
+
+
+class HardwareActor:
+    # The only thread that touches the GPIOHandler. Request threads, limit
+    # switch callbacks and jobs enqueue commands and wait for them; commands
+    # with a lower priority number jump ahead, so an emergency stop never
+    # waits behind queued moves.
+
+    EMERGENCY = 0
+    NORMAL = 1
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queue = PriorityQueue()
+        self.seq = itertools.count()
+        self.thread = None
+
+        self.executed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        command = Command(fn, args)
+        self.queue.put((kwargs.get('priority', self.NORMAL), next(self.seq), command))
+        return command
+
+    def emergency(self, fn, *args):
+        return self.submit(fn, *args, priority=self.EMERGENCY)
+
+    def call(self, fn, *args, **kwargs):
+        if current_thread() is self.thread:
+            return fn(*args)
+
+        command = self.submit(fn, *args, **kwargs)
+        command.done.wait()
+        if command.error is not None:
+            raise command.error
+        return command.result
+
+    def run(self):
+        while True:
+            priority, _, command = self.queue.get()
+
+            latency = time.monotonic() - command.enqueued
+            ACTOR_QUEUE_SECONDS.labels(priority).observe(latency)
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+            try:
+                command.result = command.fn(*command.args)
+            except StopIteration as e:
+                command.error = e
+            except Exception as e:
+                self.handler.log.exception('Hardware command failed')
+                command.error = e
+            finally:
+                self.executed += 1
+                command.done.set()
+
+    def serialize(self):
+        return {
+            'queued': self.queue.qsize(),
+            'executed': self.executed,
+            'last_latency_ms': self.last_latency * 1000,
+            'max_latency_ms': self.max_latency * 1000,
+        }
@@ -0,0 +1,193 @@
+import os
+import time
+from threading import Lock, Thread
+
+
+class Backend:
+
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def setmode(self, mode):
+        raise NotImplementedError
+
+    def setup(self, channel, direction, initial=None, pull_up_down=None):
+        raise NotImplementedError
+
+    def output(self, channel, value):
+        raise NotImplementedError
+
+    def input(self, channel):
+        raise NotImplementedError
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        raise NotImplementedError
+
+    def remove_event_detect(self, channel):
+        raise NotImplementedError
+
+    def cleanup(self):
+        raise NotImplementedError
+
+
+class RPiBackend(Backend):
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+        for name in ('BCM', 'OUT', 'IN', 'LOW', 'HIGH', 'PUD_DOWN', 'PUD_UP', 'RISING', 'FALLING', 'BOTH'):
+            setattr(self, name, getattr(GPIO, name))
+
+    def setmode(self, mode):
+        self.GPIO.setmode(mode)
+
+    def setup(self, channel, direction, initial=None, pull_up_down=None):
+        if direction == self.OUT:
+            self.GPIO.setup(channel, direction, initial=self.LOW if initial is None else initial)
+        else:
+            self.GPIO.setup(channel, direction, pull_up_down=self.PUD_DOWN if pull_up_down is None else pull_up_down)
+
+    def output(self, channel, value):
+        self.GPIO.output(channel, value)
+
+    def input(self, channel):
+        return self.GPIO.input(channel)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if bouncetime is None:
+            self.GPIO.add_event_detect(channel, edge, callback=callback)
+        else:
+            self.GPIO.add_event_detect(channel, edge, callback=callback, bouncetime=bouncetime)
+
+    def remove_event_detect(self, channel):
+        self.GPIO.remove_event_detect(channel)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class SimulatedBackend(Backend):
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = Lock()
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.events = {}
+        self.trace = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, channel, direction, initial=None, pull_up_down=None):
+        with self.lock:
+            self.directions[channel] = direction
+            if direction == self.OUT:
+                self.levels[channel] = self.LOW if initial is None else initial
+            else:
+                self.levels[channel] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def output(self, channel, value):
+        # Like RPi.GPIO, a list or tuple of channels is written as one group;
+        # every channel of the group gets the same trace timestamp.
+        channels = channel if isinstance(channel, (list, tuple)) else [channel]
+
+        with self.lock:
+            for c in channels:
+                if self.directions.get(c) != self.OUT:
+                    raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+
+            now = self.clock()
+            for c in channels:
+                self.levels[c] = value
+                self.trace.append((now, c, value))
+
+    def input(self, channel):
+        if channel not in self.directions:
+            raise RuntimeError('You must setup() the GPIO channel first')
+        return self.levels[channel]
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if self.directions.get(channel) != self.IN:
+            raise RuntimeError('You must setup() the GPIO channel as an input first')
+        if channel in self.events:
+            raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+        self.events[channel] = [edge, callback, (bouncetime or 0) / 1000.0, None]
+
+    def remove_event_detect(self, channel):
+        self.events.pop(channel, None)
+
+    def cleanup(self):
+        with self.lock:
+            self.directions.clear()
+            self.levels.clear()
+            self.events.clear()
+
+    def set_input(self, channel, value):
+        with self.lock:
+            if self.directions.get(channel) != self.IN:
+                raise RuntimeError('The GPIO channel has not been set up as an INPUT')
+            previous = self.levels[channel]
+            self.levels[channel] = value
+            event = self.events.get(channel)
+
+        if event is None or previous == value:
+            return
+
+        edge, callback, bouncetime, last = event
+        if edge == self.RISING and value != self.HIGH or edge == self.FALLING and value != self.LOW:
+            return
+
+        now = self.clock()
+        if last is not None and now - last < bouncetime:
+            return
+        event[3] = now
+
+        if callback is not None:
+            callback(channel)
+
+    def play(self, script):
+        # script: iterable of (offset in seconds, channel, value), offsets
+        # relative to the moment play() is called.
+        start = self.clock()
+        steps = sorted(script, key=lambda step: step[0])
+
+        def run():
+            for offset, channel, value in steps:
+                delay = start + offset - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+                self.set_input(channel, value)
+
+        t = Thread(target=run)
+        t.daemon = True
+        t.start()
+        return t
+
+    def output_trace(self, channel=None):
+        with self.lock:
+            return [e for e in self.trace if channel is None or e[1] == channel]
+
+    def clear_trace(self):
+        with self.lock:
+            del self.trace[:]
+
+
+BACKENDS = {
+    'rpi': RPiBackend,
+    'sim': SimulatedBackend,
+}
+
+
+def get_backend(name=None):
+    return BACKENDS[name or os.environ.get('PRL2016_GPIO', 'rpi')]()
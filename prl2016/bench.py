@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+
+import frames
+from fleet import Node, NodeError
+
+# Each scenario is a weighted list of operations; an operation is the
+# sequence of requests one client sends for it.
+SCENARIOS = {
+    'status': [(1, 'status')],
+    'move': [(1, 'move')],
+    'fire': [(1, 'fire')],
+    'mixed': [(8, 'status'), (1, 'move'), (1, 'fire')],
+}
+
+ENCODINGS = ('json', 'frame')
+PERCENTILES = (50, 90, 99)
+STARTUP_TIMEOUT = 10
+
+
+def operation(name, tube, count=None):
+    # count is the tube count of the server when the bodies go as frames
+    if name == 'status':
+        return [('status', 'GET', '/launch/status', None)]
+    if name == 'move':
+        directions = ['cw'] if count is None else frames.encode_directions(['cw'])
+        return [('move_start', 'POST', '/move/start', directions),
+                ('move_stop', 'POST', '/move/stop', directions)]
+    tube = [tube] if count is None else frames.encode_tubes([tube], count)
+    return [('load', 'POST', '/launch/load', tube),
+            ('fire', 'POST', '/launch/fire', tube)]
+
+
+def fires(scenario):
+    return any(name == 'fire' for _, name in SCENARIOS[scenario])
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class Client:
+
+    def __init__(self, address, scenario, seed, count=None):
+        self.node = Node(address, pool_size=1)
+        self.count = count
+        self.accept = None if count is None else frames.MIME_TYPE
+        self.choices = [name for weight, name in SCENARIOS[scenario] for _ in range(weight)]
+        self.random = random.Random(seed)
+        # One tube per client, so up to ten clients never fire each
+        # other's tube between its load and its fire
+        self.tube = seed % 10 + 1
+        self.latencies = {}
+        self.errors = 0
+        self.operations = 0
+
+    def run(self, warmup_until, until):
+        while True:
+            now = time.monotonic()
+            if now >= until:
+                break
+
+            name = self.random.choice(self.choices)
+            for label, method, path, body in operation(name, self.tube, self.count):
+                try:
+                    status, _, latency = self.node.request(method, path, body, self.accept)
+                except NodeError:
+                    status, latency = None, None
+
+                if now < warmup_until:
+                    continue
+                if status is None or status >= 400:
+                    self.errors += 1
+                if latency is not None:
+                    self.latencies.setdefault(label, []).append(latency)
+
+            if now >= warmup_until:
+                self.operations += 1
+
+        self.node.close()
+
+
+def run_scenario(address, scenario, clients, duration, warmup, encoding='json'):
+    # A scenario that fires arms the system for the run and disarms it
+    # afterwards, also when the run fails.
+    node = Node(address)
+    count = None
+    if encoding == 'frame':
+        count = frames.decode_status(node.request('GET', '/launch/status', accept=frames.MIME_TYPE)[1])['count']
+
+    workers = [Client(address, scenario, i, count) for i in range(clients)]
+    try:
+        if fires(scenario):
+            node.request('POST', '/launch/arm')
+
+        start = time.monotonic()
+        threads = [Thread(target=w.run, args=(start + warmup, start + warmup + duration)) for w in workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if fires(scenario):
+            node.request('POST', '/launch/disarm')
+        node.close()
+
+    latencies = {}
+    for w in workers:
+        for label, values in w.latencies.items():
+            latencies.setdefault(label, []).extend(values)
+
+    requests = sum(len(v) for v in latencies.values())
+    result = {
+        'scenario': scenario,
+        'encoding': encoding,
+        'clients': clients,
+        'duration_s': duration,
+        'requests': requests,
+        'operations': sum(w.operations for w in workers),
+        'errors': sum(w.errors for w in workers),
+        'rps': requests / duration,
+        'routes': {},
+    }
+
+    for label, values in sorted(latencies.items()):
+        values.sort()
+        route = {'count': len(values), 'max_ms': values[-1] * 1000}
+        for p in PERCENTILES:
+            route['p%d_ms' % p] = percentile(values, p) * 1000
+        result['routes'][label] = route
+
+    everything = sorted(v for values in latencies.values() for v in values)
+    for p in PERCENTILES:
+        result['p%d_ms' % p] = None if not everything else percentile(everything, p) * 1000
+
+    return result
+
+
+def start_server(threads):
+    # A separate process on the simulated backend, so the clients do not
+    # compete with the server for the interpreter lock.
+    # Returns the process, its address and its working directory.
+    workdir = tempfile.mkdtemp(prefix='prl2016-bench-')
+    port = free_port()
+    env = dict(os.environ, PRL2016_GPIO='sim')
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+                               '--host', '127.0.0.1', '--port', str(port), '--threads', str(threads),
+                               '--lock-file', os.path.join(workdir, 'lock'),
+                               '--state-file', os.path.join(workdir, 'state'),
+                               '--log-file', os.path.join(workdir, 'server.log')], env=env)
+
+    address = '127.0.0.1:' + str(port)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            Node(address, timeout=1).request('GET', '/time')
+            return server, address, workdir
+        except NodeError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                server.wait()
+                shutil.rmtree(workdir, ignore_errors=True)
+                raise RuntimeError('Benchmark server did not start')
+            time.sleep(0.1)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def compare(results, baseline, tolerance):
+    # A run regresses when its throughput drops or its p99 grows by more
+    # than tolerance compared with the same scenario, encoding and client
+    # count. Baselines from before encodings were measured are all JSON.
+    previous = dict((key(r), r) for r in baseline['results'])
+    regressions = []
+
+    for r in results:
+        b = previous.get(key(r))
+        if b is None:
+            continue
+
+        name = '%s/%s/%d' % key(r)
+        if r['rps'] < b['rps'] * (1 - tolerance):
+            regressions.append('%s: %.0f rps, baseline %.0f' % (name, r['rps'], b['rps']))
+        if b['p99_ms'] is not None and r['p99_ms'] is not None and r['p99_ms'] > b['p99_ms'] * (1 + tolerance):
+            regressions.append('%s: p99 %.2f ms, baseline %.2f ms' % (name, r['p99_ms'], b['p99_ms']))
+
+    return regressions
+
+
+def key(r):
+    return r['scenario'], r.get('encoding', 'json'), r['clients']
+
+
+def summary(r):
+    return '%-7s %-5s %3d clients %8.0f rps  p50 %6.2f ms  p90 %6.2f ms  p99 %6.2f ms  errors %d' % (
+        r['scenario'], r.get('encoding', 'json'), r['clients'], r['rps'], r['p50_ms'] or 0, r['p90_ms'] or 0, r['p99_ms'] or 0, r['errors'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput and latency benchmark of the PRL2016 control API')
+    parser.add_argument('--target', default=None, help='host:port of a running server, default starts one on sim')
+    parser.add_argument('--allow-fire', action='store_true',
+                        help='run the fire and mixed scenarios against --target; they fire real tubes')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='repeat for several')
+    parser.add_argument('--encoding', action='append', choices=ENCODINGS, help='repeat for several, default json')
+    parser.add_argument('--clients', default='1,4,10', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--server-threads', type=int, default=16)
+    parser.add_argument('--save', default=None, help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', default=None, help='baseline JSON file to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenario or ['status', 'move', 'fire', 'mixed']
+    encodings = args.encoding or ['json']
+    clients = [int(c) for c in args.clients.split(',')]
+
+    # A real launcher fires whatever is connected to its tubes
+    if args.target is not None and not args.allow_fire:
+        if args.scenario and any(fires(s) for s in args.scenario):
+            sys.exit('The fire and mixed scenarios fire tubes on %s, pass --allow-fire to run them' % args.target)
+        scenarios = [s for s in scenarios if not fires(s)]
+
+    server = workdir = None
+    address = args.target
+    if address is None:
+        server, address, workdir = start_server(args.server_threads)
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for encoding in encodings:
+                for n in clients:
+                    result = run_scenario(address, scenario, n, args.duration, args.warmup, encoding)
+                    results.append(result)
+                    print(summary(result))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'created': time.time(), 'target': args.target or 'sim', 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,589 @@
+import fcntl
+import logging
+import math
+import os
+import time
+from threading import RLock, Thread, active_count
+
+import journal
+from actor import HardwareActor
+from backend import get_backend
+from events import EventStream
+from gpio import GPIOHandler
+from jobs import JobExecutor
+from journal import RecordingBackend
+from launcher import LaunchingSystem, NotArmed, NotLoaded
+from metrics import REGISTRY
+from pinmap import AXES, AXIS_DIRECTIONS, ENCODERS, load_pin_map
+from positioner import Positioner
+from selftest import SelfTest
+from store import StateStore
+
+DEFAULT_LOCK_FILE = '/tmp/prl2016.lock'
+
+THREADS = REGISTRY.gauge('prl2016_threads', 'Number of live threads.')
+QUEUE_DEPTH = REGISTRY.gauge('prl2016_queue_depth', 'Items waiting in the internal queues.', ('queue',))
+ENCODER_RATE = REGISTRY.gauge('prl2016_encoder_step_rate', 'Encoder detents per second.', ('axis',))
+ENCODER_MISSED = REGISTRY.gauge('prl2016_encoder_missed_transitions', 'Encoder transitions lost to glitches.', ('axis',))
+EVENT_SUBSCRIBERS = REGISTRY.gauge('prl2016_event_subscribers', 'Open /events streams.')
+
+
+class BadCommand(ValueError):
+    pass
+
+
+def acquire_hardware_lock(path=DEFAULT_LOCK_FILE):
+    # Exactly one process may own the GPIO pins. The lock is released by the
+    # kernel when the process exits, so a crashed server never blocks a
+    # restart.
+    f = open(path, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        f.close()
+        return None
+
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+
+class Engine:
+    # The launcher core shared by the Flask and the Django front ends: tube
+    # and arm state, the hardware actor, jobs, the event stream and the
+    # journal. Front ends parse requests, call the command methods and map
+    # BadCommand to 400 and NotArmed/NotLoaded to 403.
+
+    MOVEMENT_TEST_DELAY = 1
+    # Furthest ahead in seconds a synchronized fire may be scheduled
+    MAX_FIRE_DELAY = 300
+    # Jobs that drive the motors, cancelled by an emergency stop
+    MOTION_JOBS = ('move_to', 'movement_test', 'self_test')
+    # Scheduled fires, cancelled by a disarm and an emergency stop
+    FIRE_JOBS = ('launch_at',)
+
+    def __init__(self, pins=None):
+        self.pins = pins or load_pin_map()
+        self.prl = LaunchingSystem(self.pins.racks, self.pins.tubes_per_rack)
+        self.lock = RLock()
+        self.handler = None
+        self.journal = None
+        self.store = None
+        self.actor = None
+        self.positioner = None
+        self.selftest = None
+        self.show = None
+        # axis -> the last move_to job driving it
+        self.axis_jobs = {}
+        # launch_at job id -> its tubes, emptied once they fire
+        self.scheduled = {}
+        self.jobs = JobExecutor()
+        self.events = EventStream(self.snapshot)
+        self.prl.listeners.append(self.events.notify)
+
+    def start(self, backend=None, journal_dir=None, input_rate=None, state_path=None):
+        if journal_dir is not None:
+            self.journal = journal.Journal(journal_dir)
+            backend = RecordingBackend(backend or get_backend(), self.journal)
+
+        self.handler = GPIOHandler(backend, self.pins)
+        if input_rate is not None:
+            self.handler.inputs.interval = 1.0 / input_rate
+        self.handler.gpio_init()
+
+        self.actor = HardwareActor(self.handler)
+        self.actor.start()
+        self.handler.limit_switches.dispatch = self.actor.emergency
+        self.handler.watchdog.dispatch = self.actor.emergency
+        self.handler.watchdog.start()
+        self.jobs.runner = self.actor.call
+
+        t1 = Thread(target=self.handler.check_limit_switches)
+        t1.daemon = True
+        t1.start()
+
+        self.handler.rotary_encoder_vertical()
+        self.handler.rotary_encoder_horizontal()
+        if state_path is not None:
+            self.open_store(state_path)
+
+        self.positioner = Positioner(self.handler)
+        self.selftest = SelfTest(self.handler, self.events.publish)
+
+        self.jobs.start()
+
+        self.handler.listeners.append(self.events.notify)
+        self.events.start()
+
+        self.register_gauges()
+
+        return self.handler
+
+    def stop(self):
+        # A journaled emergency stop like any other, so a replay of a cleanly
+        # stopped run ends with the motors cut the same way
+        self.emergency_stop()
+        self.handler.gpio_cleanup()
+        if self.store is not None:
+            self.store.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def open_store(self, path):
+        # Recovers the tube and arm state and the encoder counts of the last
+        # run, then commits every launcher change as it happens.
+        if self.prl.bank.count > StateStore.MAX_TUBES:
+            raise ValueError('The state file holds at most %d tubes' % StateStore.MAX_TUBES)
+
+        self.store = StateStore(path)
+        recovered = self.store.recovered
+        if recovered is not None:
+            self.prl.restore(recovered['armed'], recovered['loaded'])
+            self.handler.encoder_vertical.count = recovered['encoders']['vertical']
+            self.handler.encoder_horizontal.count = recovered['encoders']['horizontal']
+            logging.warning('Recovered launcher state: %s, loaded %s' % (
+                'armed' if recovered['armed'] else 'disarmed', self.prl.bank.ids(self.prl.loaded)))
+
+        self.prl.listeners.append(self.save_state)
+        self.store.start(self.state_record)
+
+    def state_record(self):
+        version, armed, loaded = self.prl.snapshot()
+        return armed, loaded, self.handler.encoder_vertical.count, self.handler.encoder_horizontal.count
+
+    def save_state(self):
+        self.store.sync()
+
+    def register_gauges(self):
+        THREADS.set_function(active_count)
+        QUEUE_DEPTH.labels('actor').set_function(self.actor.queue.qsize)
+        QUEUE_DEPTH.labels('jobs').set_function(lambda: len(self.jobs.queue))
+        QUEUE_DEPTH.labels('pin_log').set_function(self.handler.pin_log.queue.qsize)
+        EVENT_SUBSCRIBERS.set_function(lambda: len(self.events.subscribers))
+
+        for encoder in (self.handler.encoder_vertical, self.handler.encoder_horizontal):
+            ENCODER_RATE.labels(encoder.name).set_function(encoder.step_rate)
+            ENCODER_MISSED.labels(encoder.name).set_function(lambda e=encoder: e.missed)
+
+    def record(self, kind, encode=None, value=None):
+        if self.journal is not None:
+            self.journal.command(kind, encode(value) if encode else b'')
+
+    def snapshot(self):
+        version, armed, loaded = self.prl.snapshot()
+        state = {
+            'armed': armed,
+            'version': version,
+            'loaded': self.prl.bank.ids(loaded),
+        }
+
+        # The movement flags are the ones the actor keeps on the handler,
+        # whatever moved the axis: a command, a job, a limit trip or the
+        # travel watchdog
+        handler = self.handler
+        for direction in AXES:
+            state['movement.' + direction] = handler is not None and getattr(handler, 'moving_' + direction)
+
+        if handler is not None:
+            state.update(handler.snapshot())
+
+        return state
+
+    def status(self):
+        return self.prl.status()
+
+    ########### COMMANDS #############
+
+    # Launcher and movement commands hold self.lock, so a batch runs as one
+    # step for every other client. The emergency stop never takes it.
+
+    def arm(self):
+        with self.lock:
+            self.check_not_testing()
+            logging.info('ARM')
+            self.prl.arm()
+            self.record(journal.ARM)
+
+    def disarm(self):
+        with self.lock:
+            logging.info('DISARM')
+            self.prl.disarm()
+            self.record(journal.DISARM)
+            self.actor.call(self.cancel_scheduled_fires)
+
+    def load(self, ids):
+        with self.lock:
+            self.check_not_testing()
+            try:
+                self.prl.load(ids)
+            except ValueError:
+                raise BadCommand('Bad request, invalid tube id')
+
+            self.record(journal.LOAD, journal.encode_ids, ids)
+
+    def fire(self, ids):
+        with self.lock:
+            try:
+                self.prl.fire(ids)
+            except ValueError:
+                raise BadCommand('Bad request, invalid tube id')
+
+            self.record(journal.FIRE, journal.encode_ids, ids)
+            return self.jobs.submit('launch', self.handler.launch_sequence(ids))
+
+    def fire_at(self, ids, at):
+        # at is in server wall clock seconds; a time in the past fires at
+        # once and shows up as lateness in the job result.
+        self.check_time(at)
+
+        with self.lock:
+            try:
+                self.prl.fire(ids)
+            except ValueError:
+                raise BadCommand('Bad request, invalid tube id')
+
+            self.record(journal.FIRE_AT, journal.encode_fire_at, {'tubes': ids, 'at': at})
+            for job_id in [job_id for job_id, pending in self.scheduled.items() if not pending]:
+                del self.scheduled[job_id]
+
+            pending = list(ids)
+            job = self.jobs.submit('launch_at', self.fire_at_sequence(pending, at))
+            self.scheduled[job._id] = pending
+            return job
+
+    def fire_all(self):
+        with self.lock:
+            self.prl.fire_all()
+
+            self.record(journal.FIRE_ALL)
+            return self.jobs.submit('launch_all', self.handler.launch_all_sequence())
+
+    def check_not_testing(self, motors=False):
+        test = self.selftest
+        if test is not None and (test.testing_launch or motors and test.running):
+            raise BadCommand('Bad request, self-test in progress')
+
+    def check_time(self, at):
+        # NaN compares False against everything, so it would fire at once
+        if not isinstance(at, (int, float)) or isinstance(at, bool) or not math.isfinite(at) \
+                or at - time.time() > self.MAX_FIRE_DELAY:
+            raise BadCommand('Bad request, invalid time')
+
+    def check_directions(self, directions):
+        if len(directions) < 1 or len(directions) > 2:
+            raise BadCommand('Bad request, invalid json')
+
+        if 'cw' in directions and 'ccw' in directions:
+            raise BadCommand('Bad request, opposite directions')
+
+        if 'up' in directions and 'down' in directions:
+            raise BadCommand('Bad request, opposite directions')
+
+    def check_targets(self, targets):
+        if not isinstance(targets, dict) or not targets or not set(targets) <= set(ENCODERS):
+            raise BadCommand('Bad request, invalid json')
+
+        for v in targets.values():
+            if not isinstance(v, int) or isinstance(v, bool):
+                raise BadCommand('Bad request, invalid json')
+            if not journal.TARGET_MIN <= v <= journal.TARGET_MAX:
+                raise BadCommand('Bad request, target out of range')
+
+    def move_start(self, directions):
+        self.check_directions(directions)
+
+        with self.lock:
+            self.check_not_testing(motors=True)
+            self.check_not_driven(directions, self.motion_state()[1])
+            self.record(journal.MOVE_START, journal.encode_directions, directions)
+            self.actor.call(self.start_movement_command, directions)
+
+    def move_stop(self, directions):
+        self.check_directions(directions)
+
+        with self.lock:
+            self.record(journal.MOVE_STOP, journal.encode_directions, directions)
+            self.actor.call(self.stop_movement_command, directions)
+
+    def emergency_stop(self):
+        if self.show is not None:
+            self.show.stop()
+
+        self.record(journal.EMERGENCY)
+        self.actor.call(self.emergency_stop_command, priority=HardwareActor.EMERGENCY)
+
+    def move_to(self, targets):
+        self.check_targets(targets)
+
+        with self.lock:
+            self.check_not_testing(motors=True)
+            self.check_axes_idle(targets)
+            self.record(journal.MOVE_TO, journal.encode_targets, targets)
+            job = self.jobs.submit('move_to', self.positioner.move_to_sequence(targets))
+            for axis in targets:
+                self.axis_jobs[axis] = job
+            return job
+
+    def motion_state(self):
+        # (directions moving, axes driven by a move_to job)
+        moving = set(d for d in AXES if getattr(self.handler, 'moving_' + d))
+        driven = set(axis for axis, job in self.axis_jobs.items() if job.finished is None)
+        return moving, driven
+
+    def check_axes_idle(self, axes, state=None):
+        # A second controller or a manual move on the same axis would fight
+        # the first one over the motor
+        moving, driven = state or self.motion_state()
+        for axis in sorted(axes):
+            if axis in driven or moving & set(AXIS_DIRECTIONS[axis]):
+                raise BadCommand('Bad request, %s axis is already moving' % axis)
+
+    def check_not_driven(self, directions, driven):
+        for axis in sorted(driven):
+            if set(directions) & set(AXIS_DIRECTIONS[axis]):
+                raise BadCommand('Bad request, %s axis is driven by move_to' % axis)
+
+    def check_motion_idle(self):
+        # Nothing else may drive the motors while a test does
+        if self.jobs.active(('move_to', 'movement_test')) or any(self.handler.axis_moving(axis) for axis in ENCODERS):
+            raise BadCommand('Bad request, movement in progress')
+
+    ########### BATCH #############
+
+    BATCH_COMMANDS = {
+        'arm': (),
+        'disarm': (),
+        'load': ('tubes',),
+        'fire': ('tubes',),
+        'fire_at': ('tubes', 'at'),
+        'fire_all': (),
+        'move_start': ('directions',),
+        'move_stop': ('directions',),
+        'move_to': ('targets',),
+        'emergency_stop': (),
+    }
+    MAX_BATCH = 64
+
+    def batch(self, commands):
+        # Every command is parsed and checked against the launcher and motion
+        # state the commands before it would leave behind; only then does
+        # anything run, so a bad command in the middle never half applies a
+        # batch.
+        if not isinstance(commands, list) or not commands or len(commands) > self.MAX_BATCH:
+            raise BadCommand('Bad request, invalid json')
+
+        calls = []
+        for i, command in enumerate(commands):
+            name = command.get('command') if isinstance(command, dict) else None
+            if name not in self.BATCH_COMMANDS or set(command) - {'command'} != set(self.BATCH_COMMANDS[name]):
+                raise BadCommand('Command %d: Bad request, invalid json' % i)
+            calls.append((name, [command[arg] for arg in self.BATCH_COMMANDS[name]]))
+
+        with self.lock:
+            version, armed, loaded = self.prl.snapshot()
+            state = {'armed': armed, 'loaded': loaded}
+            state['moving'], state['driven'] = self.motion_state()
+            for i, (name, args) in enumerate(calls):
+                try:
+                    self.check_command(name, args, state)
+                except (BadCommand, NotArmed, NotLoaded) as e:
+                    raise e.__class__('Command %d (%s): %s' % (i, name, e))
+
+            # A hardware failure cannot be rolled back; the rest is skipped
+            results = []
+            failed = False
+            for name, args in calls:
+                if failed:
+                    results.append({'command': name, 'status': None, 'error': 'Skipped'})
+                    continue
+
+                try:
+                    job = getattr(self, name)(*args)
+                except BadCommand as e:
+                    results.append({'command': name, 'status': 400, 'error': str(e)})
+                    failed = True
+                    continue
+                except (NotArmed, NotLoaded) as e:
+                    results.append({'command': name, 'status': 403, 'error': str(e)})
+                    failed = True
+                    continue
+                except Exception as e:
+                    logging.exception('Batch command ' + name + ' failed')
+                    results.append({'command': name, 'status': 500, 'error': str(e)})
+                    failed = True
+                    continue
+
+                if job is None:
+                    results.append({'command': name, 'status': 200})
+                else:
+                    results.append({'command': name, 'status': 202, 'job': job.serialize()})
+
+        return results
+
+    def check_command(self, name, args, state):
+        # Checks one batch command against state and updates it to what the
+        # command leaves behind: armed, the loaded mask, the directions
+        # moving and the axes driven by move_to jobs
+        bank = self.prl.bank
+
+        if name in ('load', 'fire', 'fire_at'):
+            try:
+                mask = bank.mask(args[0])
+            except ValueError:
+                raise BadCommand('Bad request, invalid tube id')
+
+        if name in ('arm', 'load'):
+            self.check_not_testing()
+        elif name in ('move_start', 'move_to'):
+            self.check_not_testing(motors=True)
+
+        if name == 'arm':
+            state['armed'] = True
+        elif name == 'disarm':
+            state['armed'] = False
+        elif name == 'load':
+            state['loaded'] |= mask
+        elif name in ('fire', 'fire_at'):
+            if name == 'fire_at':
+                self.check_time(args[1])
+            if not state['armed']:
+                raise NotArmed('System is not armed!')
+            if mask & ~state['loaded']:
+                raise NotLoaded('Some of the tubes are not loaded')
+            state['loaded'] &= ~mask
+        elif name == 'fire_all':
+            if not state['armed']:
+                raise NotArmed('System is not armed!')
+            state['loaded'] = 0
+        elif name in ('move_start', 'move_stop'):
+            if not isinstance(args[0], list):
+                raise BadCommand('Bad request, invalid json')
+            self.check_directions(args[0])
+            directions = set(args[0])
+            if name == 'move_start':
+                self.check_not_driven(directions, state['driven'])
+                for axis_directions in AXIS_DIRECTIONS.values():
+                    if directions & set(axis_directions):
+                        state['moving'] -= set(axis_directions)
+                state['moving'] |= directions
+            else:
+                state['moving'] -= directions
+        elif name == 'move_to':
+            self.check_targets(args[0])
+            self.check_axes_idle(args[0], (state['moving'], state['driven']))
+            state['driven'] |= set(args[0])
+        elif name == 'emergency_stop':
+            state['moving'] = set()
+            state['driven'] = set()
+
+    def self_test(self, launch=False):
+        # The launch relays fire whatever igniter is connected, so they are
+        # only pulsed with the system disarmed and every tube empty.
+        with self.lock:
+            if self.selftest.running:
+                raise BadCommand('Bad request, self-test already running')
+
+            if launch and (self.prl.armed or self.prl.loaded):
+                raise BadCommand('Bad request, disarm and unload before testing the launch relays')
+
+            self.check_motion_idle()
+
+            job = self.jobs.submit('self_test', self.selftest.sequence(launch))
+            self.selftest.begin(launch, job)
+            return job
+
+    def movement_test(self):
+        with self.lock:
+            self.check_not_testing(motors=True)
+            self.check_motion_idle()
+            return self.jobs.submit('movement_test', self.movement_test_sequence())
+
+    ########### HARDWARE #############
+
+    def start_movement_command(self, directions):
+        # GPIOHandler.move_* cuts the opposite direction of the axis first
+        handler = self.handler
+
+        if 'cw' in directions:
+            handler.move_cw()
+
+        if 'ccw' in directions:
+            handler.move_ccw()
+
+        if 'up' in directions:
+            handler.move_up()
+
+        if 'down' in directions:
+            handler.move_down()
+
+    def stop_movement_command(self, directions):
+        handler = self.handler
+
+        if 'cw' in directions:
+            handler.stop_cw()
+
+        if 'ccw' in directions:
+            handler.stop_ccw()
+
+        if 'up' in directions:
+            handler.stop_up()
+
+        if 'down' in directions:
+            handler.stop_down()
+
+    def emergency_stop_command(self):
+        # Runs on the actor, so no step of a motion job can slip in between
+        # the cancel and the stop
+        self.jobs.cancel_all(self.MOTION_JOBS)
+        self.cancel_scheduled_fires()
+        self.handler.emergency_stop()
+
+    def cancel_scheduled_fires(self):
+        # Tubes of a fire that has not gone off yet are loaded again
+        for job in self.jobs.cancel_all(self.FIRE_JOBS):
+            pending = self.scheduled.pop(job._id, None)
+            if pending:
+                self.prl.load(pending)
+
+    def fire_at_sequence(self, pending, at):
+        delay = at - time.time()
+        if delay > 0:
+            yield delay
+
+        # A disarm cancels the job; this catches one racing the wake-up
+        if not self.prl.armed:
+            self.prl.load(pending)
+            del pending[:]
+            raise NotArmed('System was disarmed before the scheduled fire')
+
+        ids = list(pending)
+        del pending[:]
+        late = time.time() - at
+        result = yield from self.handler.launch_sequence(ids)
+        result['late_ms'] = late * 1000
+        return result
+
+    def movement_test_sequence(self):
+        handler = self.handler
+
+        handler.move_up()
+        yield self.MOVEMENT_TEST_DELAY
+        handler.stop_up()
+
+        handler.move_down()
+        yield self.MOVEMENT_TEST_DELAY
+        handler.stop_down()
+
+        handler.move_ccw()
+        yield self.MOVEMENT_TEST_DELAY
+        handler.stop_ccw()
+
+        handler.move_cw()
+        yield self.MOVEMENT_TEST_DELAY*2
+        handler.stop_cw()
+
+        handler.move_ccw()
+        yield self.MOVEMENT_TEST_DELAY
+        handler.stop_ccw()
@@ -0,0 +1,117 @@
+import itertools
+import json
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+
+
+class Subscription:
+
+    CAPACITY = 256
+
+    def __init__(self):
+        self.queue = Queue(self.CAPACITY)
+        self.resync = False
+
+
+class EventStream:
+    # A single producer samples the state through snapshot(), diffs it with
+    # the previous sample and fans the delta out to every subscriber, so the
+    # sampling cost does not grow with the number of clients. notify() wakes
+    # the producer right away; input changes are picked up on the interval.
+
+    INTERVAL = 0.01
+    KEEPALIVE = 15
+
+    def __init__(self, snapshot, interval=INTERVAL, max_subscribers=None):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.subscribers = set()
+        self.state = {}
+        self.seq = itertools.count(1)
+        self.last_seq = 0
+        self.thread = None
+
+    def start(self):
+        self.state = self.snapshot()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def subscribe(self):
+        # None when max_subscribers streams are already open
+        sub = Subscription()
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+            state = self.snapshot()
+            delta = dict((k, v) for k, v in state.items() if self.state.get(k) != v)
+            if not delta:
+                continue
+
+            self.publish('delta', delta, state)
+
+    def publish(self, name, data, state=None):
+        with self.lock:
+            if state is not None:
+                self.state = state
+            self.last_seq = next(self.seq)
+            event = (self.last_seq, name, data)
+
+            for sub in self.subscribers:
+                try:
+                    sub.queue.put_nowait(event)
+                except Full:
+                    sub.resync = True
+
+    def stream(self, sub):
+        # Generator of text/event-stream chunks: the full state first, then
+        # deltas. A subscriber that fell behind gets a fresh full state.
+        try:
+            yield self.format(self.last_seq, 'state', self.state)
+
+            while True:
+                if sub.resync:
+                    with self.lock:
+                        sub.resync = False
+                        while not sub.queue.empty():
+                            sub.queue.get_nowait()
+                        seq, state = self.last_seq, self.state
+                    yield self.format(seq, 'state', state)
+
+                try:
+                    event = sub.queue.get(timeout=self.KEEPALIVE)
+                except Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                yield self.format(*event)
+        finally:
+            self.unsubscribe(sub)
+
+    def format(self, seq, name, data):
+        return 'id: %d\nevent: %s\ndata: %s\n\n' % (seq, name, json.dumps(data, sort_keys=True))
+
+    def serialize(self):
+        return {
+            'subscribers': len(self.subscribers),
+            'max_subscribers': self.max_subscribers,
+            'seq': self.last_seq,
+        }
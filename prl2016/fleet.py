@@ -0,0 +1,270 @@
+import argparse
+import http.client
+import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+
+import frames
+
+
+class NodeError(Exception):
+    pass
+
+
+class Node:
+    # One PRL2016 server. Connections the server keeps open are pooled so a
+    # fan-out pays the TCP handshake once per connection, not once per
+    # command; the werkzeug based server closes each one after its response.
+
+    POOL_SIZE = 4
+    TIMEOUT = 5
+    # Safe to send twice; a fire must never be
+    IDEMPOTENT = ('GET', 'HEAD')
+
+    def __init__(self, address, timeout=TIMEOUT, pool_size=POOL_SIZE):
+        host, _, port = address.rpartition(':')
+        self.address = address
+        self.host = host or 'localhost'
+        self.port = int(port)
+        self.timeout = timeout
+        self.pool = Queue(pool_size)
+
+        self.offset = 0.0
+        self.rtt = None
+
+    def connection(self):
+        # (connection, reused)
+        try:
+            return self.pool.get_nowait(), True
+        except Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, conn):
+        try:
+            self.pool.put_nowait(conn)
+        except Exception:
+            conn.close()
+
+    def request(self, method, path, body=None, accept=None):
+        # A bytes body is sent as a binary frame, anything else as JSON
+        headers = {'Connection': 'keep-alive'}
+        if accept is not None:
+            headers['Accept'] = accept
+
+        data = None
+        if isinstance(body, bytes):
+            data = body
+            headers['Content-Type'] = frames.MIME_TYPE
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        # A pooled connection the server has since closed fails on first
+        # use; move on to the next one, but only when the request never went
+        # out or sending it twice is harmless. A fresh connection never
+        # retries, so a timed out fire is reported, not sent again.
+        while True:
+            conn, reused = self.connection()
+            sent = False
+            try:
+                start = time.monotonic()
+                conn.request(method, path, data, headers)
+                sent = True
+                response = conn.getresponse()
+                payload = response.read()
+                latency = time.monotonic() - start
+            except (http.client.HTTPException, socket.error) as e:
+                conn.close()
+                if reused and (not sent or method in self.IDEMPOTENT):
+                    continue
+                raise NodeError(str(e) or e.__class__.__name__)
+
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+            else:
+                self.release(conn)
+            return response.status, decode(response, payload), latency
+
+    def sync_clock(self, samples=8):
+        # NTP style: the server read its clock somewhere inside the round
+        # trip, assume the middle. The sample with the shortest round trip
+        # bounds the error best.
+        best = None
+        for _ in range(samples):
+            sent = time.time()
+            status, body, _ = self.request('GET', '/time')
+            received = time.time()
+            if status != 200:
+                raise NodeError('GET /time returned ' + str(status))
+
+            rtt = received - sent
+            if best is None or rtt < best[0]:
+                best = (rtt, body['time'] - (sent + received) / 2)
+
+        self.rtt, self.offset = best
+        return self.offset
+
+    def close(self):
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except Empty:
+                break
+
+    def serialize(self):
+        return {
+            'address': self.address,
+            'offset_ms': self.offset * 1000,
+            'rtt_ms': None if self.rtt is None else self.rtt * 1000,
+        }
+
+
+def decode(response, payload):
+    content_type = response.getheader('Content-Type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(payload.decode())
+    if content_type.startswith(frames.MIME_TYPE):
+        return payload
+    return payload.decode(errors='replace')
+
+
+class Fleet:
+    # Fans commands out to every node at once and gathers the answers with
+    # the latency of each node. A node that fails or answers with an error
+    # status never stops the others.
+
+    def __init__(self, addresses, timeout=Node.TIMEOUT):
+        self.nodes = [Node(a, timeout) for a in addresses]
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.nodes)))
+
+    def broadcast(self, method, path, body=None, nodes=None):
+        return self.gather(lambda node: node.request(method, path, body(node) if callable(body) else body), nodes)
+
+    def gather(self, fn, nodes=None):
+        futures = [(node, self.executor.submit(fn, node)) for node in (self.nodes if nodes is None else nodes)]
+        results = {}
+
+        for node, future in futures:
+            try:
+                status, body, latency = future.result()
+                results[node.address] = {'status': status, 'body': body, 'latency_ms': latency * 1000}
+            except NodeError as e:
+                results[node.address] = {'status': None, 'error': str(e), 'latency_ms': None}
+
+        latencies = [r['latency_ms'] for r in results.values() if r['latency_ms'] is not None]
+        return {
+            'ok': sum(1 for r in results.values() if r['status'] is not None and r['status'] < 400),
+            'failed': sum(1 for r in results.values() if r['status'] is None or r['status'] >= 400),
+            'max_latency_ms': max(latencies) if latencies else None,
+            'nodes': results,
+        }
+
+    def arm(self):
+        return self.broadcast('POST', '/launch/arm')
+
+    def disarm(self):
+        return self.broadcast('POST', '/launch/disarm')
+
+    def load(self, ids):
+        return self.broadcast('POST', '/launch/load', ids)
+
+    def fire(self, ids):
+        return self.broadcast('POST', '/launch/fire', ids)
+
+    def status(self):
+        return self.broadcast('GET', '/launch/status')
+
+    def sync_clocks(self, samples=8):
+        def sync(node):
+            start = time.monotonic()
+            node.sync_clock(samples)
+            return 200, node.serialize(), time.monotonic() - start
+
+        return self.gather(sync)
+
+    def fire_at(self, ids, delay, samples=8):
+        # Every node gets the same instant translated into its own clock, so
+        # the spread between nodes is the offset error, not the network. A
+        # node whose clock could not be synced is left out, not fired with a
+        # stale or zero offset.
+        synced = self.sync_clocks(samples)['nodes']
+        nodes = [node for node in self.nodes if synced[node.address]['status'] is not None]
+
+        at = time.time() + delay
+        result = self.broadcast('POST', '/launch/fire/at', lambda node: {'tubes': ids, 'at': at + node.offset}, nodes)
+        for node in self.nodes:
+            if node not in nodes:
+                error = 'Not fired, clock sync failed: ' + synced[node.address]['error']
+                result['nodes'][node.address] = {'status': None, 'error': error, 'latency_ms': None}
+                result['failed'] += 1
+        result['at'] = at
+        result['clocks'] = dict((node.address, node.serialize()) for node in self.nodes)
+        return result
+
+    def job(self, node, job_id):
+        return node.request('GET', '/jobs/' + str(job_id))
+
+    def wait(self, result, timeout=10):
+        # Polls the jobs a fire returned until they finish or time out
+        deadline = time.monotonic() + timeout
+        jobs = {}
+
+        for node in self.nodes:
+            body = result['nodes'][node.address].get('body')
+            if not isinstance(body, dict) or 'id' not in body:
+                continue
+
+            while True:
+                status, job, _ = self.job(node, body['id'])
+                if status != 200 or job['state'] not in ('pending', 'running') or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            jobs[node.address] = job
+
+        return jobs
+
+    def close(self):
+        self.executor.shutdown()
+        for node in self.nodes:
+            node.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Drive several PRL2016 servers at once')
+    parser.add_argument('--node', action='append', required=True, help='host:port, repeat for every server')
+    parser.add_argument('--timeout', type=float, default=Node.TIMEOUT)
+    parser.add_argument('--delay', type=float, default=2.0, help='seconds from now for fire-at')
+    parser.add_argument('--wait', action='store_true', help='wait for the launch jobs to finish')
+    parser.add_argument('command', choices=['arm', 'disarm', 'status', 'load', 'fire', 'fire-at', 'clocks'])
+    parser.add_argument('tubes', nargs='*', type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fleet = Fleet(args.node, args.timeout)
+
+    try:
+        if args.command == 'load':
+            result = fleet.load(args.tubes)
+        elif args.command == 'fire':
+            result = fleet.fire(args.tubes)
+        elif args.command == 'fire-at':
+            result = fleet.fire_at(args.tubes, args.delay)
+        elif args.command == 'clocks':
+            result = fleet.sync_clocks()
+        else:
+            result = getattr(fleet, args.command)()
+
+        if args.wait and args.command in ('fire', 'fire-at'):
+            result['jobs'] = fleet.wait(result, args.delay + 10)
+    finally:
+        fleet.close()
+
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
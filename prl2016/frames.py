@@ -0,0 +1,116 @@
+import struct
+
+import journal
+from engine import BadCommand
+
+# Compact binary encoding of the status and the command bodies for clients
+# on slow links, negotiated per request: a client sends command bodies with
+# this Content-Type and asks for it in Accept. JSON stays the default.
+MIME_TYPE = 'application/vnd.prl2016.frame'
+FORMAT_VERSION = 1
+
+ARMED = 1
+
+# format version, flags, state version, tube count; the loaded tube mask
+# follows, little-endian in mask_size(count) bytes
+STATUS = struct.Struct('<BBIH')
+# job id
+JOB = struct.Struct('<I')
+# server wall clock time; the tube mask follows
+FIRE_AT = struct.Struct('<d')
+
+
+def mask_size(count):
+    return (count + 7) // 8
+
+
+def encode_mask(mask, count):
+    return mask.to_bytes(mask_size(count), 'little')
+
+
+def decode_mask(payload, bank):
+    # Tube n is bit n-1, the same as TubeBank masks
+    if len(payload) != mask_size(bank.count):
+        raise BadCommand('Bad request, invalid frame')
+
+    mask = int.from_bytes(payload, 'little')
+    if not mask or mask & ~bank.all:
+        raise BadCommand('Bad request, invalid tube id')
+    return mask
+
+
+def encode_status(state, count):
+    version, armed, loaded = state
+    return STATUS.pack(FORMAT_VERSION, ARMED if armed else 0, version & 0xffffffff, count) + encode_mask(loaded, count)
+
+
+def decode_status(payload):
+    version, flags, state, count = STATUS.unpack_from(payload)
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported frame version %d' % version)
+
+    mask = int.from_bytes(payload[STATUS.size:STATUS.size + mask_size(count)], 'little')
+    loaded = []
+    while mask:
+        low = mask & -mask
+        loaded.append(low.bit_length())
+        mask ^= low
+
+    return {
+        'version': state,
+        'armed': bool(flags & ARMED),
+        'count': count,
+        'loaded': loaded,
+    }
+
+
+def encode_tubes(ids, count):
+    return encode_mask(sum(1 << (i - 1) for i in ids), count)
+
+
+def decode_tubes(payload, bank):
+    return bank.ids(decode_mask(payload, bank))
+
+
+def encode_fire_at(ids, at, count):
+    return FIRE_AT.pack(at) + encode_tubes(ids, count)
+
+
+def decode_fire_at(payload, bank):
+    if len(payload) < FIRE_AT.size:
+        raise BadCommand('Bad request, invalid frame')
+    return decode_tubes(payload[FIRE_AT.size:], bank), FIRE_AT.unpack_from(payload)[0]
+
+
+# Directions and targets use the journal encodings: one byte of direction
+# bits, and a presence byte with both target counts.
+encode_directions = journal.encode_directions
+encode_targets = journal.encode_targets
+
+
+def decode_directions(payload):
+    if len(payload) != 1:
+        raise BadCommand('Bad request, invalid frame')
+    return journal.decode_directions(payload)
+
+
+def decode_targets(payload):
+    try:
+        return journal.decode_targets(payload)
+    except struct.error:
+        raise BadCommand('Bad request, invalid frame')
+
+
+def encode_job(job):
+    return JOB.pack(job._id)
+
+
+def decode_job(payload):
+    return JOB.unpack(payload)[0]
+
+
+def status_frame(prl):
+    # (version, etag, body) like LaunchingSystem.status; the ETag differs
+    # from the JSON one so a cache never mixes the two encodings up
+    state = prl.snapshot()
+    return state[0], '%s-%d-frame' % (prl.boot, state[0]), encode_status(state, prl.bank.count)
@@ -1,230 +1,260 @@
-import RPi.GPIO as GPIO
 import time
-import logging
-from ky040 import KY040Vertical, KY040Horizontal
+from ky040 import KY040
+from limits import LimitSwitches
+from backend import get_backend
+from pinmap import AXES, AXIS_DIRECTIONS, load_pin_map
+from pinlog import MessageLog, PinLog
+from sampler import InputSampler
+from watchdog import TravelWatchdog
+from metrics import REGISTRY, GPIO_BUCKETS
+
+GPIO_WRITE_SECONDS = REGISTRY.histogram('prl2016_gpio_write_seconds', 'Time spent in a GPIO output write.',
+                                        ('op',), GPIO_BUCKETS)
+GPIO_WRITE_HIGH = GPIO_WRITE_SECONDS.labels('high')
+GPIO_WRITE_LOW = GPIO_WRITE_SECONDS.labels('low')
+GPIO_WRITE_GROUP = GPIO_WRITE_SECONDS.labels('group')
 
 
 class GPIOHandler:
 
-    def __init__(self):
+    def __init__(self, backend=None, pins=None):
+        self.gpio = backend or get_backend()
+        self.pins = pins or load_pin_map()
         self.moving_up = False
         self.moving_down = False
         self.moving_ccw = False
         self.moving_cw = False
-        self.moving_up_time = 0
-        self.moving_up_start = 0
+        self.last_skew = 0.0
+        self.max_skew = 0.0
+        self.pin_log = PinLog()
+        self.log = MessageLog()
+        self.listeners = []
+        self.inputs = InputSampler(self.gpio, self.pins.inputs, [self.pins.switches[axis] for axis in AXES])
+        self.inputs.listeners.append(lambda previous, snapshot: self.changed())
+        self.encoder_vertical = KY040(self.gpio, *self.pins.encoders['vertical'], name='vertical')
+        self.encoder_horizontal = KY040(self.gpio, *self.pins.encoders['horizontal'], name='horizontal')
+        self.limit_switches = LimitSwitches(self)
+        self.watchdog = TravelWatchdog(self, self.TRAVEL_LIMITS)
 
     LAUNCH_WAIT_TIME = 1.5
-    RELAY_TEST_DELAY = 0.3
     SWITCH_REVERSE_MOVEMENT = 0.2
-    MOVING_UP_LIMIT = 1300
-
-    output_pins = {
-        'launch_1': 8,
-        'launch_2': 10,
-        'launch_3': 7,
-        'launch_4': 5,
-        'launch_5': 12,
-        'launch_6': 6,
-        'launch_7': 13,
-        'launch_8': 16,
-        'launch_9': 19,
-        'launch_10': 20,
-        'move_output_cw': 14,
-        # 'move_output_up2': 2, // fosok
-        # 'move_output_down': 3, // fosok
-        'move_output_ccw': 4,
-        # 'move_output_up': 24,
-        'move_output_up': 25,
-        'move_output_down': 9}
-        # 'move_output_down2': 10
-
-    input_pins = {
-        'move_input_hor_rotary_clk': 23,
-        'move_input_hor_rotary_data': 22,
-        'move_input_ver_rotary_clk': 17,
-        'move_input_ver_rotary_data': 18,
-        'move_input_ver_switch_down': 15,
-        'move_input_ver_switch_up': 26,
-        'move_input_hor_switch_left': 21,
-        'move_input_hor_switch_right': 27}
+    MOVING_UP_LIMIT = 1.3
+
+    # Longest time in seconds an axis output may stay high, None for no limit
+    TRAVEL_LIMITS = {
+        'up': MOVING_UP_LIMIT,
+        'down': MOVING_UP_LIMIT,
+        'cw': 30,
+        'ccw': 30,
+    }
 
     def gpio_init(self):
-        GPIO.setmode(GPIO.BCM)
+        self.pin_log.start()
+        self.log.start()
+        self.gpio.setmode(self.gpio.BCM)
+
+        for v in self.pins.idle_low:
+            self.gpio.setup(v, self.gpio.OUT)
+            self.gpio.output(v, self.gpio.LOW)
 
-        GPIO.setup(2, GPIO.OUT)
-        GPIO.output(2, GPIO.LOW)
+        for v in self.pins.outputs:
+            self.gpio.setup(v, self.gpio.OUT, initial=self.gpio.LOW)
 
-        for v in self.output_pins.values():
-            GPIO.setup(v, GPIO.OUT, initial=GPIO.LOW)
+        for v in self.pins.inputs:
+            self.gpio.setup(v, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
 
-        for v in self.input_pins.values():
-            GPIO.setup(v, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.inputs.start()
 
 
     def set_pin_high(self, pin):
-        GPIO.output(pin, GPIO.HIGH)
-        logging.info('Pin ' + str(pin) + ' on HIGH!')
+        start = time.monotonic()
+        self.gpio.output(pin, self.gpio.HIGH)
+        GPIO_WRITE_HIGH.observe(time.monotonic() - start)
+        self.pin_log.record(pin, self.gpio.HIGH)
+        self.changed()
 
     def set_pin_low(self, pin):
-        GPIO.output(pin, GPIO.LOW)
-        logging.info('Pin ' + str(pin) + ' on LOW!')
-
-    def launch(self, rockets):
-        for r in rockets:
-            self.set_pin_high(self.output_pins['launch_' + str(r)])
-
-        time.sleep(self.LAUNCH_WAIT_TIME)
+        start = time.monotonic()
+        self.gpio.output(pin, self.gpio.LOW)
+        GPIO_WRITE_LOW.observe(time.monotonic() - start)
+        self.pin_log.record(pin, self.gpio.LOW)
+        self.changed()
+
+    def set_pins_high(self, pins):
+        return self.set_pins(pins, self.gpio.HIGH)
+
+    def set_pins_low(self, pins):
+        return self.set_pins(pins, self.gpio.LOW)
+
+    def set_pins(self, pins, value):
+        # One backend call for the whole group; the time spent inside it is
+        # the upper bound of the skew between the first and the last pin.
+        pins = list(pins)
+        start = time.monotonic()
+        self.gpio.output(pins, value)
+        skew = time.monotonic() - start
+        GPIO_WRITE_GROUP.observe(skew)
+
+        self.last_skew = skew
+        self.max_skew = max(self.max_skew, skew)
+        self.pin_log.record(pins, value)
+        self.changed()
+        return skew
+
+    def changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def launch_sequence(self, rockets):
+        tubes = self.pins.tubes
+        pins = [tubes[r] for r in rockets]
+
+        skew = self.set_pins_high(pins)
+        try:
+            yield self.LAUNCH_WAIT_TIME
+        finally:
+            # Also when the job is cancelled mid-pulse
+            self.set_pins_low(pins)
 
-        for r in rockets:
-            self.set_pin_low(self.output_pins['launch_' + str(r)])
+        return {'skew_ms': skew * 1000}
 
-    def launch_all(self):
-        for pin in self.output_pins.values():
-            self.set_pin_high(pin)
+    def launch_all_sequence(self):
+        pins = self.pins.launch
 
-        time.sleep(self.LAUNCH_WAIT_TIME)
+        skew = self.set_pins_high(pins)
+        try:
+            yield self.LAUNCH_WAIT_TIME
+        finally:
+            self.set_pins_low(pins)
 
-        for pin in self.output_pins.values():
-            self.set_pin_low(pin)
+        self.log.info('All rockets launched!')
+        return {'skew_ms': skew * 1000}
 
-        logging.info('All rockets launched!')
+    # Both directions of an axis are never driven together: starting one
+    # direction cuts the opposite one first.
 
     def move_cw(self):
+        if self.moving_ccw:
+            self.stop_ccw()
         if not self.moving_cw and self.get_input_sw_right() == 0:
-            self.set_pin_high(self.output_pins['move_output_cw'])
-            # self.set_pin_high(self.output_pins['move_output_cw2'])
+            self.set_pin_high(self.pins.axes['cw'])
             self.moving_cw = True
+            self.watchdog.arm('cw')
 
     def move_ccw(self):
+        if self.moving_cw:
+            self.stop_cw()
         if not self.moving_ccw and self.get_input_sw_left() == 0:
-            self.set_pin_high(self.output_pins['move_output_ccw'])
-            # self.set_pin_high(self.output_pins['move_output_ccw2'])
+            self.set_pin_high(self.pins.axes['ccw'])
             self.moving_ccw = True
+            self.watchdog.arm('ccw')
 
     def move_up(self):
+        if self.moving_down:
+            self.stop_down()
         if not self.moving_up and self.get_input_sw_up() == 0:
-            self.set_pin_high(self.output_pins['move_output_up'])
-            # self.set_pin_high(self.output_pins['move_output_up2'])
+            self.set_pin_high(self.pins.axes['up'])
             self.moving_up = True
-            # self.moving_up_start = self.time_in_millis()
+            self.watchdog.arm('up')
 
     def move_down(self):
+        if self.moving_up:
+            self.stop_up()
         if not self.moving_down and self.get_input_sw_down() == 0:
-            self.set_pin_high(self.output_pins['move_output_down'])
-            # self.set_pin_high(self.output_pins['move_output_down2'])
+            self.set_pin_high(self.pins.axes['down'])
             self.moving_down = True
+            self.watchdog.arm('down')
 
     def stop_cw(self):
-        self.set_pin_low(self.output_pins['move_output_cw'])
-        # self.set_pin_low(self.output_pins['move_output_cw2'])
+        self.set_pin_low(self.pins.axes['cw'])
         self.moving_cw = False
+        self.watchdog.cancel('cw')
 
     def stop_ccw(self):
-        self.set_pin_low(self.output_pins['move_output_ccw'])
-        # self.set_pin_low(self.output_pins['move_output_ccw2'])
+        self.set_pin_low(self.pins.axes['ccw'])
         self.moving_ccw = False
+        self.watchdog.cancel('ccw')
 
     def stop_up(self):
-        self.set_pin_low(self.output_pins['move_output_up'])
-        # self.set_pin_low(self.output_pins['move_output_up2'])
+        self.set_pin_low(self.pins.axes['up'])
         self.moving_up = False
+        self.watchdog.cancel('up')
 
     def stop_down(self):
-        self.set_pin_low(self.output_pins['move_output_down'])
-        # self.set_pin_low(self.output_pins['move_output_down2'])
+        self.set_pin_low(self.pins.axes['down'])
         self.moving_down = False
+        self.watchdog.cancel('down')
+
+    def set_moving(self, directions, moving):
+        # For callers that drive the axis pins themselves, like the self-test,
+        # so the limit switches and the watchdog still cover those pins
+        for direction in directions:
+            setattr(self, 'moving_' + direction, moving)
+            if moving:
+                self.watchdog.arm(direction)
+            else:
+                self.watchdog.cancel(direction)
+
+    def axis_moving(self, axis):
+        return any(getattr(self, 'moving_' + d) for d in AXIS_DIRECTIONS[axis])
 
     def get_input_sw_down(self):
-        return GPIO.input(self.input_pins['move_input_ver_switch_down'])
+        return self.inputs.level(self.pins.switches['down'])
 
     def get_input_sw_up(self):
-        return GPIO.input(self.input_pins['move_input_ver_switch_up'])
+        return self.inputs.level(self.pins.switches['up'])
 
     def get_input_sw_left(self):
-        return GPIO.input(self.input_pins['move_input_hor_switch_left'])
+        return self.inputs.level(self.pins.switches['ccw'])
 
     def get_input_sw_right(self):
-        return GPIO.input(self.input_pins['move_input_hor_switch_right'])
+        return self.inputs.level(self.pins.switches['cw'])
+
+    def snapshot(self):
+        state = {
+            'gpio.moving_cw': self.moving_cw,
+            'gpio.moving_ccw': self.moving_ccw,
+            'gpio.moving_up': self.moving_up,
+            'gpio.moving_down': self.moving_down,
+            'switch.up': self.get_input_sw_up(),
+            'switch.down': self.get_input_sw_down(),
+            'switch.left': self.get_input_sw_left(),
+            'switch.right': self.get_input_sw_right(),
+            'encoder.vertical': self.encoder_vertical.turn,
+            'encoder.horizontal': self.encoder_horizontal.turn,
+        }
+
+        return state
 
     def emergency_stop(self):
-        self.set_pin_low(self.output_pins['move_output_cw'])
-        # self.set_pin_low(self.output_pins['move_output_cw2'])
-        self.set_pin_low(self.output_pins['move_output_ccw'])
-        # self.set_pin_low(self.output_pins['move_output_ccw2'])
-        self.set_pin_low(self.output_pins['move_output_up'])
-        # self.set_pin_low(self.output_pins['move_output_up2'])
-        self.set_pin_low(self.output_pins['move_output_down'])
-        # self.set_pin_low(self.output_pins['move_output_down2'])
+        self.set_pins_low(self.pins.motors)
         self.moving_cw = False
         self.moving_down = False
         self.moving_ccw = False
         self.moving_up = False
 
-    def check_limit_switches(self):
-        while True:
-            if self.moving_up and self.get_input_sw_up() == 1:
-                self.stop_up()
-                self.move_down()
-                time.sleep(self.SWITCH_REVERSE_MOVEMENT)
-                self.stop_down()
-
-            if self.moving_down and self.get_input_sw_down() == 1:
-                # self.moving_up_time = 0
-                self.stop_down()
-                self.move_up()
-                time.sleep(self.SWITCH_REVERSE_MOVEMENT)
-                self.stop_up()
-
-            if self.moving_ccw and self.get_input_sw_left() == 1:
-                self.stop_ccw()
-
-            if self.moving_cw and self.get_input_sw_right() == 1:
-                self.stop_cw()
-
-            time.sleep(0.1)
-
-    def rotary_encoder_vertical(self):
-        ky040 = KY040Vertical(self.input_pins['move_input_ver_rotary_clk'], self.input_pins['move_input_ver_rotary_data'])
-        ky040.start()
-
-        try:
-            while True:
-                time.sleep(0.1)
-        finally:
-            ky040.stop()
-            GPIO.cleanup()
-
-    def rotary_encoder_horizontal(self):
-        ky040 = KY040Horizontal(self.input_pins['move_input_hor_rotary_clk'], self.input_pins['move_input_hor_rotary_data'])
-        ky040.start()
+        for axis in self.TRAVEL_LIMITS:
+            self.watchdog.cancel(axis)
 
+    def check_limit_switches(self):
+        self.limit_switches.start()
         try:
-            while True:
-                time.sleep(0.1)
+            self.limit_switches.watchdog()
         finally:
-            ky040.stop()
-            GPIO.cleanup()
-
-    def moving_up_time_limit(self):
-        while True:
-            if self.moving_up:
-                self.moving_up_time = self.time_in_millis() - self.moving_up_start
+            self.limit_switches.stop()
 
-            if self.moving_up_time >= self.MOVING_UP_LIMIT:
-                self.stop_up()
+    def rotary_encoder_vertical(self):
+        self.encoder_vertical.start()
 
-            time.sleep(0.1)
+    def rotary_encoder_horizontal(self):
+        self.encoder_horizontal.start()
 
-    def relay_test(self):
-        for pin in self.output_pins:
-            self.set_pin_high(self.output_pins[pin])
-            time.sleep(self.RELAY_TEST_DELAY)
-            self.set_pin_low(self.output_pins[pin])
-            time.sleep(self.RELAY_TEST_DELAY)
+    def stop_encoders(self):
+        self.encoder_vertical.stop()
+        self.encoder_horizontal.stop()
 
     def gpio_cleanup(self):
-        GPIO.cleanup()
-
-    def time_in_millis(self):
-        return int(round(time.time() * 1000))
+        self.stop_encoders()
+        self.limit_switches.stop()
+        self.inputs.stop()
+        self.gpio.cleanup()
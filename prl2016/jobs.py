@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from threading import Condition, Thread
+
+
+class Job:
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, _id, name, sequence):
+        self._id = _id
+        self.name = name
+        self.sequence = sequence
+        self.state = self.PENDING
+        self.error = None
+        self.result = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    def serialize(self):
+        return {
+            'id': self._id,
+            'name': self.name,
+            'state': self.state,
+            'error': self.error,
+            'result': self.result,
+            'duration_ms': None if self.finished is None else (self.finished - self.started) * 1000,
+        }
+
+
+class JobExecutor:
+    # Runs job sequences on one timer thread. A sequence is a generator that
+    # yields the number of seconds to wait before it is resumed, so a pulse
+    # or a relay test never holds a request thread while it sleeps.
+    # Cancelling closes the generator on the runner, so its finally blocks
+    # release the hardware, and no step of it runs after the cancel.
+
+    MAX_FINISHED = 256
+
+    def __init__(self, runner=None):
+        self.runner = runner
+        self.cond = Condition()
+        self.queue = []
+        self.jobs = OrderedDict()
+        self.ids = itertools.count(1)
+        self.seq = itertools.count()
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, name, sequence):
+        with self.cond:
+            job = Job(next(self.ids), name, sequence)
+            self.jobs[job._id] = job
+            self.schedule(0, job)
+            self.cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def schedule(self, delay, job):
+        heapq.heappush(self.queue, (time.monotonic() + delay, next(self.seq), job))
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.cond.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, _, job = heapq.heappop(self.queue)
+
+            self.step(job)
+
+    def step(self, job):
+        with self.cond:
+            if job.state == Job.CANCELLED:
+                return
+            if job.state == Job.PENDING:
+                job.state = Job.RUNNING
+                job.started = time.monotonic()
+
+        try:
+            delay = self.runner(self.advance, job) if self.runner else self.advance(job)
+        except StopIteration as e:
+            job.result = e.value
+            self.finish(job, Job.DONE)
+        except Exception as e:
+            logging.exception('Job ' + job.name + ' failed')
+            job.error = str(e)
+            self.finish(job, Job.FAILED)
+        else:
+            with self.cond:
+                if job.state != Job.CANCELLED:
+                    self.schedule(delay or 0, job)
+
+    def advance(self, job):
+        # Checked on the runner, where cancel closes the sequence, so a step
+        # already queued there when the job is cancelled does nothing
+        if job.state == Job.CANCELLED:
+            return None
+        return next(job.sequence)
+
+    def cancel(self, job):
+        with self.cond:
+            if job.finished is not None or job.state == Job.CANCELLED:
+                return False
+            job.state = Job.CANCELLED
+            self.queue = [entry for entry in self.queue if entry[2] is not job]
+            heapq.heapify(self.queue)
+
+        try:
+            if self.runner:
+                self.runner(job.sequence.close)
+            else:
+                job.sequence.close()
+        finally:
+            self.finish(job, Job.CANCELLED)
+        return True
+
+    def active(self, names):
+        with self.cond:
+            return [j for j in self.jobs.values() if j.name in names and j.finished is None]
+
+    def cancel_all(self, names):
+        return [j for j in self.active(names) if self.cancel(j)]
+
+    def finish(self, job, state):
+        with self.cond:
+            if job.finished is not None or job.state == Job.CANCELLED and state != Job.CANCELLED:
+                return
+            job.finished = time.monotonic()
+            if job.started is None:
+                job.started = job.finished
+            job.state = state
+            job.sequence = None
+
+            finished = [j for j in self.jobs.values() if j.finished is not None]
+            for j in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+                del self.jobs[j._id]
@@ -0,0 +1,289 @@
+import glob
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+from backend import Backend
+
+
+ARM = 1
+DISARM = 2
+LOAD = 3
+FIRE = 4
+FIRE_ALL = 5
+MOVE_START = 6
+MOVE_STOP = 7
+EMERGENCY = 8
+MOVE_TO = 9
+PIN = 10
+INPUT = 11
+FIRE_AT = 12
+
+NAMES = {
+    ARM: 'arm',
+    DISARM: 'disarm',
+    LOAD: 'load',
+    FIRE: 'fire',
+    FIRE_ALL: 'fire_all',
+    MOVE_START: 'move_start',
+    MOVE_STOP: 'move_stop',
+    EMERGENCY: 'emergency',
+    MOVE_TO: 'move_to',
+    PIN: 'pin',
+    INPUT: 'input',
+    FIRE_AT: 'fire_at',
+}
+
+DIRECTIONS = ('cw', 'ccw', 'up', 'down')
+
+MAGIC = b'PRLJ'
+FORMAT_VERSION = 1
+
+# magic, format version, segment number, wall clock and monotonic time at creation
+SEGMENT_HEADER = struct.Struct('<4sHIdd')
+# monotonic time, record type, payload length
+RECORD_HEADER = struct.Struct('<dBH')
+
+
+def encode_ids(ids):
+    return struct.pack('<%dH' % len(ids), *ids)
+
+
+def decode_ids(payload):
+    return list(struct.unpack('<%dH' % (len(payload) // 2), payload))
+
+
+def encode_directions(directions):
+    return struct.pack('<B', sum(1 << i for i, d in enumerate(DIRECTIONS) if d in directions))
+
+
+def decode_directions(payload):
+    bits = struct.unpack('<B', payload)[0]
+    return [d for i, d in enumerate(DIRECTIONS) if bits >> i & 1]
+
+
+# move_to targets are journaled as signed 32 bit counts
+TARGET_MIN = -2 ** 31
+TARGET_MAX = 2 ** 31 - 1
+
+
+def encode_targets(targets):
+    present = ('horizontal' in targets) | ('vertical' in targets) << 1
+    return struct.pack('<Bii', present, targets.get('horizontal', 0), targets.get('vertical', 0))
+
+
+def decode_targets(payload):
+    present, horizontal, vertical = struct.unpack('<Bii', payload)
+    targets = {}
+    if present & 1:
+        targets['horizontal'] = horizontal
+    if present & 2:
+        targets['vertical'] = vertical
+    return targets
+
+
+def encode_fire_at(request):
+    return struct.pack('<d', request['at']) + encode_ids(request['tubes'])
+
+
+def decode_fire_at(payload):
+    return {'at': struct.unpack_from('<d', payload)[0], 'tubes': decode_ids(payload[8:])}
+
+
+def encode_pins(pins, value):
+    pins = pins if isinstance(pins, (list, tuple)) else [pins]
+    return struct.pack('<B%dB' % len(pins), value, *pins)
+
+
+def decode_pins(payload):
+    values = struct.unpack('<%dB' % len(payload), payload)
+    return list(values[1:]), values[0]
+
+
+DECODERS = {
+    LOAD: decode_ids,
+    FIRE: decode_ids,
+    MOVE_START: decode_directions,
+    MOVE_STOP: decode_directions,
+    MOVE_TO: decode_targets,
+    FIRE_AT: decode_fire_at,
+    PIN: decode_pins,
+    INPUT: lambda payload: struct.unpack('<BB', payload),
+}
+
+
+class Journal:
+    # Binary append-only journal written through a memory-mapped ring of
+    # fixed-size segment files. Appending a record is a struct pack and a
+    # copy into the mapping; the kernel writes the pages back, so records
+    # survive a crash of the process. Segments past SEGMENTS are deleted.
+
+    SEGMENT_SIZE = 4 * 1024 * 1024
+    SEGMENTS = 8
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, segments=SEGMENTS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments = segments
+        self.lock = Lock()
+        self.map = None
+        self.file = None
+        self.offset = 0
+        self.written = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        existing = segment_files(directory)
+        self.number = segment_number(existing[-1]) if existing else 0
+        self.roll()
+
+    def roll(self):
+        self.close()
+
+        self.number += 1
+        path = os.path.join(self.directory, 'journal-%08d.seg' % self.number)
+        self.file = open(path, 'w+b')
+        self.file.truncate(self.segment_size)
+        self.map = mmap.mmap(self.file.fileno(), self.segment_size)
+        self.map[:SEGMENT_HEADER.size] = SEGMENT_HEADER.pack(MAGIC, FORMAT_VERSION, self.number,
+                                                             time.time(), time.monotonic())
+        self.offset = SEGMENT_HEADER.size
+
+        for old in segment_files(self.directory)[:-self.segments]:
+            os.remove(old)
+
+    def append(self, kind, payload=b''):
+        size = RECORD_HEADER.size + len(payload)
+
+        with self.lock:
+            # Keep room for a zero header after the last record, it marks the end
+            if self.offset + size + RECORD_HEADER.size > self.segment_size:
+                self.roll()
+
+            RECORD_HEADER.pack_into(self.map, self.offset, time.monotonic(), kind, len(payload))
+            self.map[self.offset + RECORD_HEADER.size:self.offset + size] = payload
+            self.offset += size
+            self.written += 1
+
+    def command(self, kind, payload=b''):
+        self.append(kind, payload)
+
+    def pins(self, pins, value):
+        self.append(PIN, encode_pins(pins, value))
+
+    def input(self, pin, value):
+        self.append(INPUT, struct.pack('<BB', pin, value))
+
+    def flush(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
+
+    def serialize(self):
+        return {
+            'segment': self.number,
+            'offset': self.offset,
+            'records': self.written,
+        }
+
+
+def segment_files(directory):
+    return sorted(glob.glob(os.path.join(directory, 'journal-*.seg')))
+
+
+def segment_number(path):
+    return int(os.path.basename(path)[len('journal-'):-len('.seg')])
+
+
+def read_segment(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, number, wall, mono = SEGMENT_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a PRL2016 journal segment: ' + path)
+
+    offset = SEGMENT_HEADER.size
+    while offset + RECORD_HEADER.size <= len(data):
+        t, kind, length = RECORD_HEADER.unpack_from(data, offset)
+        if kind == 0:
+            break
+
+        payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+        decoder = DECODERS.get(kind)
+        yield t, kind, decoder(payload) if decoder else None
+        offset += RECORD_HEADER.size + length
+
+
+def read_journal(directory):
+    for path in segment_files(directory):
+        for record in read_segment(path):
+            yield record
+
+
+class RecordingBackend(Backend):
+    # Wraps another backend and journals every output write and every input
+    # change: edges with the level read when the edge is delivered, polled
+    # pins when a read returns a new level.
+
+    def __init__(self, backend, journal):
+        self.backend = backend
+        self.journal = journal
+        self.levels = {}
+
+        for name in ('BCM', 'OUT', 'IN', 'LOW', 'HIGH', 'PUD_DOWN', 'PUD_UP', 'RISING', 'FALLING', 'BOTH'):
+            setattr(self, name, getattr(backend, name))
+
+    def setmode(self, mode):
+        self.backend.setmode(mode)
+
+    def setup(self, channel, direction, initial=None, pull_up_down=None):
+        self.backend.setup(channel, direction, initial=initial, pull_up_down=pull_up_down)
+
+    def output(self, channel, value):
+        self.backend.output(channel, value)
+        self.journal.pins(channel, value)
+
+    def input(self, channel):
+        level = self.backend.input(channel)
+        if self.levels.get(channel) != level:
+            self.levels[channel] = level
+            self.journal.input(channel, level)
+        return level
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        # Both edges are watched so the journal also sees the releases a
+        # RISING-only consumer never asks for.
+        def recorded(pin):
+            level = self.backend.input(pin)
+            self.levels[pin] = level
+            self.journal.input(pin, level)
+
+            if callback is not None and (edge == self.BOTH or
+                                         edge == self.RISING and level == self.HIGH or
+                                         edge == self.FALLING and level == self.LOW):
+                callback(pin)
+
+        self.backend.add_event_detect(channel, self.BOTH, callback=recorded, bouncetime=bouncetime)
+
+    def remove_event_detect(self, channel):
+        self.backend.remove_event_detect(channel)
+
+    def cleanup(self):
+        self.backend.cleanup()
+        self.journal.flush()
+
+    def __getattr__(self, name):
+        # set_input, play, output_trace, ... of a simulated backend
+        return getattr(self.backend, name)
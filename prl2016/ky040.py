@@ -1,55 +1,109 @@
-import RPi.GPIO as GPIO
+import time
+from threading import Lock
 
 
-class KY040Vertical:
+class KY040:
+    # Quadrature decoder for a KY040 rotary encoder. Both edges of both
+    # channels are decoded through the Gray code transition table, so every
+    # quarter step is counted and contact bounce cancels itself out (+1 -1).
+    # Edges closer than GLITCH_FILTER to the previous accepted transition on
+    # the same channel are ignored; if that hides a real transition the next
+    # edge sees both channels changed and counts a missed transition.
 
     CLOCKWISE = 0
     ANTICLOCKWISE = 1
 
-    def __init__(self, clock_in, data_pin):
+    STEPS_PER_DETENT = 4
+    GLITCH_FILTER = 0.0005
+    RATE_WINDOW = 0.25
 
-        self.clockPin = clock_in
-        self.dataPin = data_pin
-
-        self.vertical_turn = 0
-
-    def start(self):
-        GPIO.add_event_detect(self.clockPin, GPIO.FALLING, callback=self.clock_callback, bouncetime=100)
-
-    def stop(self):
-        GPIO.remove_event_detect(self.clockPin)
+    INVALID = None
 
-    def clock_callback(self, pin):
-        if GPIO.input(self.clockPin) == 0:
-            data = GPIO.input(self.dataPin)
-            if data == 1:
-                self.vertical_turn += 1
-            else:
-                self.vertical_turn -= 1
+    # (previous state << 2) | new state, state = (clock << 1) | data
+    TRANSITIONS = [
+        0, -1, 1, INVALID,
+        1, 0, INVALID, -1,
+        -1, INVALID, 0, 1,
+        INVALID, 1, -1, 0,
+    ]
 
+    def __init__(self, gpio, clock_in, data_pin, name=None):
 
-class KY040Horizontal:
-
-    CLOCKWISE = 0
-    ANTICLOCKWISE = 1
-
-    def __init__(self, clock_in, data_pin):
-
+        self.gpio = gpio
         self.clockPin = clock_in
         self.dataPin = data_pin
+        self.name = name
+
+        self.lock = Lock()
+        self.state = 0
+        self.count = 0
+        self.missed = 0
+        self.glitches = 0
+        self.last_edge = {clock_in: 0.0, data_pin: 0.0}
 
-        self.horizontal_turn = 0
+        self.rate = 0.0
+        self.window_start = 0.0
+        self.window_count = 0
 
     def start(self):
-        GPIO.add_event_detect(self.clockPin, GPIO.FALLING, callback=self.clock_callback, bouncetime=100)
+        self.state = self.read_state()
+        self.window_start = time.monotonic()
+        self.gpio.add_event_detect(self.clockPin, self.gpio.BOTH, callback=self.edge_callback)
+        self.gpio.add_event_detect(self.dataPin, self.gpio.BOTH, callback=self.edge_callback)
 
     def stop(self):
-        GPIO.remove_event_detect(self.clockPin)
-
-    def clock_callback(self, pin):
-        if GPIO.input(self.clockPin) == 0:
-            data = GPIO.input(self.dataPin)
-            if data == 1:
-                self.horizontal_turn += 1
-            else:
-                self.horizontal_turn -= 1
\ No newline at end of file
+        self.gpio.remove_event_detect(self.clockPin)
+        self.gpio.remove_event_detect(self.dataPin)
+
+    def read_state(self):
+        return (self.gpio.input(self.clockPin) << 1) | self.gpio.input(self.dataPin)
+
+    def edge_callback(self, pin):
+        now = time.monotonic()
+        state = self.read_state()
+
+        with self.lock:
+            if now - self.last_edge[pin] < self.GLITCH_FILTER:
+                self.glitches += 1
+                return
+            self.last_edge[pin] = now
+
+            step = self.TRANSITIONS[(self.state << 2) | state]
+            self.state = state
+
+            if step is self.INVALID:
+                self.missed += 1
+            elif step:
+                self.count += step
+                self.window_count += 1
+
+            elapsed = now - self.window_start
+            if elapsed >= self.RATE_WINDOW:
+                self.rate = self.window_count / elapsed / self.STEPS_PER_DETENT
+                self.window_start = now
+                self.window_count = 0
+
+    @property
+    def turn(self):
+        return int(self.count / self.STEPS_PER_DETENT)
+
+    def step_rate(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.window_start
+            if elapsed >= 2 * self.RATE_WINDOW:
+                return self.window_count / elapsed / self.STEPS_PER_DETENT
+            return self.rate
+
+    def reset(self, count=0):
+        with self.lock:
+            self.count = count
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'turn': self.turn,
+            'count': self.count,
+            'rate': self.step_rate(),
+            'missed': self.missed,
+            'glitches': self.glitches,
+        }
@@ -0,0 +1,133 @@
+import json
+import time
+from threading import Lock
+
+
+class NotArmed(Exception):
+    pass
+
+
+class NotLoaded(Exception):
+    pass
+
+
+class TubeBank:
+    # Tube ids run from 1 to racks * tubes_per_rack; tube n is bit n-1 of an
+    # integer mask, so loading, fire validation and clearing are single set
+    # operations however many racks there are.
+
+    def __init__(self, racks=1, tubes_per_rack=10):
+        self.racks = racks
+        self.tubes_per_rack = tubes_per_rack
+        self.count = racks * tubes_per_rack
+        self.all = (1 << self.count) - 1
+
+    def mask(self, ids):
+        if not isinstance(ids, (list, tuple)):
+            raise ValueError('Tube ids must be a list')
+
+        mask = 0
+        for r in ids:
+            if not isinstance(r, int) or isinstance(r, bool) or r < 1 or r > self.count:
+                raise ValueError('Invalid tube id: ' + repr(r))
+            mask |= 1 << (r - 1)
+        return mask
+
+    def ids(self, mask):
+        ids = []
+        while mask:
+            low = mask & -mask
+            ids.append(low.bit_length())
+            mask ^= low
+        return ids
+
+    def rack(self, _id):
+        return (_id - 1) // self.tubes_per_rack + 1, (_id - 1) % self.tubes_per_rack + 1
+
+
+class LaunchingSystem:
+
+    def __init__(self, racks=1, tubes_per_rack=10):
+        self.bank = TubeBank(racks, tubes_per_rack)
+        self.lock = Lock()
+
+        # (version, armed, loaded mask), replaced as a whole under the lock so
+        # readers always get a consistent snapshot without locking. The
+        # version is bumped on every arm, disarm, load and fire; the boot id
+        # keeps the ETags of two server runs apart.
+        self.state = (0, False, 0)
+        self.boot = '%x' % int(time.time())
+        self.status_cache = None
+        self.listeners = []
+
+    def __str__(self):
+        return str(self.armed)
+
+    @property
+    def version(self):
+        return self.state[0]
+
+    @property
+    def armed(self):
+        return self.state[1]
+
+    @property
+    def loaded(self):
+        return self.state[2]
+
+    def snapshot(self):
+        return self.state
+
+    def serialize(self, state=None):
+        version, armed, loaded = state or self.state
+        return {
+            'armed': armed,
+            'tubes': [{'id': i + 1, 'loaded': bool(loaded >> i & 1)} for i in range(self.bank.count)],
+        }
+
+    def update(self, armed, loaded):
+        self.state = (self.state[0] + 1, armed, loaded)
+        for listener in self.listeners:
+            listener()
+
+    def restore(self, armed, loaded):
+        with self.lock:
+            self.update(armed, loaded & self.bank.all)
+
+    def arm(self):
+        with self.lock:
+            self.update(True, self.loaded)
+
+    def disarm(self):
+        with self.lock:
+            self.update(False, self.loaded)
+
+    def load(self, ids):
+        mask = self.bank.mask(ids)
+        with self.lock:
+            self.update(self.armed, self.loaded | mask)
+
+    def fire(self, ids):
+        mask = self.bank.mask(ids)
+        with self.lock:
+            version, armed, loaded = self.state
+            if not armed:
+                raise NotArmed('System is not armed!')
+            if mask & ~loaded:
+                raise NotLoaded('Some of the tubes are not loaded')
+            self.update(armed, loaded & ~mask)
+
+    def fire_all(self):
+        with self.lock:
+            if not self.armed:
+                raise NotArmed('System is not armed!')
+            self.update(True, 0)
+
+    def status(self):
+        state = self.state
+        cache = self.status_cache
+        if cache is None or cache[0] != state[0]:
+            cache = (state[0], self.boot + '-' + str(state[0]), json.dumps(self.serialize(state)).encode())
+            self.status_cache = cache
+
+        return cache
@@ -0,0 +1,109 @@
+import time
+from threading import Lock, Timer
+from metrics import REGISTRY
+
+LIMIT_REACTION_SECONDS = REGISTRY.histogram('prl2016_limit_switch_reaction_seconds',
+                                            'Time from a limit switch going high to the motor pin going low.',
+                                            ('axis', 'source'))
+
+
+class LimitSwitch:
+
+    def __init__(self, name, pin, is_moving, stop, reverse=None, stop_reverse=None):
+        self.name = name
+        self.pin = pin
+        self.is_moving = is_moving
+        self.stop = stop
+        self.reverse = reverse
+        self.stop_reverse = stop_reverse
+
+        self.lock = Lock()
+        self.trips = 0
+        self.watchdog_trips = 0
+        self.last_reaction = None
+        self.max_reaction = 0.0
+
+    def serialize(self):
+        return {
+            'axis': self.name,
+            'trips': self.trips,
+            'watchdog_trips': self.watchdog_trips,
+            'last_reaction_ms': None if self.last_reaction is None else self.last_reaction * 1000,
+            'max_reaction_ms': self.max_reaction * 1000,
+        }
+
+
+class LimitSwitches:
+
+    # Closing edges come from the debounced input snapshots; the watchdog
+    # catches a switch that was already closed when a movement started. It
+    # reads the pins itself, so it still works when the sampler has stalled.
+
+    WATCHDOG_INTERVAL = 0.5
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.inputs = handler.inputs
+        self.running = False
+        self.dispatch = lambda fn, *args: fn(*args)
+
+        h = handler
+        self.switches = [
+            LimitSwitch('up', h.pins.switches['up'],
+                        lambda: h.moving_up, h.stop_up, h.move_down, h.stop_down),
+            LimitSwitch('down', h.pins.switches['down'],
+                        lambda: h.moving_down, h.stop_down, h.move_up, h.stop_up),
+            LimitSwitch('ccw', h.pins.switches['ccw'],
+                        lambda: h.moving_ccw, h.stop_ccw),
+            LimitSwitch('cw', h.pins.switches['cw'],
+                        lambda: h.moving_cw, h.stop_cw),
+        ]
+
+    def start(self):
+        self.inputs.listeners.append(self.inputs_changed)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        if self.inputs_changed in self.inputs.listeners:
+            self.inputs.listeners.remove(self.inputs_changed)
+
+    def inputs_changed(self, previous, snapshot):
+        closed = snapshot.filtered & ~previous.filtered
+        for s in self.switches:
+            if closed >> s.pin & 1:
+                self.dispatch(self.trip, s, snapshot.rose[s.pin])
+
+    def trip(self, switch, detected, watchdog=False):
+        # Each axis has its own lock, so a switch on one axis never waits
+        # for the reverse movement of another one.
+        with switch.lock:
+            if not switch.is_moving():
+                return
+
+            switch.stop()
+            reaction = time.monotonic() - detected
+
+            switch.trips += 1
+            if watchdog:
+                switch.watchdog_trips += 1
+            switch.last_reaction = reaction
+            switch.max_reaction = max(switch.max_reaction, reaction)
+            LIMIT_REACTION_SECONDS.labels(switch.name, 'watchdog' if watchdog else 'edge').observe(reaction)
+
+            if switch.reverse is not None:
+                switch.reverse()
+                Timer(self.handler.SWITCH_REVERSE_MOVEMENT, self.dispatch, (switch.stop_reverse,)).start()
+
+        self.handler.log.info('Limit switch ' + switch.name + ' tripped, motor cut in %.3f ms' % (reaction * 1000))
+
+    def watchdog(self):
+        while self.running:
+            for s in self.switches:
+                if s.is_moving() and self.handler.gpio.input(s.pin):
+                    self.dispatch(self.trip, s, time.monotonic(), True)
+
+            time.sleep(self.WATCHDOG_INTERVAL)
+
+    def serialize(self):
+        return [s.serialize() for s in self.switches]
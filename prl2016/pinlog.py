@@ -0,0 +1,109 @@
+import logging
+import time
+import traceback
+from queue import Queue, Empty, Full
+from threading import Thread
+
+
+class PinLog:
+    # Pin transitions are queued as (monotonic time, pins, value) tuples and
+    # written by a background thread in batches, so a slow log file never
+    # stalls a GPIO write. When the buffer is full new records are dropped
+    # and counted instead of blocking the caller.
+
+    CAPACITY = 4096
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, logger=None, capacity=CAPACITY):
+        self.logger = logger or logging.getLogger('prl2016.pins')
+        self.queue = Queue(capacity)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.written = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def record(self, pins, value):
+        try:
+            self.queue.put_nowait((time.monotonic(), pins, value))
+        except Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.FLUSH_INTERVAL)]
+            except Empty:
+                continue
+
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                pass
+
+            self.write(batch)
+
+    def write(self, batch):
+        lines = ['%.6f %s %d' % (t, pins, value) for t, pins, value in batch]
+
+        dropped = self.dropped
+        if dropped != self.reported_dropped:
+            lines.append('dropped %d' % (dropped - self.reported_dropped))
+            self.reported_dropped = dropped
+
+        self.logger.info('\n'.join(lines))
+        self.written += len(batch)
+
+    def serialize(self):
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+
+class MessageLog:
+    # Log lines from the hardware actor and the timer threads go through a
+    # bounded queue to a background thread, like pin transitions, so a
+    # stalled log file never delays the next queued command, an emergency
+    # stop included. Lines that do not fit are dropped and counted.
+
+    CAPACITY = 1024
+
+    def __init__(self, capacity=CAPACITY):
+        self.queue = Queue(capacity)
+        self.dropped = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def log(self, level, message):
+        try:
+            self.queue.put_nowait((level, message))
+        except Full:
+            self.dropped += 1
+
+    def info(self, message):
+        self.log(logging.INFO, message)
+
+    def warning(self, message):
+        self.log(logging.WARNING, message)
+
+    def exception(self, message):
+        self.log(logging.ERROR, message + '\n' + traceback.format_exc().rstrip())
+
+    def run(self):
+        while True:
+            level, message = self.queue.get()
+            logging.log(level, message)
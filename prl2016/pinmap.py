@@ -0,0 +1,130 @@
+import json
+import os
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pins.json')
+
+AXES = ('cw', 'ccw', 'up', 'down')
+ENCODERS = ('vertical', 'horizontal')
+AXIS_DIRECTIONS = {'vertical': ('up', 'down'), 'horizontal': ('cw', 'ccw')}
+MAX_PIN = 27
+
+
+class PinMapError(ValueError):
+    pass
+
+
+class PinMap:
+    # A pin layout checked once at startup and compiled into lookup tables:
+    # tubes[n] is the pin of tube n, axes[axis] the channel (a pin, or a tuple
+    # of pins written as one group) driving an axis, launch the group of all
+    # tube pins. The motor relays are never part of the launch group.
+    # polarity[encoder] is the direction that makes its count go up.
+
+    def __init__(self, config):
+        errors = []
+        owners = {}
+
+        def claim(pin, role):
+            if not isinstance(pin, int) or isinstance(pin, bool) or pin < 0 or pin > MAX_PIN:
+                errors.append('%s: invalid pin %r' % (role, pin))
+            elif pin in owners:
+                errors.append('%s: pin %d is already used by %s' % (role, pin, owners[pin]))
+            else:
+                owners[pin] = role
+            return pin
+
+        def section(name, kind):
+            value = config.get(name)
+            if not isinstance(value, kind):
+                errors.append('%s: missing or not a %s' % (name, kind.__name__))
+                return kind()
+            return value
+
+        tubes = section('tubes', list)
+        axes = section('axes', dict)
+        switches = section('switches', dict)
+        encoders = section('encoders', dict)
+        idle_low = section('idle_low', list) if 'idle_low' in config else []
+        polarity = section('polarity', dict) if 'polarity' in config else {}
+
+        if not tubes:
+            errors.append('tubes: at least one tube is required')
+        self.tubes = [None] + [claim(pin, 'tube %d' % (i + 1)) for i, pin in enumerate(tubes)]
+
+        self.tubes_per_rack = config.get('tubes_per_rack', len(tubes))
+        if not isinstance(self.tubes_per_rack, int) or self.tubes_per_rack < 1 or len(tubes) % self.tubes_per_rack:
+            errors.append('tubes_per_rack: %r does not divide %d tubes' % (self.tubes_per_rack, len(tubes)))
+            self.tubes_per_rack = len(tubes) or 1
+        self.racks = len(tubes) // self.tubes_per_rack
+
+        self.axes = {}
+        for axis in AXES:
+            pins = axes.get(axis)
+            if not isinstance(pins, list) or not pins:
+                errors.append('axes.%s: expected a non-empty list of pins' % axis)
+                continue
+            pins = tuple(claim(pin, 'axis ' + axis) for pin in pins)
+            self.axes[axis] = pins[0] if len(pins) == 1 else pins
+
+        self.switches = {}
+        for axis in AXES:
+            if axis not in switches:
+                errors.append('switches.%s: missing' % axis)
+                continue
+            self.switches[axis] = claim(switches[axis], 'limit switch ' + axis)
+
+        self.encoders = {}
+        for name in ENCODERS:
+            pins = encoders.get(name)
+            if not isinstance(pins, list) or len(pins) != 2:
+                errors.append('encoders.%s: expected [clock, data]' % name)
+                continue
+            self.encoders[name] = tuple(claim(pin, 'encoder %s %s' % (name, role))
+                                        for pin, role in zip(pins, ('clock', 'data')))
+
+        self.idle_low = tuple(claim(pin, 'idle output') for pin in idle_low)
+
+        self.polarity = {}
+        for name in ENCODERS:
+            direction = polarity.get(name, AXIS_DIRECTIONS[name][0])
+            if direction not in AXIS_DIRECTIONS[name]:
+                errors.append('polarity.%s: expected one of %s' % (name, ', '.join(AXIS_DIRECTIONS[name])))
+            self.polarity[name] = direction
+
+        for name in set(config) - {'tubes', 'tubes_per_rack', 'axes', 'switches', 'encoders', 'idle_low', 'polarity'}:
+            errors.append('%s: unknown section' % name)
+        for name in set(axes) - set(AXES):
+            errors.append('axes.%s: unknown axis' % name)
+        for name in set(switches) - set(AXES):
+            errors.append('switches.%s: unknown axis' % name)
+        for name in set(polarity) - set(ENCODERS):
+            errors.append('polarity.%s: unknown encoder' % name)
+
+        if errors:
+            raise PinMapError('Invalid pin map: ' + '; '.join(sorted(errors)))
+
+        self.count = len(tubes)
+        self.launch = tuple(self.tubes[1:])
+        self.motors = tuple(pin for axis in AXES for pin in self.channel_pins(self.axes[axis]))
+        self.outputs = self.launch + self.motors
+        self.inputs = tuple(self.switches[axis] for axis in AXES) + \
+            tuple(pin for name in ENCODERS for pin in self.encoders[name])
+
+    @staticmethod
+    def channel_pins(channel):
+        return channel if isinstance(channel, tuple) else (channel,)
+
+
+def load_pin_map(path=None):
+    path = path or os.environ.get('PRL2016_PINS') or DEFAULT_PATH
+
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise PinMapError('Cannot read pin map ' + path + ': ' + str(e))
+
+    if not isinstance(config, dict):
+        raise PinMapError('Invalid pin map: ' + path + ' is not a JSON object')
+
+    return PinMap(config)
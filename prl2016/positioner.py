@@ -0,0 +1,161 @@
+import time
+
+from pinmap import AXIS_DIRECTIONS
+
+
+class Axis:
+
+    def __init__(self, name, encoder, forward, backward):
+        # forward/backward: (move, stop, is_moving) of the output that makes
+        # the encoder count up/down, as set by the pin map polarity
+        self.name = name
+        self.encoder = encoder
+        self.forward = forward
+        self.backward = backward
+
+
+class AxisController:
+
+    def __init__(self, axis, target, positioner):
+        self.axis = axis
+        self.p = positioner
+        self.target = target * axis.encoder.STEPS_PER_DETENT
+        self.best = abs(self.error())
+        self.start = time.monotonic()
+        self.output = None
+        self.pulse_until = None
+        self.rest_until = None
+        self.settle_until = None
+        self.finished = None
+        self.reason = None
+
+    def error(self):
+        return self.target - self.axis.encoder.count
+
+    def drive(self, output):
+        if self.output is not None and self.output is not output:
+            self.release()
+
+        move, stop, is_moving = output
+        if not is_moving():
+            move()
+            if not is_moving():
+                return False
+        self.output = output
+        return True
+
+    def release(self):
+        if self.output is not None:
+            self.output[1]()
+            self.output = None
+
+    def abort(self, reason, now):
+        self.release()
+        self.reason = reason
+        self.settle_until = now + self.p.SETTLE_TIME
+
+    def update(self, now):
+        if self.finished is not None:
+            return
+
+        if self.settle_until is not None:
+            if now >= self.settle_until:
+                self.finished = now
+            return
+
+        if self.output is not None and not self.output[2]():
+            # Cut by a limit switch, /move/stop or an emergency stop
+            self.output = None
+            return self.abort('interrupted', now)
+
+        if now - self.start > self.p.TIMEOUT:
+            return self.abort('timeout', now)
+
+        error = self.error()
+        if abs(error) <= self.p.TOLERANCE:
+            return self.abort('reached', now)
+
+        # Driving away from the target: wrong polarity, a slipping encoder
+        # or a reversed motor. Stop before the limit switch has to.
+        self.best = min(self.best, abs(error))
+        if abs(error) > self.best + self.p.RUNAWAY:
+            return self.abort('runaway', now)
+
+        output = self.axis.forward if error > 0 else self.axis.backward
+
+        if abs(error) > self.p.SLOW_ZONE:
+            self.pulse_until = None
+            if not self.drive(output):
+                return self.abort('limit', now)
+            return
+
+        # Close to the target the output is pulsed, so the turret creeps in
+        # instead of coasting past it.
+        if self.pulse_until is not None:
+            if now >= self.pulse_until:
+                self.release()
+                self.pulse_until = None
+                self.rest_until = now + self.p.PULSE_OFF
+            return
+
+        if self.rest_until is not None and now < self.rest_until:
+            return
+
+        if not self.drive(output):
+            return self.abort('limit', now)
+        self.pulse_until = now + self.p.PULSE_ON
+
+    def serialize(self):
+        steps = self.axis.encoder.STEPS_PER_DETENT
+        return {
+            'axis': self.axis.name,
+            'target': self.target / steps,
+            'position': self.axis.encoder.count / float(steps),
+            'error': self.error() / float(steps),
+            'reason': self.reason,
+            'settling_ms': None if self.finished is None else (self.finished - self.start) * 1000,
+        }
+
+
+class Positioner:
+
+    TICK = 0.005
+    TOLERANCE = 1
+    SLOW_ZONE = 8
+    PULSE_ON = 0.02
+    PULSE_OFF = 0.04
+    SETTLE_TIME = 0.1
+    TIMEOUT = 30
+    # Counts the error may grow past the closest approach before aborting
+    RUNAWAY = 16
+
+    def __init__(self, handler):
+        h = handler
+        outputs = {
+            'cw': (h.move_cw, h.stop_cw, lambda: h.moving_cw),
+            'ccw': (h.move_ccw, h.stop_ccw, lambda: h.moving_ccw),
+            'up': (h.move_up, h.stop_up, lambda: h.moving_up),
+            'down': (h.move_down, h.stop_down, lambda: h.moving_down),
+        }
+        encoders = {'horizontal': h.encoder_horizontal, 'vertical': h.encoder_vertical}
+
+        self.axes = {}
+        for name, directions in AXIS_DIRECTIONS.items():
+            up = h.pins.polarity[name]
+            down = directions[1] if up == directions[0] else directions[0]
+            self.axes[name] = Axis(name, encoders[name], outputs[up], outputs[down])
+
+    def move_to_sequence(self, targets):
+        controllers = [AxisController(self.axes[name], target, self) for name, target in sorted(targets.items())]
+
+        try:
+            while any(c.finished is None for c in controllers):
+                now = time.monotonic()
+                for c in controllers:
+                    c.update(now)
+                yield self.TICK
+        finally:
+            for c in controllers:
+                c.release()
+
+        return dict((c.axis.name, c.serialize()) for c in controllers)
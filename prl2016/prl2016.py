@@ -1,58 +1,55 @@
 import logging
 import time
-from gpio import GPIOHandler
-from flask import Flask, jsonify, request
-from threading import Thread
+import frames
+from engine import Engine, BadCommand
+from launcher import NotArmed, NotLoaded
+from metrics import REGISTRY
+from show import compile_show, start_show
+from flask import Flask, Response, g, jsonify, request
 
-MOVEMENT_TEST_DELAY = 1
+REQUEST_SECONDS = REGISTRY.histogram('prl2016_request_seconds', 'Request latency of the /launch and /move routes.',
+                                     ('route', 'method', 'status'))
 
+engine = Engine()
+app = Flask(__name__)
 
-class Tube:
 
-    def __init__(self, _id):
-        self.loaded = False
-        self._id = _id
+def init_hardware(backend=None, journal_dir=None, input_rate=None, state_path=None):
+    return engine.start(backend, journal_dir, input_rate, state_path)
 
-    def __str__(self):
-        return str(self.loaded) + str(self._id)
 
-    def serialize(self):
-        return {
-            'id': self._id,
-            'loaded': self.loaded,
-        }
+@app.errorhandler(BadCommand)
+def bad_command(e):
+    return str(e), 400
 
 
-class LaunchingSystem:
+@app.errorhandler(NotArmed)
+@app.errorhandler(NotLoaded)
+def not_ready(e):
+    return str(e), 403
 
-    def __init__(self):
-        self.armed = False
-        self.tubes = []
 
-        for i in range(1, 11):
-            self.tubes.append(Tube(i))
+@app.before_request
+def start_timer():
+    g.start = time.monotonic()
 
-    def __str__(self):
-        return str(self.armed)
 
-    def serialize(self):
-        return {
-            'armed': self.armed,
-            'tubes': [t.serialize() for t in self.tubes],
-        }
+@app.after_request
+def observe_latency(response):
+    rule = request.url_rule
+    if rule is not None and (rule.rule.startswith('/launch/') or rule.rule.startswith('/move/')):
+        REQUEST_SECONDS.labels(rule.rule, request.method, response.status_code).observe(time.monotonic() - g.start)
+    return response
 
 
-class Movement:
-    def __init__(self):
-        self.moving_ccw = False
-        self.moving_cw = False
-        self.moving_up = False
-        self.moving_down = False
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 
-prl = LaunchingSystem()
-movement = Movement()
-app = Flask(__name__)
+@app.route('/time', methods=['GET'])
+def server_time():
+    return jsonify({'time': time.time()}), 200
 
 
 @app.route('/')
@@ -63,206 +60,248 @@ def index():
 
 @app.route('/launch/arm', methods=['POST'])
 def arm():
-    logging.info('ARM')
-    prl.armed = True
+    engine.arm()
     return "System armed", 200
 
 
 @app.route('/launch/disarm', methods=['POST'])
 def disarm():
-    logging.info('DISARM')
-    prl.armed = False
+    engine.disarm()
     return "System disarmed", 200
 
 
 @app.route('/launch/status', methods=['GET'])
 def status():
-    return jsonify(prl.serialize()), 200
+    if wants_frame():
+        version, etag, body = frames.status_frame(engine.prl)
+        mimetype = frames.MIME_TYPE
+    else:
+        version, etag, body = engine.status()
+        mimetype = 'application/json'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+@app.route('/launch/store', methods=['GET'])
+def state_store():
+    if engine.store is None:
+        return "State is not persisted", 404
+
+    return jsonify(engine.store.serialize()), 200
+
+
+@app.route('/events', methods=['GET'])
+def event_stream():
+    events = engine.events
+    sub = events.subscribe()
+    if sub is None:
+        return "Too many event streams", 503
+
+    response = Response(events.stream(sub), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/launch/load', methods=['POST'])
 def load_tubes():
-    if not request.json:
+    tubes = command_body(frames.decode_tubes, engine.prl.bank)
+    if not tubes:
         return "No JSON received.", 400
 
-    for r in request.json:
-        prl.tubes[r-1].loaded = True
-
+    engine.load(tubes)
     return "Tube(s) loaded", 200
 
 
 @app.route('/launch/fire', methods=['POST'])
 def fire():
-    if not request.json:
+    tubes = command_body(frames.decode_tubes, engine.prl.bank)
+    if not tubes:
         return "No JSON received.", 400
-    elif not prl.armed:
-        return "System is not armed!", 403
-    else:
-        for r in request.json:
-            if not prl.tubes[r-1].loaded:
-                return "Some of the tubes are not loaded", 403
 
-        for r in request.json:
-            prl.tubes[r-1].loaded = False
+    return job_accepted(engine.fire(tubes))
 
-        gpioHandler.launch(request.json)
 
-    return "Given rockets launched", 200
+@app.route('/launch/fire/at', methods=['POST'])
+def fire_at():
+    if request.mimetype == frames.MIME_TYPE:
+        tubes, at = frames.decode_fire_at(request.get_data(), engine.prl.bank)
+        return job_accepted(engine.fire_at(tubes, at))
+
+    if not request.json:
+        return "No JSON received.", 400
+
+    if not isinstance(request.json, dict) or 'tubes' not in request.json or 'at' not in request.json:
+        return "Bad request, invalid json", 400
+
+    return job_accepted(engine.fire_at(request.json['tubes'], request.json['at']))
 
 
 @app.route('/launch/fire/all', methods=['POST'])
 def fire_all():
-    if not prl.armed:
-        return "System is not armed!", 403
-    else:
-        gpioHandler.launch_all()
+    return job_accepted(engine.fire_all())
 
-    return "All rockets launched!", 200
 
+@app.route('/batch', methods=['POST'])
+def batch():
+    if not request.json:
+        return "No JSON received.", 400
 
-@app.route('/test', methods=['GET'])
-def _relay_test():
-    gpioHandler.relay_test()
-    return "Test finished", 200
+    return jsonify(engine.batch(request.json)), 200
 
 
-@app.route('/move/start', methods=['POST'])
-def start_movement():
+@app.route('/show/validate', methods=['POST'])
+def validate_show():
     if not request.json:
         return "No JSON received.", 400
 
-    if len(request.json) < 1 or len(request.json) > 2:
-        return "Bad request, invalid json", 400
+    return jsonify(compile_show(request.json, engine).serialize()), 200
 
-    if 'cw' in request.json and 'ccw' in request.json:
-        return "Bad request, opposite directions", 400
-
-    if 'up' in request.json and 'down' in request.json:
-        return "Bad request, opposite directions", 400
-
-    if 'cw' in request.json:
-        if movement.moving_ccw:
-            gpioHandler.stop_ccw()
-            movement.moving_ccw = False
-        gpioHandler.move_cw()
-        movement.moving_cw = True
-
-    if 'ccw' in request.json:
-        if movement.moving_cw:
-            gpioHandler.stop_cw()
-            movement.moving_cw = False
-        gpioHandler.move_ccw()
-        movement.moving_ccw = True
-
-    if 'up' in request.json:
-        if movement.moving_down:
-            gpioHandler.stop_down()
-            movement.moving_down = False
-        gpioHandler.move_up()
-        movement.moving_up = True
-
-    if 'down' in request.json:
-        if movement.moving_up:
-            gpioHandler.stop_up()
-            movement.moving_up = False
-        gpioHandler.move_down()
-        movement.moving_down = True
 
-    return "Moving in given direction", 200
+@app.route('/show', methods=['POST'])
+def run_show():
+    if not request.json:
+        return "No JSON received.", 400
 
+    response = jsonify(start_show(engine, request.json).serialize())
+    response.headers['Location'] = '/show'
+    return response, 202
 
-@app.route('/move/stop', methods=['POST'])
-def stop_movement():
-    if not request.json:
+
+@app.route('/show', methods=['GET'])
+def show_status():
+    if engine.show is None:
+        return "No show has run", 404
+
+    return jsonify(engine.show.serialize()), 200
+
+
+@app.route('/show/stop', methods=['POST'])
+def stop_show():
+    engine.emergency_stop()
+    return "Show stopped", 200
+
+
+@app.route('/move/to', methods=['POST'])
+def move_to():
+    targets = command_body(frames.decode_targets)
+    if not targets:
         return "No JSON received.", 400
 
-    if len(request.json) < 1 or len(request.json) > 2:
-        return "Bad request, invalid json", 400
+    return job_accepted(engine.move_to(targets))
+
+
+@app.route('/move/position', methods=['GET'])
+def position():
+    return jsonify({
+        'vertical': engine.handler.encoder_vertical.serialize(),
+        'horizontal': engine.handler.encoder_horizontal.serialize(),
+    }), 200
 
-    if 'cw' in request.json and 'ccw' in request.json:
-        return "Bad request, opposite directions", 400
 
-    if 'up' in request.json and 'down' in request.json:
-        return "Bad request, opposite directions", 400
+@app.route('/move/actor', methods=['GET'])
+def actor_status():
+    return jsonify(engine.actor.serialize()), 200
+
+
+@app.route('/move/watchdog', methods=['GET'])
+def travel_watchdog():
+    return jsonify(engine.handler.watchdog.serialize()), 200
+
+
+@app.route('/move/inputs', methods=['GET'])
+def input_sampler():
+    return jsonify(engine.handler.inputs.serialize()), 200
+
+
+@app.route('/move/limits', methods=['GET'])
+def limit_switches():
+    return jsonify(engine.handler.limit_switches.serialize()), 200
+
+
+@app.route('/test', methods=['GET'])
+def self_test():
+    return job_accepted(engine.self_test(request.args.get('launch') == '1'))
 
-    if 'cw' in request.json:
-        gpioHandler.stop_cw()
-        movement.moving_cw = False
 
-    if 'ccw' in request.json:
-        gpioHandler.stop_ccw()
-        movement.moving_ccw = False
+@app.route('/test/report', methods=['GET'])
+def self_test_report():
+    report = engine.selftest.serialize()
+    if report is None:
+        return "No self-test has run", 404
 
-    if 'up' in request.json:
-        gpioHandler.stop_up()
-        movement.moving_up = False
+    return jsonify(report), 200
 
-    if 'down' in request.json:
-        gpioHandler.stop_down()
-        movement.moving_down = False
 
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = engine.jobs.get(job_id)
+    if job is None:
+        return "No such job", 404
+
+    return jsonify(job.serialize()), 200
+
+
+@app.route('/move/start', methods=['POST'])
+def start_movement():
+    directions = command_body(frames.decode_directions)
+    if not directions:
+        return "No JSON received.", 400
+
+    engine.move_start(directions)
+    return "Moving in given direction", 200
+
+
+@app.route('/move/stop', methods=['POST'])
+def stop_movement():
+    directions = command_body(frames.decode_directions)
+    if not directions:
+        return "No JSON received.", 400
+
+    engine.move_stop(directions)
     return "Moving in given direction", 200
 
 
 @app.route('/move/emergency', methods=['GET'])
 def emergency_stop():
-    gpioHandler.emergency_stop()
-    movement.moving_cw = False
-    movement.moving_ccw = False
-    movement.moving_down = False
-    movement.moving_up = False
-
+    engine.emergency_stop()
     return "Emergency eliminated", 200
 
 
 @app.route('/move/test', methods=['POST'])
 def test_movement():
-    gpioHandler.move_up()
-    time.sleep(MOVEMENT_TEST_DELAY)
-    gpioHandler.stop_up()
+    return job_accepted(engine.movement_test())
 
-    gpioHandler.move_down()
-    time.sleep(MOVEMENT_TEST_DELAY)
-    gpioHandler.stop_down()
 
-    gpioHandler.move_ccw()
-    time.sleep(MOVEMENT_TEST_DELAY)
-    gpioHandler.stop_ccw()
+def command_body(decode, *args):
+    # A command body is JSON unless the client sent a binary frame
+    if request.mimetype == frames.MIME_TYPE:
+        return decode(request.get_data(), *args)
+    return request.json
 
-    gpioHandler.move_cw()
-    time.sleep(MOVEMENT_TEST_DELAY*2)
-    gpioHandler.stop_cw()
 
-    gpioHandler.move_ccw()
-    time.sleep(MOVEMENT_TEST_DELAY)
-    gpioHandler.stop_ccw()
+def wants_frame():
+    # JSON wins unless the client prefers frames, */* included
+    return request.accept_mimetypes.best_match(('application/json', frames.MIME_TYPE)) == frames.MIME_TYPE
 
-    return "Movement test finished", 200
+
+def job_accepted(job):
+    if wants_frame():
+        response = Response(frames.encode_job(job), mimetype=frames.MIME_TYPE)
+    else:
+        response = jsonify(job.serialize())
+    response.headers['Location'] = '/jobs/' + str(job._id)
+    return response, 202
 
 ########### APP #############
 
 if __name__ == '__main__':
-    logging.basicConfig(filename='prl2016.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-    gpioHandler = GPIOHandler()
-    gpioHandler.gpio_init()
-
-    t1 = Thread(target=gpioHandler.check_limit_switches)
-    t1.daemon = True
-    t1.start()
-
-    # t2 = Thread(target=gpioHandler.moving_up_time_limit)
-    # t2.daemon = True
-    # t2.start()
-
-    # t2 = Thread(target=gpioHandler.rotary_encoder_horizontal)
-    # t2.daemon = True
-    #
-    # t3 = Thread(target=gpioHandler.rotary_encoder_vertical)
-    # t3.daemon = True
-
-    try:
-        app.run(debug=True, host='0.0.0.0', port=8000)
-    except KeyboardInterrupt:
-        print "Interrupt received, stopping..."
-        gpioHandler.gpio_init()
-        gpioHandler.gpio_cleanup()
+    from server import main
+    main()
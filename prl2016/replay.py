@@ -0,0 +1,125 @@
+import argparse
+import json
+import time
+
+import journal
+import prl2016
+from backend import SimulatedBackend
+
+REQUESTS = {
+    journal.ARM: ('POST', '/launch/arm'),
+    journal.DISARM: ('POST', '/launch/disarm'),
+    journal.LOAD: ('POST', '/launch/load'),
+    journal.FIRE: ('POST', '/launch/fire'),
+    journal.FIRE_ALL: ('POST', '/launch/fire/all'),
+    journal.MOVE_START: ('POST', '/move/start'),
+    journal.MOVE_STOP: ('POST', '/move/stop'),
+    journal.EMERGENCY: ('GET', '/move/emergency'),
+    journal.MOVE_TO: ('POST', '/move/to'),
+    journal.FIRE_AT: ('POST', '/launch/fire/at'),
+}
+
+SETTLE_TIMEOUT = 10
+
+
+def expand_pins(pins, value):
+    return [(pin, value) for pin in pins]
+
+
+def replay(directory, speed=1.0):
+    # Feeds a journal back through the real Flask routes on the simulated
+    # backend: commands become requests, input records become input edges.
+    # speed scales the recorded gaps, 0 replays as fast as possible.
+    records = list(journal.read_journal(directory))
+    if not records:
+        return {'records': 0}
+
+    sim = SimulatedBackend()
+    prl2016.init_hardware(sim)
+    client = prl2016.app.test_client()
+
+    recorded = []
+    latencies = {}
+    statuses = {}
+    first = records[0][0]
+    previous = first
+    start = time.monotonic()
+
+    for t, kind, data in records:
+        if kind == journal.PIN:
+            recorded.extend(expand_pins(*data))
+            continue
+
+        # A new server run starts a new monotonic timeline; replay it
+        # straight after the previous record.
+        if t < previous:
+            first += t - previous
+        previous = t
+
+        if speed > 0:
+            delay = start + (t - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        if kind == journal.INPUT:
+            sim.set_input(*data)
+            continue
+
+        method, path = REQUESTS[kind]
+        sent = time.monotonic()
+        if data is None:
+            response = client.open(path, method=method)
+        else:
+            response = client.open(path, method=method, json=data)
+        name = journal.NAMES[kind]
+        latencies.setdefault(name, []).append(time.monotonic() - sent)
+        statuses.setdefault(name, []).append(response.status_code)
+
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while (prl2016.engine.jobs.queue or prl2016.engine.actor.queue.qsize()) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    replayed = [(pin, value) for _, pin, value in sim.output_trace()]
+    divergence = None
+    for i, (a, b) in enumerate(zip(recorded, replayed)):
+        if a != b:
+            divergence = i
+            break
+    if divergence is None and len(recorded) != len(replayed):
+        divergence = min(len(recorded), len(replayed))
+
+    return {
+        'records': len(records),
+        'duration_s': time.monotonic() - start,
+        'outputs_recorded': len(recorded),
+        'outputs_replayed': len(replayed),
+        'first_divergence': divergence,
+        'commands': dict((name, {
+            'count': len(values),
+            'statuses': sorted(set(statuses[name])),
+            'mean_ms': sum(values) / len(values) * 1000,
+            'max_ms': max(values) * 1000,
+        }) for name, values in latencies.items()),
+    }
+
+
+def dump(directory):
+    for t, kind, data in journal.read_journal(directory):
+        print('%.6f %s %s' % (t, journal.NAMES.get(kind, kind), json.dumps(data)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a PRL2016 journal on the simulated GPIO backend')
+    parser.add_argument('directory')
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale, 0 for as fast as possible')
+    parser.add_argument('--dump', action='store_true', help='print the records instead of replaying them')
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        dump(args.directory)
+    else:
+        print(json.dumps(replay(args.directory, args.speed), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import itertools
+import logging
+import time
+from collections import deque, namedtuple
+from threading import Event, Thread
+
+# raw and filtered are bitmasks indexed by BCM pin number; filtered has the
+# limit switches debounced and every other input as sampled. rose maps each
+# closed switch pin to the time of the first raw high sample behind its
+# closing, so a reaction time includes the debounce delay.
+InputSnapshot = namedtuple('InputSnapshot', ('seq', 'time', 'raw', 'filtered', 'rose'))
+
+
+class InputSampler:
+    # Reads every input pin in one pass on its own thread and publishes the
+    # result as an immutable snapshot, so the limit switches, the movement
+    # checks and the event stream share one consistent view of the inputs
+    # instead of each reading pins on its own. A limit switch counts as
+    # closed when it is high in the majority of the last SWITCH_WINDOW
+    # passes. Listeners are called on the sampler thread with the previous
+    # and the new snapshot whenever the filtered inputs change. While the
+    # sampler runs, a snapshot older than STALE_PASSES intervals means the
+    # thread stalled, and level() reads the pin itself rather than trust it.
+
+    RATE = 1000
+    SWITCH_WINDOW = 5
+    STALE_PASSES = 20
+
+    def __init__(self, gpio, pins, switches, rate=RATE, window=SWITCH_WINDOW):
+        self.gpio = gpio
+        self.pins = tuple(pins)
+        self.switches = tuple(switches)
+        self.switch_mask = sum(1 << pin for pin in self.switches)
+        self.interval = 1.0 / rate
+        self.window = deque(maxlen=window)
+        self.times = deque(maxlen=window)
+        self.seq = itertools.count(1)
+        self.listeners = []
+        self.stopped = Event()
+        self.thread = None
+
+        self.snapshot = InputSnapshot(0, time.monotonic(), 0, 0, {})
+        self.passes = 0
+        self.last_pass = 0.0
+        self.max_pass = 0.0
+        self.overruns = 0
+        self.errors = 0
+        self.stale_reads = 0
+
+    def start(self):
+        # One synchronous pass, the snapshot is valid before start returns.
+        # The window is primed with it so a switch already closed at start
+        # reads closed instead of waiting for the majority to build up.
+        self.window.extend([self.read()] * self.window.maxlen)
+        self.times.extend([time.monotonic()] * self.times.maxlen)
+        self.sample()
+
+        self.stopped.clear()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def read(self):
+        raw = 0
+        for pin in self.pins:
+            if self.gpio.input(pin):
+                raw |= 1 << pin
+        return raw
+
+    def sample(self):
+        start = time.monotonic()
+        raw = self.read()
+        self.window.append(raw)
+        self.times.append(start)
+
+        filtered = raw & ~self.switch_mask
+        half = len(self.window) // 2
+        for pin in self.switches:
+            if sum(s >> pin & 1 for s in self.window) > half:
+                filtered |= 1 << pin
+
+        previous = self.snapshot
+        rose = previous.rose
+        if (filtered ^ previous.filtered) & self.switch_mask:
+            rose = {}
+            for pin in self.switches:
+                if filtered >> pin & 1:
+                    rose[pin] = previous.rose[pin] if previous.filtered >> pin & 1 else self.first_high(pin)
+
+        snapshot = InputSnapshot(next(self.seq), start, raw, filtered, rose)
+        self.snapshot = snapshot
+
+        elapsed = time.monotonic() - start
+        self.passes += 1
+        self.last_pass = elapsed
+        self.max_pass = max(self.max_pass, elapsed)
+
+        if filtered != previous.filtered:
+            for listener in self.listeners:
+                listener(previous, snapshot)
+
+    def first_high(self, pin):
+        return next(t for t, raw in zip(self.times, self.window) if raw >> pin & 1)
+
+    def run(self):
+        due = time.monotonic()
+        failing = False
+        while not self.stopped.is_set():
+            try:
+                self.sample()
+                failing = False
+            except Exception:
+                # Logged once per run of failures, the loop must keep going
+                self.errors += 1
+                if not failing:
+                    logging.exception('Input sampling failed')
+                failing = True
+
+            due += self.interval
+            delay = due - time.monotonic()
+            if delay > 0:
+                self.stopped.wait(delay)
+            else:
+                self.overruns += 1
+                due = time.monotonic()
+
+    def level(self, pin):
+        snapshot = self.snapshot
+        if not self.stopped.is_set() and time.monotonic() - snapshot.time > self.STALE_PASSES * self.interval:
+            self.stale_reads += 1
+            return 1 if self.gpio.input(pin) else 0
+        return snapshot.filtered >> pin & 1
+
+    def serialize(self):
+        snapshot = self.snapshot
+        return {
+            'seq': snapshot.seq,
+            'age_ms': (time.monotonic() - snapshot.time) * 1000,
+            'levels': dict((str(pin), snapshot.filtered >> pin & 1) for pin in self.pins),
+            'rate': 1.0 / self.interval,
+            'passes': self.passes,
+            'last_pass_ms': self.last_pass * 1000,
+            'max_pass_ms': self.max_pass * 1000,
+            'overruns': self.overruns,
+            'errors': self.errors,
+            'stale_reads': self.stale_reads,
+        }
@@ -0,0 +1,146 @@
+import time
+from pinmap import AXES, ENCODERS, PinMap
+
+
+class SelfTest:
+    # Pre-show check of the relays and the input lines, run as a job so it
+    # never holds a request. Outputs are pulsed in groups that may be on
+    # together, never both directions of one axis, and read back while high
+    # and after release. Inputs are sampled together for their idle level.
+    # Every result goes out as a 'selftest' event; the last report is kept.
+    # running and testing_launch follow the job, so a job cancelled before
+    # its first step, whose finally never runs, still releases them.
+
+    PULSE = 0.1
+    INPUT_SAMPLES = 5
+    SAMPLE_INTERVAL = 0.01
+
+    def __init__(self, handler, publish):
+        self.handler = handler
+        self.gpio = handler.gpio
+        self.publish = publish
+        self.job = None
+        self.launch = False
+        self.report = None
+
+    @property
+    def running(self):
+        return self.job is not None and self.job.finished is None
+
+    @property
+    def testing_launch(self):
+        return self.running and self.launch
+
+    def output_groups(self, launch):
+        # (axis directions driven, [(name, pin)])
+        axes = self.handler.pins.axes
+        groups = []
+
+        for group in (('cw', 'up'), ('ccw', 'down')):
+            groups.append((group, [('axis ' + axis, pin) for axis in group for pin in PinMap.channel_pins(axes[axis])]))
+
+        if launch:
+            tubes = self.handler.pins.tubes
+            groups.append(((), [('tube %d' % i, tubes[i]) for i in range(1, len(tubes))]))
+
+        return groups
+
+    def inputs(self):
+        pins = self.handler.pins
+        inputs = [('switch ' + axis, pins.switches[axis], True) for axis in AXES]
+        for name in ENCODERS:
+            clock, data = pins.encoders[name]
+            inputs.append(('encoder %s clock' % name, clock, False))
+            inputs.append(('encoder %s data' % name, data, False))
+        return inputs
+
+    def begin(self, launch, job):
+        self.launch = launch
+        self.job = job
+
+    def sequence(self, launch=False):
+        gpio = self.gpio
+        groups = self.output_groups(launch)
+        inputs = self.inputs()
+        total = sum(len(g) for _, g in groups) + len(inputs)
+        results = []
+
+        start = time.monotonic()
+        self.report = {
+            'state': 'running',
+            'started': time.time(),
+            'launch': launch,
+            'total': total,
+            'failed': 0,
+            'duration_ms': None,
+            'results': results,
+        }
+        self.publish('selftest', {'state': 'running', 'done': 0, 'total': total})
+
+        try:
+            for directions, group in groups:
+                pins = [pin for _, pin in group]
+
+                self.handler.set_pins_high(pins)
+                self.handler.set_moving(directions, True)
+                yield self.PULSE
+                high = [gpio.input(pin) for pin in pins]
+                self.handler.set_pins_low(pins)
+                self.handler.set_moving(directions, False)
+                yield self.PULSE
+                low = [gpio.input(pin) for pin in pins]
+
+                for (name, pin), h, l in zip(group, high, low):
+                    self.add(results, {
+                        'name': name,
+                        'pin': pin,
+                        'kind': 'output',
+                        'high': h,
+                        'low': l,
+                        'ok': h == gpio.HIGH and l == gpio.LOW,
+                    })
+            self.launch = False
+
+            # A limit switch must be open at rest; an encoder line may rest at
+            # either level but should not move while the rig stands still.
+            samples = []
+            for _ in range(self.INPUT_SAMPLES):
+                samples.append([gpio.input(pin) for _, pin, _ in inputs])
+                yield self.SAMPLE_INTERVAL
+
+            for i, (name, pin, switch) in enumerate(inputs):
+                levels = [s[i] for s in samples]
+                stable = len(set(levels)) == 1
+                self.add(results, {
+                    'name': name,
+                    'pin': pin,
+                    'kind': 'input',
+                    'levels': levels,
+                    'ok': stable and (not switch or levels[0] == gpio.LOW),
+                })
+        finally:
+            # Also reached when the job fails or the generator is dropped
+            self.handler.set_pins_low([pin for _, group in groups for _, pin in group])
+            self.handler.set_moving([d for directions, _ in groups for d in directions], False)
+            self.launch = False
+
+            report = self.report
+            report['duration_ms'] = (time.monotonic() - start) * 1000
+            report['state'] = 'passed' if len(results) == total and not report['failed'] else 'failed'
+            self.publish('selftest', {'state': report['state'], 'done': len(results), 'total': total,
+                                      'failed': report['failed']})
+
+        return {'state': report['state'], 'failed': report['failed']}
+
+    def add(self, results, result):
+        results.append(result)
+        if not result['ok']:
+            self.report['failed'] += 1
+
+        event = dict(result)
+        event.update({'done': len(results), 'total': self.report['total']})
+        self.publish('selftest', event)
+
+    def serialize(self):
+        report = self.report
+        return report and dict(report, results=list(report['results']))
@@ -0,0 +1,160 @@
+import sys
+
+# The server, the actor, the jobs and the journal use Python 3 only features
+# (yield from, time.monotonic, int.to_bytes); under Python 2 the imports
+# below would fail with a syntax error instead of this message.
+if sys.version_info < (3, 4):
+    sys.exit('PRL2016 needs Python 3.4 or newer: install python3-rpi.gpio and python3-flask and run it with python3')
+
+import argparse  # noqa: E402
+import logging  # noqa: E402
+import selectors  # noqa: E402
+import socket  # noqa: E402
+import time  # noqa: E402
+from queue import Empty, Queue  # noqa: E402
+from threading import Thread  # noqa: E402
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler  # noqa: E402
+
+import prl2016  # noqa: E402
+from backend import get_backend  # noqa: E402
+from engine import DEFAULT_LOCK_FILE, Engine, acquire_hardware_lock  # noqa: E402
+from pinmap import PinMapError, load_pin_map  # noqa: E402
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8000
+DEFAULT_THREADS = 16
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    # Connections are handed to a fixed pool of daemon worker threads instead
+    # of one new thread each. Werkzeug closes every connection after its
+    # response, so each connection carries one request. A new connection
+    # holds no worker until its request starts to arrive: it waits in a
+    # selector and is queued once readable, or closed after IDLE_TIMEOUT.
+    # Only /events streams hold a worker for long, and the engine caps them
+    # below the pool size, so a worker is always left for the emergency stop.
+
+    IDLE_TIMEOUT = 5
+    IDLE_CHECK = 0.5
+
+    def __init__(self, host, port, app, threads):
+        BaseWSGIServer.__init__(self, host, port, app, handler=QuietRequestHandler)
+        self.requests = Queue()
+        self.parked = Queue()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.waker = socket.socketpair()
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+
+        for _ in range(threads):
+            t = Thread(target=self.worker)
+            t.daemon = True
+            t.start()
+
+        t = Thread(target=self.idle)
+        t.daemon = True
+        t.start()
+
+    def process_request(self, request, client_address):
+        self.parked.put((request, client_address))
+        self.waker.send(b'\0')
+
+    def worker(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def idle(self):
+        # The selector is only touched on this thread; the accept loop hands
+        # new connections over through a queue and a wakeup socket.
+        deadlines = {}
+        while True:
+            for key, _ in self.selector.select(self.IDLE_CHECK):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    continue
+                self.selector.unregister(key.fileobj)
+                del deadlines[key.fileobj]
+                self.requests.put((key.fileobj, key.data))
+
+            now = time.monotonic()
+            while True:
+                try:
+                    request, client_address = self.parked.get_nowait()
+                except Empty:
+                    break
+                self.selector.register(request, selectors.EVENT_READ, client_address)
+                deadlines[request] = now + self.IDLE_TIMEOUT
+
+            for request, deadline in list(deadlines.items()):
+                if deadline < now:
+                    self.selector.unregister(request)
+                    del deadlines[request]
+                    self.shutdown_request(request)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='PRL2016 control server')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS)
+    parser.add_argument('--max-streams', type=int, default=None,
+                        help='open /events streams allowed, default half the threads; must stay below --threads')
+    parser.add_argument('--backend', choices=['rpi', 'sim'], default=None)
+    parser.add_argument('--lock-file', default=DEFAULT_LOCK_FILE)
+    parser.add_argument('--log-file', default='prl2016.log')
+    parser.add_argument('--journal', default=None, help='directory of the binary event journal')
+    parser.add_argument('--pins', default=None, help='JSON pin map, defaults to pins.json')
+    parser.add_argument('--state-file', default='prl2016.state', help='crash-safe launcher state, empty to disable')
+    parser.add_argument('--input-rate', type=float, default=None, help='input sampling rate in Hz')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    max_streams = min(args.threads // 2, args.threads - 1) if args.max_streams is None else args.max_streams
+    if max_streams < 0 or max_streams >= args.threads:
+        sys.exit('--max-streams must be below --threads, a worker is kept for the emergency stop')
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    lock = acquire_hardware_lock(args.lock_file)
+    if lock is None:
+        sys.exit('Another PRL2016 server already owns the hardware (' + args.lock_file + ')')
+
+    if args.pins is not None:
+        try:
+            prl2016.engine = Engine(load_pin_map(args.pins))
+        except PinMapError as e:
+            sys.exit(str(e))
+
+    prl2016.init_hardware(args.backend and get_backend(args.backend), args.journal, args.input_rate, args.state_file or None)
+    prl2016.engine.events.max_subscribers = max_streams
+
+    server = PooledWSGIServer(args.host, args.port, prl2016.app, args.threads)
+    logging.info('Serving on ' + args.host + ':' + str(args.port) + ' with ' + str(args.threads) + ' threads')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Interrupt received, stopping...")
+    finally:
+        server.server_close()
+        prl2016.engine.stop()
+        lock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+import argparse
+import json
+import logging
+import time
+from threading import Event, Thread
+
+from engine import BadCommand
+from gpio import GPIOHandler
+from launcher import NotArmed
+from positioner import Positioner
+
+AXIS_OF = {'cw': 'horizontal', 'ccw': 'horizontal', 'up': 'vertical', 'down': 'vertical'}
+
+EVENT_ARGS = {
+    'move_start': 'directions',
+    'move_stop': 'directions',
+    'move_to': 'targets',
+    'fire': 'tubes',
+}
+
+
+class ShowEvent:
+
+    def __init__(self, at, index, command, arg):
+        self.at = at
+        self.index = index
+        self.command = command
+        self.arg = arg
+
+    def serialize(self):
+        return {
+            'at_ms': self.at,
+            'index': self.index,
+            'command': self.command,
+            EVENT_ARGS[self.command]: self.arg,
+        }
+
+
+class Show:
+
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+        self.duration = events[-1].at if events else 0
+        self.tubes = sorted(t for e in events if e.command == 'fire' for t in e.arg)
+
+    def serialize(self):
+        return {
+            'name': self.name,
+            'duration_ms': self.duration,
+            'tubes': self.tubes,
+            'events': [e.serialize() for e in self.events],
+        }
+
+
+def compile_show(data, engine, loaded=None):
+    # Sorts the timeline by offset, file order breaking ties, and replays it
+    # against the tube and axis state before anything moves: every fired
+    # tube loaded and fired once, no axis reversed or driven by two events
+    # at once, every run stopped within its travel limit. A move_to may run
+    # until its timeout, so its axis takes no other move until then. All
+    # problems are reported together.
+    if not isinstance(data, dict) or not isinstance(data.get('events'), list) or not data['events']:
+        raise BadCommand('Bad request, invalid show')
+
+    errors = []
+    events = []
+    for i, e in enumerate(data['events']):
+        command = e.get('command') if isinstance(e, dict) else None
+        at = e.get('at') if isinstance(e, dict) else None
+        if command not in EVENT_ARGS or set(e) != {'at', 'command', EVENT_ARGS[command]}:
+            errors.append('event %d: invalid event' % i)
+        elif not isinstance(at, int) or isinstance(at, bool) or at < 0:
+            errors.append('event %d: invalid offset' % i)
+        else:
+            events.append(ShowEvent(at, i, command, e[EVENT_ARGS[command]]))
+
+    events.sort(key=lambda e: (e.at, e.index))
+
+    if loaded is None:
+        loaded = engine.prl.loaded
+    bank = engine.prl.bank
+    limits = GPIOHandler.TRAVEL_LIMITS
+    moving = {}
+    touched = {}
+    # axis -> (index of the move_to, offset by which its job has surely ended)
+    driven = {}
+    busy = int((Positioner.TIMEOUT + Positioner.SETTLE_TIME + 2 * Positioner.TICK) * 1000)
+
+    for e in events:
+        where = 'event %d (%s at %d ms)' % (e.index, e.command, e.at)
+
+        try:
+            if e.command == 'fire':
+                mask = bank.mask(e.arg)
+            elif e.command == 'move_to':
+                engine.check_targets(e.arg)
+            elif not isinstance(e.arg, list):
+                raise BadCommand('Bad request, invalid json')
+            else:
+                engine.check_directions(e.arg)
+        except ValueError as error:
+            errors.append('%s: %s' % (where, error))
+            continue
+
+        if e.command == 'fire':
+            if mask & ~loaded:
+                errors.append('%s: tubes %s are not loaded or already fired' % (where, bank.ids(mask & ~loaded)))
+            loaded &= ~mask
+            continue
+
+        axes = sorted(e.arg) if e.command == 'move_to' else sorted(AXIS_OF.get(d, d) for d in e.arg)
+        for axis in axes:
+            if axis in touched and touched[axis] == e.at:
+                errors.append('%s: %s axis is driven by another event at the same time' % (where, axis))
+            touched[axis] = e.at
+
+        for axis in axes:
+            if axis in driven and e.at < driven[axis][1]:
+                errors.append('%s: %s axis may still be driven by event %d until %d ms'
+                              % (where, axis, driven[axis][0], driven[axis][1]))
+
+        if e.command == 'move_to':
+            for axis in axes:
+                if axis in moving:
+                    errors.append('%s: %s axis is still moving %s' % (where, axis, moving[axis][0]))
+                driven[axis] = (e.index, e.at + busy)
+            continue
+
+        for d in e.arg:
+            axis = AXIS_OF.get(d)
+            if axis is None:
+                errors.append('%s: unknown direction %r' % (where, d))
+            elif e.command == 'move_start':
+                if axis in moving:
+                    errors.append('%s: %s axis is already moving %s' % (where, axis, moving[axis][0]))
+                else:
+                    moving[axis] = (d, e.at)
+            elif axis not in moving or moving[axis][0] != d:
+                errors.append('%s: %s axis is not moving %s' % (where, axis, d))
+            else:
+                check_travel(errors, where, d, e.at - moving.pop(axis)[1], limits)
+
+    end = events[-1].at if events else 0
+    for axis, (d, since) in sorted(moving.items()):
+        errors.append('%s axis is still moving %s at the end of the show' % (axis, d))
+        check_travel(errors, 'end of show', d, end - since, limits)
+
+    if errors:
+        raise BadCommand('Invalid show: ' + '; '.join(errors))
+
+    return Show(data.get('name', ''), events)
+
+
+def check_travel(errors, where, direction, duration, limits):
+    limit = limits.get(direction)
+    if limit is not None and duration > limit * 1000:
+        errors.append('%s: %s runs %d ms, over its %d ms travel limit' % (where, direction, duration, limit * 1000))
+
+
+class ShowRunner:
+    # Plays a compiled show on its own thread against the monotonic clock:
+    # it sleeps until SPIN before an event is due, then busy-waits, and
+    # records how late each command was dispatched. speed > 1 compresses
+    # the timeline for dry runs. A failed command aborts the show and stops
+    # all motion.
+
+    SPIN = 0.002
+
+    def __init__(self, engine, show, speed=1.0):
+        self.engine = engine
+        self.show = show
+        self.speed = speed
+        self.stopped = Event()
+        self.thread = None
+        self.state = 'pending'
+        self.error = None
+        self.results = []
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.state = 'running'
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait(self, due):
+        while True:
+            remaining = due - time.monotonic()
+            if remaining <= 0 or self.stopped.is_set():
+                return
+            if remaining > self.SPIN:
+                self.stopped.wait(remaining - self.SPIN)
+
+    def run(self):
+        engine = self.engine
+        self.started = time.monotonic()
+        publish = engine.events.publish
+
+        for e in self.show.events:
+            due = self.started + e.at / 1000.0 / self.speed
+            self.wait(due)
+            if self.stopped.is_set():
+                self.state = 'stopped'
+                break
+
+            dispatched = time.monotonic()
+            result = {'index': e.index, 'at_ms': e.at, 'command': e.command,
+                      'jitter_ms': (dispatched - due) * 1000}
+            try:
+                job = getattr(engine, e.command)(e.arg)
+                if job is not None:
+                    result['job'] = job._id
+            except Exception as error:
+                logging.exception('Show event ' + str(e.index) + ' failed')
+                result['error'] = str(error)
+                self.error = 'event %d: %s' % (e.index, error)
+                self.state = 'aborted'
+                engine.emergency_stop()
+
+            result['latency_ms'] = (time.monotonic() - dispatched) * 1000
+            self.results.append(result)
+            publish('show', dict(result, done=len(self.results), total=len(self.show.events)))
+
+            if self.state == 'aborted':
+                break
+        else:
+            self.state = 'done'
+
+        self.finished = time.monotonic()
+        publish('show', {'state': self.state, 'done': len(self.results), 'total': len(self.show.events)})
+
+    def serialize(self):
+        results = list(self.results)
+        jitter = [abs(r['jitter_ms']) for r in results]
+        return {
+            'name': self.show.name,
+            'state': self.state,
+            'error': self.error,
+            'speed': self.speed,
+            'events': len(self.show.events),
+            'done': len(results),
+            'duration_ms': None if self.finished is None else (self.finished - self.started) * 1000,
+            'max_jitter_ms': max(jitter) if jitter else None,
+            'mean_jitter_ms': sum(jitter) / len(jitter) if jitter else None,
+            'results': results,
+        }
+
+
+def start_show(engine, data, speed=1.0):
+    with engine.lock:
+        if engine.show is not None and engine.show.state == 'running':
+            raise BadCommand('Bad request, a show is already running')
+
+        show = compile_show(data, engine)
+        if show.tubes and not engine.prl.armed:
+            raise NotArmed('System is not armed!')
+
+        engine.show = ShowRunner(engine, show, speed)
+        engine.show.start()
+        return engine.show
+
+
+def scale_durations(engine, speed):
+    # Positioner timeouts and pulses, launch pulses and travel limits run
+    # speed times faster, along with the show offsets. Nothing turns the
+    # simulated encoders, so a move_to there always ends on its timeout.
+    positioner = engine.positioner
+    for name in ('TIMEOUT', 'SETTLE_TIME', 'PULSE_ON', 'PULSE_OFF'):
+        setattr(positioner, name, getattr(Positioner, name) / speed)
+
+    handler = engine.handler
+    handler.LAUNCH_WAIT_TIME = GPIOHandler.LAUNCH_WAIT_TIME / speed
+    handler.watchdog.limits = dict((d, None if limit is None else limit / speed)
+                                   for d, limit in GPIOHandler.TRAVEL_LIMITS.items())
+
+
+def dry_run(path, speed):
+    # Plays a show on a fresh engine over the simulated backend, armed and
+    # loaded with exactly the tubes the show fires, in accelerated time.
+    from backend import SimulatedBackend
+    from engine import Engine
+
+    with open(path) as f:
+        data = json.load(f)
+
+    engine = Engine()
+    sim = SimulatedBackend()
+    engine.start(sim)
+    scale_durations(engine, speed)
+
+    show = compile_show(data, engine, loaded=engine.prl.bank.all)
+    engine.arm()
+    if show.tubes:
+        engine.load(show.tubes)
+
+    runner = start_show(engine, data, speed)
+    runner.thread.join()
+    while engine.jobs.queue or engine.actor.queue.qsize():
+        time.sleep(0.01)
+
+    report = runner.serialize()
+    report['outputs'] = len(sim.output_trace())
+    engine.stop()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Validate or dry run a PRL2016 show file on the simulated backend')
+    parser.add_argument('show')
+    parser.add_argument('--speed', type=float, default=1.0, help='time scale of the dry run')
+    parser.add_argument('--validate', action='store_true', help='only compile and print the schedule')
+    args = parser.parse_args(argv)
+
+    if args.validate:
+        from engine import Engine
+        with open(args.show) as f:
+            data = json.load(f)
+        engine = Engine()
+        result = compile_show(data, engine, loaded=engine.prl.bank.all).serialize()
+    else:
+        result = dry_run(args.show, args.speed)
+
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Event, Lock, Thread
+
+MAGIC = b'PRLS'
+FORMAT_VERSION = 1
+
+# magic, format version, sequence, armed, loaded tube mask, vertical and
+# horizontal encoder counts; a CRC32 of these bytes follows
+RECORD = struct.Struct('<4sHQ?Qqq')
+CRC = struct.Struct('<I')
+
+# The two slots sit in different 512 byte sectors, so a torn write can only
+# ever damage the slot being written, never the last good one.
+SLOT_OFFSETS = (0, 512)
+FILE_SIZE = 4096
+
+
+class StateStore:
+    # Launcher state kept in a small memory-mapped file with two alternating
+    # checksummed slots. A commit packs the record into the older slot, a
+    # copy into the page cache that survives a crash of the process at once;
+    # a flusher thread msyncs dirty pages every FLUSH_INTERVAL, so a power
+    # cut loses at most that much. Encoder counts change on every quarter
+    # step and are only picked up by the flusher.
+
+    FLUSH_INTERVAL = 0.005
+    MAX_TUBES = 64
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.source = None
+
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self.file.fileno()).st_size < FILE_SIZE:
+            self.file.truncate(FILE_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), FILE_SIZE)
+
+        self.recovered = self.load()
+        self.seq = self.recovered['seq'] if self.recovered else 0
+        self.last = None
+        self.dirty = False
+        self.commits = 0
+        self.flushes = 0
+        self.last_commit = 0.0
+        self.max_commit = 0.0
+
+    def load(self):
+        best = None
+        for offset in SLOT_OFFSETS:
+            data = self.map[offset:offset + RECORD.size + CRC.size]
+            magic, version, seq, armed, loaded, vertical, horizontal = RECORD.unpack_from(data)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                continue
+            if CRC.unpack_from(data, RECORD.size)[0] != zlib.crc32(data[:RECORD.size]):
+                continue
+            if best is None or seq > best['seq']:
+                best = {'seq': seq, 'armed': armed, 'loaded': loaded,
+                        'encoders': {'vertical': vertical, 'horizontal': horizontal}}
+        return best
+
+    def commit(self, armed, loaded, vertical, horizontal):
+        self.write(lambda: (armed, loaded, vertical, horizontal))
+
+    def sync(self):
+        # The source is read under the lock: two threads syncing at once
+        # can never leave the older snapshot under the higher sequence
+        self.write(self.source)
+
+    def write(self, read):
+        start = time.monotonic()
+
+        with self.lock:
+            record = tuple(read())
+            if record == self.last:
+                return
+            self.seq += 1
+            data = RECORD.pack(MAGIC, FORMAT_VERSION, self.seq, *record)
+            offset = SLOT_OFFSETS[self.seq % 2]
+            self.map[offset:offset + RECORD.size + CRC.size] = data + CRC.pack(zlib.crc32(data))
+            self.last = record
+            self.dirty = True
+            self.commits += 1
+
+        elapsed = time.monotonic() - start
+        self.last_commit = elapsed
+        self.max_commit = max(self.max_commit, elapsed)
+
+    def start(self, source):
+        # source() returns the current (armed, loaded, vertical, horizontal);
+        # it is called with the store lock held, so it must not block
+        self.source = source
+        self.sync()
+        self.flush()
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.sync()
+            self.flush()
+
+    def flush(self):
+        # msync runs outside the lock, a commit never waits for the disk
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        self.map.flush()
+        self.flushes += 1
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.source is not None:
+            self.sync()
+        self.flush()
+        self.map.close()
+        self.file.close()
+
+    def serialize(self):
+        return {
+            'path': self.path,
+            'seq': self.seq,
+            'commits': self.commits,
+            'flushes': self.flushes,
+            'last_commit_us': self.last_commit * 1000000,
+            'max_commit_us': self.max_commit * 1000000,
+            'recovered': self.recovered,
+        }
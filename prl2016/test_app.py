@@ -0,0 +1,112 @@
+import time
+import unittest
+from unittest import mock
+
+import frames
+import prl2016
+from backend import SimulatedBackend
+from engine import Engine
+
+
+class AppTestCase(unittest.TestCase):
+    # The Flask routes on a fresh engine over the simulated backend
+
+    def setUp(self):
+        self.engine = Engine()
+        self.engine.MOVEMENT_TEST_DELAY = 0.01
+        patcher = mock.patch.object(prl2016, 'engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine.start(backend=SimulatedBackend())
+        self.client = prl2016.app.test_client()
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def wait(self, location, timeout=5):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.client.get(location).get_json()
+            if job['duration_ms'] is not None:
+                return job
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.005)
+
+
+class StatusTest(AppTestCase):
+
+    def test_not_modified_until_the_state_changes(self):
+        first = self.client.get('/launch/status')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        self.assertEqual(first.get_json()['armed'], False)
+
+        again = self.client.get('/launch/status', headers={'If-None-Match': etag})
+        self.assertEqual((again.status_code, again.data), (304, b''))
+        self.assertEqual(again.headers['ETag'], etag)
+
+        self.assertEqual(self.client.post('/launch/arm').status_code, 200)
+        changed = self.client.get('/launch/status', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertEqual(changed.get_json()['armed'], True)
+
+    def test_frame_and_json_etags_differ(self):
+        json_etag = self.client.get('/launch/status').headers['ETag']
+        response = self.client.get('/launch/status', headers={'Accept': frames.MIME_TYPE,
+                                                             'If-None-Match': json_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, frames.MIME_TYPE)
+        self.assertIn('Accept', response.headers['Vary'])
+        self.assertNotEqual(response.headers['ETag'], json_etag)
+
+
+class JobTest(AppTestCase):
+
+    def test_accepted_with_a_location(self):
+        response = self.client.post('/move/test')
+        self.assertEqual(response.status_code, 202)
+        location = response.headers['Location']
+        self.assertEqual(location, '/jobs/%d' % response.get_json()['id'])
+        self.assertEqual(self.wait(location)['state'], 'done')
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/jobs/999').status_code, 404)
+
+    def test_fire_needs_arm(self):
+        self.client.post('/launch/load', json=[1])
+        self.assertEqual(self.client.post('/launch/fire', json=[1]).status_code, 403)
+        self.assertEqual(self.client.post('/launch/load', json=[99]).status_code, 400)
+
+
+class FrameTest(AppTestCase):
+
+    def test_commands_and_status_as_frames(self):
+        count = self.engine.prl.bank.count
+        response = self.client.post('/launch/load', data=frames.encode_tubes([1, 3], count),
+                                    content_type=frames.MIME_TYPE)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/launch/status', headers={'Accept': frames.MIME_TYPE})
+        status = frames.decode_status(response.data)
+        self.assertEqual((status['armed'], status['loaded']), (False, [1, 3]))
+
+    def test_job_id_as_a_frame(self):
+        response = self.client.post('/move/test', headers={'Accept': frames.MIME_TYPE})
+        self.assertEqual((response.status_code, response.mimetype), (202, frames.MIME_TYPE))
+        location = response.headers['Location']
+        self.assertEqual(location, '/jobs/%d' % frames.decode_job(response.data))
+        self.wait(location)
+
+    def test_json_by_default(self):
+        response = self.client.get('/launch/status', headers={'Accept': '*/*'})
+        self.assertEqual(response.mimetype, 'application/json')
+
+    def test_invalid_frame(self):
+        response = self.client.post('/move/start', data=b'\x01\x00', content_type=frames.MIME_TYPE)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.engine.handler.moving_cw)
+
+
+if __name__ == '__main__':
+    unittest.main()
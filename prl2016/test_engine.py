@@ -0,0 +1,315 @@
+import time
+import unittest
+from threading import Thread
+from unittest import mock
+
+from backend import SimulatedBackend
+from engine import BadCommand, Engine
+from launcher import NotArmed, NotLoaded
+
+
+class EngineTestCase(unittest.TestCase):
+    # A whole engine on the simulated backend, with the test delays cut down
+
+    def setUp(self):
+        self.engine = Engine()
+        self.engine.MOVEMENT_TEST_DELAY = 0.05
+        self.handler = self.engine.start(backend=SimulatedBackend())
+        self.engine.selftest.PULSE = 0.02
+        self.gpio = self.handler.gpio
+        self.pins = self.engine.pins
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def wait(self, job, timeout=5):
+        deadline = time.monotonic() + timeout
+        while job.finished is None:
+            self.assertLess(time.monotonic(), deadline, 'job %s did not finish' % job.name)
+            time.sleep(0.005)
+        return job
+
+    def level(self, direction):
+        return self.gpio.input(self.pins.axes[direction])
+
+    def high_together(self, first, second):
+        # Replays the output trace and reports whether both pins were ever
+        # high at the same time
+        a, b = self.pins.axes[first], self.pins.axes[second]
+        levels = {a: 0, b: 0}
+        for _, pin, value in self.gpio.output_trace():
+            if pin in levels:
+                levels[pin] = value
+                if levels[a] and levels[b]:
+                    return True
+        return False
+
+
+class BatchTest(EngineTestCase):
+
+    def test_bad_command_applies_nothing(self):
+        version = self.engine.prl.version
+        with self.assertRaises(BadCommand):
+            self.engine.batch([{'command': 'arm'}, {'command': 'load', 'tubes': [1]}, {'command': 'spin'}])
+        with self.assertRaises(BadCommand):
+            self.engine.batch([{'command': 'arm'}, {'command': 'load', 'tubes': [99]}])
+        self.assertEqual(self.engine.prl.version, version)
+        self.assertFalse(self.engine.prl.armed)
+
+    def test_checked_against_the_state_left_by_earlier_commands(self):
+        with self.assertRaises(NotArmed) as e:
+            self.engine.batch([{'command': 'load', 'tubes': [1]}, {'command': 'fire', 'tubes': [1]}])
+        self.assertIn('Command 1 (fire)', str(e.exception))
+
+        with self.assertRaises(NotLoaded):
+            self.engine.batch([{'command': 'arm'}, {'command': 'load', 'tubes': [1]},
+                               {'command': 'fire', 'tubes': [1]}, {'command': 'fire', 'tubes': [1]}])
+        self.assertEqual(self.engine.prl.loaded, 0)
+
+        results = self.engine.batch([{'command': 'arm'}, {'command': 'load', 'tubes': [1, 2]},
+                                     {'command': 'fire', 'tubes': [2]}])
+        self.assertEqual([r['status'] for r in results], [200, 200, 202])
+        self.assertEqual(self.engine.prl.bank.ids(self.engine.prl.loaded), [1])
+
+    def test_axes_busy_through_the_batch(self):
+        for commands in ([{'command': 'move_to', 'targets': {'vertical': 5}},
+                          {'command': 'move_to', 'targets': {'vertical': 10}}, {'command': 'arm'}],
+                         [{'command': 'move_start', 'directions': ['up']},
+                          {'command': 'move_to', 'targets': {'vertical': 10}}],
+                         [{'command': 'move_to', 'targets': {'horizontal': 5}},
+                          {'command': 'move_start', 'directions': ['ccw']}]):
+            with self.assertRaises(BadCommand):
+                self.engine.batch(commands)
+            self.assertFalse(self.engine.prl.armed)
+            self.assertEqual(self.engine.motion_state(), (set(), set()))
+
+        results = self.engine.batch([{'command': 'move_start', 'directions': ['up']},
+                                     {'command': 'move_stop', 'directions': ['up']},
+                                     {'command': 'move_to', 'targets': {'vertical': 1}},
+                                     {'command': 'emergency_stop'},
+                                     {'command': 'move_to', 'targets': {'vertical': 2}}])
+        self.assertEqual([r['status'] for r in results], [200, 200, 202, 200, 202])
+        self.engine.emergency_stop()
+
+    def test_refusal_while_running_is_a_400(self):
+        with mock.patch.object(self.engine, 'load', side_effect=BadCommand('Bad request, nope')):
+            results = self.engine.batch([{'command': 'load', 'tubes': [1]}, {'command': 'arm'}])
+        self.assertEqual([r['status'] for r in results], [400, None])
+        self.assertFalse(self.engine.prl.armed)
+
+    def test_move_to_on_a_busy_axis(self):
+        job = self.engine.move_to({'vertical': 50})
+        with self.assertRaises(BadCommand):
+            self.engine.batch([{'command': 'move_to', 'targets': {'vertical': 10}}])
+        self.engine.emergency_stop()
+        self.wait(job)
+
+
+class InterlockTest(EngineTestCase):
+
+    def test_opposite_directions_never_both_high(self):
+        self.engine.move_start(['up'])
+        self.engine.move_start(['down', 'cw'])
+        self.engine.move_start(['ccw'])
+        self.assertEqual((self.level('up'), self.level('down')), (0, 1))
+        self.assertEqual((self.level('cw'), self.level('ccw')), (0, 1))
+        self.assertFalse(self.high_together('up', 'down'))
+        self.assertFalse(self.high_together('cw', 'ccw'))
+
+    def test_move_to_targets_fit_the_journal(self):
+        for targets in ({'vertical': 2 ** 31}, {'horizontal': -2 ** 31 - 1}, {'vertical': 10000000000}):
+            with self.assertRaises(BadCommand):
+                self.engine.move_to(targets)
+        with self.assertRaises(BadCommand):
+            self.engine.batch([{'command': 'move_to', 'targets': {'vertical': 10000000000}}])
+        self.assertEqual(self.engine.motion_state(), (set(), set()))
+
+    def test_move_to_refuses_a_busy_axis(self):
+        job = self.engine.move_to({'vertical': 50})
+        with self.assertRaises(BadCommand):
+            self.engine.move_to({'vertical': -50})
+
+        other = self.engine.move_to({'horizontal': 50})
+        self.engine.emergency_stop()
+        self.wait(job)
+        self.wait(other)
+
+        self.engine.move_start(['cw'])
+        with self.assertRaises(BadCommand):
+            self.engine.move_to({'horizontal': 10})
+
+    def test_manual_move_refused_on_a_driven_axis(self):
+        job = self.engine.move_to({'vertical': 50})
+        time.sleep(0.02)
+        with self.assertRaises(BadCommand):
+            self.engine.move_start(['down'])
+        self.engine.move_start(['cw'])
+        self.engine.emergency_stop()
+        self.wait(job)
+        self.assertFalse(self.high_together('up', 'down'))
+
+    def test_runaway_aborts(self):
+        # A reversed motor: driving up makes the encoder count down
+        encoder = self.handler.encoder_vertical
+        running = [True]
+
+        def motor():
+            while running[0]:
+                if self.level('up'):
+                    encoder.count -= 1
+                if self.level('down'):
+                    encoder.count += 1
+                time.sleep(0.002)
+
+        t = Thread(target=motor)
+        t.start()
+        try:
+            job = self.wait(self.engine.move_to({'vertical': 40}))
+        finally:
+            running[0] = False
+            t.join()
+
+        self.assertEqual(job.result['vertical']['reason'], 'runaway')
+        self.assertEqual((self.level('up'), self.level('down')), (0, 0))
+
+
+class CancelTest(EngineTestCase):
+
+    def test_emergency_cancels_motion_jobs(self):
+        test = self.engine.movement_test()
+        time.sleep(0.02)
+        self.engine.emergency_stop()
+        self.assertEqual(self.wait(test).state, 'cancelled')
+
+        move = self.engine.move_to({'horizontal': 100})
+        time.sleep(0.02)
+        self.engine.emergency_stop()
+        self.assertEqual(self.wait(move).state, 'cancelled')
+
+        self.gpio.clear_trace()
+        time.sleep(0.1)
+        self.assertEqual([e for e in self.gpio.output_trace() if e[2]], [])
+        self.assertFalse(any(self.level(d) for d in ('up', 'down', 'cw', 'ccw')))
+
+    def fire_at_then(self, cancel):
+        self.engine.load([3])
+        self.engine.arm()
+        job = self.engine.fire_at([3], time.time() + 0.2)
+        self.assertEqual(self.engine.prl.loaded, 0)
+        cancel()
+
+        time.sleep(0.3)
+        self.assertEqual(job.state, 'cancelled')
+        self.assertEqual(self.gpio.output_trace(self.pins.tubes[3]), [])
+        self.assertEqual(self.engine.prl.bank.ids(self.engine.prl.loaded), [3])
+
+    def test_disarm_cancels_a_scheduled_fire(self):
+        self.fire_at_then(self.engine.disarm)
+
+    def test_emergency_cancels_a_scheduled_fire(self):
+        self.fire_at_then(self.engine.emergency_stop)
+
+    def test_cancel_mid_pulse_drops_the_tube_pin(self):
+        self.engine.load([3])
+        self.engine.arm()
+        job = self.engine.fire_at([3], time.time())
+        time.sleep(0.05)
+        self.assertEqual(self.gpio.input(self.pins.tubes[3]), 1)
+
+        self.engine.emergency_stop()
+        self.assertEqual(self.wait(job).state, 'cancelled')
+        self.assertEqual(self.gpio.input(self.pins.tubes[3]), 0)
+        # It did fire, so the tube stays empty
+        self.assertEqual(self.engine.prl.loaded, 0)
+
+    def test_fire_at_needs_a_finite_time(self):
+        self.engine.load([1])
+        self.engine.arm()
+        for at in (float('nan'), float('inf'), float('-inf'), time.time() + 3600, '1', True):
+            with self.assertRaises(BadCommand):
+                self.engine.fire_at([1], at)
+        self.assertEqual(self.engine.prl.bank.ids(self.engine.prl.loaded), [1])
+
+    def test_disarm_racing_the_wake_up(self):
+        self.engine.load([3])
+        self.engine.arm()
+        job = self.engine.fire_at([3], time.time() + 0.1)
+        # Bypasses Engine.disarm, so only the check on wake-up stops it
+        self.engine.prl.disarm()
+
+        self.assertEqual(self.wait(job).state, 'failed')
+        self.assertEqual(self.gpio.output_trace(self.pins.tubes[3]), [])
+        self.assertEqual(self.engine.prl.bank.ids(self.engine.prl.loaded), [3])
+
+
+class SelfTestGuardTest(EngineTestCase):
+
+    def test_refused_while_motion_runs(self):
+        test = self.engine.movement_test()
+        with self.assertRaises(BadCommand):
+            self.engine.self_test()
+        self.wait(test)
+
+        move = self.engine.move_to({'vertical': 50})
+        with self.assertRaises(BadCommand):
+            self.engine.self_test()
+        self.engine.emergency_stop()
+        self.wait(move)
+
+        self.engine.move_start(['cw'])
+        with self.assertRaises(BadCommand):
+            self.engine.self_test()
+
+    def test_motion_refused_during_a_self_test(self):
+        job = self.engine.self_test()
+        for command in (self.engine.movement_test, lambda: self.engine.move_start(['up']),
+                        lambda: self.engine.move_to({'vertical': 5})):
+            with self.assertRaises(BadCommand):
+                command()
+        with self.assertRaises(BadCommand):
+            self.engine.self_test()
+        self.assertEqual(self.wait(job).state, 'done')
+
+    def test_pulses_keep_the_motion_flags(self):
+        job = self.engine.self_test()
+        time.sleep(0.01)
+        self.assertTrue(self.handler.moving_cw and self.handler.moving_up)
+        self.assertEqual(sorted(self.handler.watchdog.entries), ['cw', 'up'])
+
+        self.wait(job)
+        self.assertEqual(job.result, {'state': 'passed', 'failed': 0})
+        self.assertFalse(self.handler.axis_moving('vertical') or self.handler.axis_moving('horizontal'))
+        self.assertEqual(self.handler.watchdog.entries, {})
+
+    def test_emergency_clears_the_motion_flags(self):
+        job = self.engine.self_test()
+        time.sleep(0.01)
+        self.engine.emergency_stop()
+        self.assertEqual(self.wait(job).state, 'cancelled')
+        self.assertFalse(self.handler.axis_moving('vertical') or self.handler.axis_moving('horizontal'))
+        self.assertEqual(self.handler.watchdog.entries, {})
+        self.assertFalse(any(self.gpio.input(pin) for pin in self.pins.outputs))
+
+    def test_cancel_before_the_first_step(self):
+        # The first step waits behind a busy actor; the emergency stop jumps
+        # ahead and closes a generator that never started
+        self.engine.actor.submit(time.sleep, 0.1)
+        job = self.engine.self_test(launch=True)
+        time.sleep(0.02)
+        self.engine.emergency_stop()
+
+        self.assertEqual(self.wait(job).state, 'cancelled')
+        self.assertFalse(self.engine.selftest.running or self.engine.selftest.testing_launch)
+        self.engine.arm()
+        self.engine.move_start(['up'])
+        self.engine.emergency_stop()
+        self.wait(self.engine.self_test())
+
+    def test_launch_relays_need_an_empty_disarmed_launcher(self):
+        self.engine.load([1])
+        with self.assertRaises(BadCommand):
+            self.engine.self_test(launch=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
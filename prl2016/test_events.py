@@ -0,0 +1,32 @@
+import unittest
+
+from events import EventStream
+
+
+class EventStreamTest(unittest.TestCase):
+
+    def test_subscriber_cap(self):
+        stream = EventStream(dict, max_subscribers=2)
+        first = stream.subscribe()
+        second = stream.subscribe()
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(stream.subscribe())
+
+        stream.unsubscribe(first)
+        self.assertIsNotNone(stream.subscribe())
+
+    def test_no_cap(self):
+        stream = EventStream(dict)
+        self.assertTrue(all(stream.subscribe() is not None for _ in range(100)))
+
+    def test_publish_reaches_every_subscriber(self):
+        stream = EventStream(dict)
+        subs = [stream.subscribe() for _ in range(3)]
+        stream.publish('selftest', {'state': 'running'})
+        for sub in subs:
+            self.assertEqual(sub.queue.get_nowait(), (1, 'selftest', {'state': 'running'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
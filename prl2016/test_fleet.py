@@ -0,0 +1,94 @@
+import socket
+import unittest
+from threading import Thread
+from unittest import mock
+
+from fleet import Fleet, Node, NodeError
+
+
+class SilentServer:
+    # Accepts connections and reads requests without ever answering
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.address = '127.0.0.1:%d' % self.sock.getsockname()[1]
+        self.requests = []
+        self.connections = []
+        t = Thread(target=self.run)
+        t.daemon = True
+        t.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            data = conn.recv(4096)
+            if data:
+                self.requests.append(data.split(b'\r\n')[0])
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.sock.close()
+
+
+class NodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SilentServer()
+        self.node = Node(self.server.address, timeout=0.2)
+
+    def tearDown(self):
+        self.node.close()
+        self.server.close()
+
+    def test_timed_out_fire_is_not_sent_again(self):
+        with self.assertRaises(NodeError):
+            self.node.request('POST', '/launch/fire', [1])
+        self.assertEqual(self.server.requests, [b'POST /launch/fire HTTP/1.1'])
+
+    def test_stale_pooled_connection_is_not_retried_for_a_fire(self):
+        stale = self.node.connection()[0]
+        stale.connect()
+        self.node.release(stale)
+
+        with self.assertRaises(NodeError):
+            self.node.request('POST', '/launch/fire', [1])
+        self.assertEqual(self.server.requests, [b'POST /launch/fire HTTP/1.1'])
+
+    def test_stale_pooled_connection_is_retried_for_a_get(self):
+        stale = self.node.connection()[0]
+        stale.connect()
+        self.node.release(stale)
+
+        with self.assertRaises(NodeError):
+            self.node.request('GET', '/time')
+        self.assertEqual(self.server.requests, [b'GET /time HTTP/1.1'] * 2)
+
+
+class FleetTest(unittest.TestCase):
+
+    def test_fire_at_leaves_out_nodes_without_a_clock(self):
+        fleet = Fleet(['good:8000', 'bad:8000'])
+        good, bad = fleet.nodes
+        good.sync_clock = mock.Mock(return_value=0.5)
+        good.offset = 0.5
+        bad.sync_clock = mock.Mock(side_effect=NodeError('connection refused'))
+        good.request = mock.Mock(return_value=(202, {'id': 1}, 0.01))
+        bad.request = mock.Mock()
+
+        result = fleet.fire_at([1], 2)
+        bad.request.assert_not_called()
+        self.assertEqual(good.request.call_args[0][2], {'tubes': [1], 'at': result['at'] + 0.5})
+        self.assertEqual((result['ok'], result['failed']), (1, 1))
+        self.assertIsNone(result['nodes']['bad:8000']['status'])
+        self.assertIn('clock sync failed', result['nodes']['bad:8000']['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import struct
+import unittest
+
+import frames
+from engine import BadCommand
+from launcher import LaunchingSystem, TubeBank
+
+
+class FramesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bank = TubeBank(racks=2, tubes_per_rack=10)
+
+    def test_status_round_trip(self):
+        prl = LaunchingSystem(2, 10)
+        prl.load([1, 9, 20])
+        prl.arm()
+
+        version, etag, body = frames.status_frame(prl)
+        self.assertEqual(len(body), frames.STATUS.size + 3)
+        self.assertTrue(etag.endswith('-frame'))
+        self.assertEqual(frames.decode_status(body), {'version': version, 'armed': True, 'count': 20,
+                                                      'loaded': [1, 9, 20]})
+
+    def test_status_version_check(self):
+        body = frames.encode_status((1, False, 0), 10)
+        with self.assertRaises(ValueError):
+            frames.decode_status(b'\x02' + body[1:])
+
+    def test_tubes_round_trip(self):
+        payload = frames.encode_tubes([1, 8, 9, 20], self.bank.count)
+        self.assertEqual(payload, b'\x81\x01\x08')
+        self.assertEqual(frames.decode_tubes(payload, self.bank), [1, 8, 9, 20])
+
+    def test_invalid_tube_masks(self):
+        for payload in (b'\x01\x00', b'\x01\x00\x00\x00', b'\x00\x00\x00', b'\x00\x00\x10'):
+            with self.assertRaises(BadCommand):
+                frames.decode_tubes(payload, self.bank)
+
+    def test_fire_at_round_trip(self):
+        payload = frames.encode_fire_at([3], 1234.5, self.bank.count)
+        self.assertEqual(frames.decode_fire_at(payload, self.bank), ([3], 1234.5))
+        with self.assertRaises(BadCommand):
+            frames.decode_fire_at(payload[:4], self.bank)
+
+    def test_directions_and_targets(self):
+        self.assertEqual(frames.decode_directions(frames.encode_directions(['ccw', 'up'])), ['ccw', 'up'])
+        with self.assertRaises(BadCommand):
+            frames.decode_directions(b'')
+
+        targets = {'vertical': -12, 'horizontal': 300}
+        self.assertEqual(frames.decode_targets(frames.encode_targets(targets)), targets)
+        self.assertEqual(frames.decode_targets(frames.encode_targets({'vertical': 4})), {'vertical': 4})
+        with self.assertRaises(BadCommand):
+            frames.decode_targets(b'\x01')
+
+    def test_job(self):
+        self.assertEqual(frames.decode_job(struct.pack('<I', 42)), 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
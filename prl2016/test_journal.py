@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import journal
+import prl2016
+import replay
+from backend import SimulatedBackend
+from engine import Engine
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='prl2016-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_records_round_trip(self):
+        j = journal.Journal(self.dir)
+        j.command(journal.LOAD, journal.encode_ids([1, 20]))
+        j.command(journal.MOVE_START, journal.encode_directions(['up', 'cw']))
+        j.command(journal.MOVE_TO, journal.encode_targets({'vertical': -2 ** 31}))
+        j.pins([5, 6], 1)
+        j.close()
+
+        records = [(kind, data) for _, kind, data in journal.read_journal(self.dir)]
+        self.assertEqual(records, [(journal.LOAD, [1, 20]), (journal.MOVE_START, ['cw', 'up']),
+                                   (journal.MOVE_TO, {'vertical': -2 ** 31}), (journal.PIN, ([5, 6], 1))])
+
+    def test_segments_roll_over(self):
+        j = journal.Journal(self.dir, segment_size=256, segments=2)
+        for _ in range(40):
+            j.command(journal.ARM)
+        j.close()
+
+        self.assertEqual(len(journal.segment_files(self.dir)), 2)
+        kinds = set(kind for _, kind, _ in journal.read_journal(self.dir))
+        self.assertEqual(kinds, {journal.ARM})
+
+    def test_replay_reproduces_the_outputs(self):
+        engine = Engine()
+        engine.start(backend=SimulatedBackend(), journal_dir=self.dir)
+        engine.load([1, 2])
+        engine.arm()
+        engine.move_start(['up'])
+        engine.move_stop(['up'])
+        engine.disarm()
+        engine.stop()
+
+        replayed = Engine()
+        with mock.patch.object(prl2016, 'engine', replayed):
+            try:
+                report = replay.replay(self.dir, speed=0)
+            finally:
+                replayed.stop()
+
+        self.assertIsNone(report['first_divergence'])
+        self.assertGreater(report['outputs_replayed'], 0)
+        self.assertEqual(dict((name, c['statuses']) for name, c in report['commands'].items()),
+                         {'load': [200], 'arm': [200], 'move_start': [200], 'move_stop': [200],
+                          'disarm': [200], 'emergency': [200]})
+        self.assertEqual(replayed.prl.bank.ids(replayed.prl.loaded), [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
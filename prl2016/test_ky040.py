@@ -0,0 +1,67 @@
+import unittest
+
+from backend import SimulatedBackend
+from ky040 import KY040
+
+CLOCK = 5
+DATA = 6
+
+
+class KY040Test(unittest.TestCase):
+
+    def setUp(self):
+        self.gpio = SimulatedBackend()
+        for pin in (CLOCK, DATA):
+            self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+        self.encoder = KY040(self.gpio, CLOCK, DATA, name='test')
+        # Simulated edges come faster than any real contact could
+        self.encoder.GLITCH_FILTER = 0
+        self.encoder.start()
+
+    def step(self, states):
+        # states are (clock << 1) | data, one channel changing at a time
+        for state in states:
+            clock, data = state >> 1, state & 1
+            if clock != self.gpio.input(CLOCK):
+                self.gpio.set_input(CLOCK, clock)
+            if data != self.gpio.input(DATA):
+                self.gpio.set_input(DATA, data)
+
+    def test_transition_table(self):
+        table = KY040.TRANSITIONS
+        for state in range(4):
+            self.assertEqual(table[state << 2 | state], 0)
+            # both channels changing at once is never valid
+            self.assertIs(table[state << 2 | state ^ 3], KY040.INVALID)
+        for previous in range(4):
+            for new in range(4):
+                step = table[previous << 2 | new]
+                if step:
+                    self.assertEqual(table[new << 2 | previous], -step)
+
+    def test_one_detent_each_way(self):
+        self.step([2, 3, 1, 0])
+        self.assertEqual((self.encoder.count, self.encoder.turn), (4, 1))
+
+        self.step([1, 3, 2, 0])
+        self.assertEqual((self.encoder.count, self.encoder.turn), (0, 0))
+        self.assertEqual(self.encoder.missed, 0)
+
+    def test_bounce_cancels_out(self):
+        self.step([2, 0, 2, 0, 2, 3, 1, 0])
+        self.assertEqual(self.encoder.count, 4)
+
+    def test_skipped_state_counts_as_missed(self):
+        # 0 -> 3 in one edge callback: the data edge was lost
+        self.gpio.levels[DATA] = 1
+        self.gpio.set_input(CLOCK, 1)
+        self.assertEqual((self.encoder.count, self.encoder.missed), (0, 1))
+
+    def test_glitch_filter(self):
+        self.encoder.GLITCH_FILTER = 60
+        self.step([2, 0])
+        self.assertEqual((self.encoder.count, self.encoder.glitches), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
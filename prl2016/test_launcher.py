@@ -0,0 +1,60 @@
+import unittest
+
+from launcher import LaunchingSystem, NotArmed, NotLoaded, TubeBank
+
+
+class TubeBankTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bank = TubeBank(racks=3, tubes_per_rack=10)
+
+    def test_tube_n_is_bit_n_minus_one(self):
+        self.assertEqual(self.bank.mask([1]), 1)
+        self.assertEqual(self.bank.mask([1, 3, 30]), 1 | 4 | 1 << 29)
+        self.assertEqual(self.bank.all, (1 << 30) - 1)
+
+    def test_ids_round_trip(self):
+        ids = [2, 7, 11, 30]
+        self.assertEqual(self.bank.ids(self.bank.mask(ids)), ids)
+        self.assertEqual(self.bank.ids(0), [])
+
+    def test_invalid_ids(self):
+        for ids in ([0], [31], [True], ['1'], [1.0], 1, None):
+            with self.assertRaises(ValueError):
+                self.bank.mask(ids)
+
+    def test_rack(self):
+        self.assertEqual(self.bank.rack(1), (1, 1))
+        self.assertEqual(self.bank.rack(10), (1, 10))
+        self.assertEqual(self.bank.rack(11), (2, 1))
+
+
+class LaunchingSystemTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prl = LaunchingSystem()
+
+    def test_fire_needs_arm_and_loaded_tubes(self):
+        self.prl.load([1, 2])
+        with self.assertRaises(NotArmed):
+            self.prl.fire([1])
+
+        self.prl.arm()
+        with self.assertRaises(NotLoaded):
+            self.prl.fire([1, 3])
+        self.assertEqual(self.prl.bank.ids(self.prl.loaded), [1, 2])
+
+        self.prl.fire([1])
+        self.assertEqual(self.prl.bank.ids(self.prl.loaded), [2])
+
+    def test_every_change_bumps_the_version(self):
+        calls = []
+        self.prl.listeners.append(lambda: calls.append(self.prl.version))
+        self.prl.arm()
+        self.prl.load([4])
+        self.prl.disarm()
+        self.assertEqual(calls, [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
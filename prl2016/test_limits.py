@@ -0,0 +1,185 @@
+import time
+import unittest
+from threading import Event
+from unittest import mock
+
+from backend import SimulatedBackend
+from engine import Engine
+from limits import LimitSwitches
+from sampler import InputSampler
+
+
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gpio = SimulatedBackend()
+        self.gpio.setup(5, self.gpio.IN)
+        self.sampler = InputSampler(self.gpio, [5], [5])
+        self.stalled = Event()
+
+    def tearDown(self):
+        self.stalled.set()
+        self.sampler.stop()
+
+    def test_failing_pass_keeps_the_loop_running(self):
+        failures = [1]
+
+        def listener(previous, snapshot):
+            if failures:
+                failures.pop()
+                raise RuntimeError('listener failed')
+
+        self.sampler.listeners.append(listener)
+        self.sampler.start()
+        with self.assertLogs(level='ERROR'):
+            self.gpio.set_input(5, 1)
+            time.sleep(0.05)
+        passes = self.sampler.passes
+        time.sleep(0.05)
+
+        self.assertEqual(self.sampler.errors, 1)
+        self.assertGreater(self.sampler.passes, passes)
+        self.assertEqual(self.sampler.level(5), 1)
+        self.assertEqual(self.sampler.stale_reads, 0)
+
+    def test_switch_closes_on_the_majority(self):
+        self.sampler.window.extend([0] * self.sampler.window.maxlen)
+        self.sampler.times.extend([0.0] * self.sampler.times.maxlen)
+        self.gpio.set_input(5, 1)
+        self.sampler.sample()
+        first = self.sampler.snapshot.time
+        self.gpio.set_input(5, 0)
+        self.sampler.sample()
+        self.gpio.set_input(5, 1)
+        self.sampler.sample()
+        self.assertEqual(self.sampler.snapshot.filtered, 0)
+        self.assertEqual(self.sampler.snapshot.raw, 1 << 5)
+
+        self.sampler.sample()
+        self.assertEqual(self.sampler.snapshot.filtered, 1 << 5)
+        self.assertEqual(self.sampler.snapshot.rose, {5: first})
+
+    def test_stale_snapshot_reads_the_pin(self):
+        self.sampler.listeners.append(lambda previous, snapshot: self.stalled.wait())
+        self.gpio.setup(6, self.gpio.IN)
+        self.sampler.pins += (6,)
+        self.sampler.start()
+
+        self.gpio.set_input(6, 1)
+        self.gpio.set_input(5, 1)
+        time.sleep(self.sampler.STALE_PASSES * self.sampler.interval * 2)
+        self.assertEqual(self.sampler.snapshot.filtered >> 5 & 1, 0)
+        self.assertEqual(self.sampler.level(5), 1)
+        self.assertGreater(self.sampler.stale_reads, 0)
+
+        self.stalled.set()
+        self.sampler.stop()
+        self.assertEqual(self.sampler.level(5), self.sampler.snapshot.filtered >> 5 & 1)
+
+
+class LimitSwitchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        with mock.patch.object(LimitSwitches, 'WATCHDOG_INTERVAL', 0.02):
+            self.handler = self.engine.start(backend=SimulatedBackend())
+        self.gpio = self.handler.gpio
+        self.pins = self.engine.pins
+        self.switches = dict((s.name, s) for s in self.handler.limit_switches.switches)
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def until(self, condition, timeout=1):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.002)
+
+    def test_trip_reverses_off_the_switch(self):
+        self.engine.move_start(['up'])
+        self.gpio.set_input(self.pins.switches['up'], 1)
+        self.until(lambda: not self.handler.moving_up)
+        self.assertTrue(self.handler.moving_down)
+
+        self.until(lambda: not self.handler.moving_down)
+        up, down = self.pins.axes['up'], self.pins.axes['down']
+        pulses = [(pin, value) for _, pin, value in self.gpio.output_trace() if pin in (up, down)]
+        self.assertEqual(pulses, [(up, 1), (up, 0), (down, 1), (down, 0)])
+
+        switch = self.switches['up']
+        self.assertEqual((switch.trips, switch.watchdog_trips), (1, 0))
+        self.assertLess(switch.last_reaction, 0.1)
+
+    def test_horizontal_trip_only_stops(self):
+        self.engine.move_start(['ccw'])
+        self.gpio.set_input(self.pins.switches['ccw'], 1)
+        self.until(lambda: not self.handler.moving_ccw)
+        time.sleep(self.handler.SWITCH_REVERSE_MOVEMENT)
+        self.assertFalse(self.handler.moving_cw)
+        self.assertEqual(self.gpio.output_trace(self.pins.axes['cw']), [])
+
+    def test_switch_ignored_when_not_moving(self):
+        self.gpio.set_input(self.pins.switches['down'], 1)
+        time.sleep(0.05)
+        self.assertEqual(self.switches['down'].trips, 0)
+        self.assertEqual(self.handler.get_input_sw_down(), 1)
+
+        self.engine.move_start(['down'])
+        self.assertFalse(self.handler.moving_down)
+
+    def test_watchdog_catches_a_switch_closed_at_start(self):
+        self.gpio.set_input(self.pins.switches['cw'], 1)
+        time.sleep(0.05)
+        # Sets the flag and the pin without the switch check of move_cw
+        self.handler.moving_cw = True
+        self.handler.set_pin_high(self.pins.axes['cw'])
+
+        self.until(lambda: not self.handler.moving_cw)
+        self.assertEqual(self.gpio.input(self.pins.axes['cw']), 0)
+        self.assertEqual(self.switches['cw'].watchdog_trips, 1)
+
+
+class StalledSamplerTest(unittest.TestCase):
+    # A listener ahead of the limit switches blocks the sampler thread on
+    # the first input change, so the snapshots freeze while it runs
+
+    def setUp(self):
+        self.engine = Engine()
+        with mock.patch.object(LimitSwitches, 'WATCHDOG_INTERVAL', 0.02):
+            self.handler = self.engine.start(backend=SimulatedBackend())
+        self.gpio = self.handler.gpio
+        self.pins = self.engine.pins
+        self.stalled = Event()
+        self.handler.inputs.listeners.insert(0, lambda previous, snapshot: self.stalled.wait())
+
+    def tearDown(self):
+        self.stalled.set()
+        self.engine.stop()
+
+    def stall(self):
+        self.gpio.set_input(self.pins.switches['down'], 1)
+        time.sleep(0.05)
+
+    def test_watchdog_trips_without_the_sampler(self):
+        self.engine.move_start(['cw'])
+        self.stall()
+        self.gpio.set_input(self.pins.switches['cw'], 1)
+
+        deadline = time.monotonic() + 1
+        while self.handler.moving_cw and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertFalse(self.handler.moving_cw)
+        self.assertEqual(self.gpio.input(self.pins.axes['cw']), 0)
+        self.assertEqual(self.handler.limit_switches.switches[3].watchdog_trips, 1)
+
+    def test_movement_refused_on_a_closed_switch(self):
+        self.stall()
+        self.gpio.set_input(self.pins.switches['up'], 1)
+        self.engine.move_start(['up'])
+        self.assertFalse(self.handler.moving_up)
+        self.assertEqual(self.gpio.input(self.pins.axes['up']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
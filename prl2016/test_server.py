@@ -0,0 +1,64 @@
+import http.client
+import socket
+import unittest
+from threading import Thread
+
+from server import PooledWSGIServer
+
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+    return [b'ok']
+
+
+class PooledWSGIServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PooledWSGIServer('127.0.0.1', 0, app, 2)
+        self.server.IDLE_TIMEOUT = 0.5
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.sockets = []
+
+    def tearDown(self):
+        for s in self.sockets:
+            s.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def connect(self):
+        s = socket.create_connection(('127.0.0.1', self.port))
+        self.sockets.append(s)
+        return s
+
+    def get(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+        conn.request('GET', '/move/emergency')
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response.status, body
+
+    def test_silent_connections_hold_no_worker(self):
+        for _ in range(6):
+            self.connect()
+        self.assertEqual(self.get(), (200, b'ok'))
+
+    def test_parked_connection_is_served_once_readable(self):
+        s = self.connect()
+        self.connect()
+        self.connect()
+        s.sendall(b'GET / HTTP/1.1\r\nHost: test\r\n\r\n')
+        s.settimeout(2)
+        self.assertTrue(s.recv(100).startswith(b'HTTP/1.1 200'))
+
+    def test_idle_connection_is_closed(self):
+        s = self.connect()
+        s.settimeout(3)
+        self.assertEqual(s.recv(10), b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
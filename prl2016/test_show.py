@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from backend import SimulatedBackend
+from engine import BadCommand, Engine
+from show import compile_show, dry_run, start_show
+
+
+def event(at, command, arg):
+    key = {'fire': 'tubes', 'move_to': 'targets'}.get(command, 'directions')
+    return {'at': at, 'command': command, key: arg}
+
+
+class CompileShowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+
+    def compile(self, *events):
+        return compile_show({'name': 'test', 'events': list(events)}, self.engine, loaded=self.engine.prl.bank.all)
+
+    def assertInvalid(self, message, *events):
+        with self.assertRaises(BadCommand) as e:
+            self.compile(*events)
+        self.assertIn(message, str(e.exception))
+
+    def test_schedule(self):
+        show = self.compile(event(500, 'fire', [2]), event(0, 'move_start', ['up']), event(400, 'move_stop', ['up']),
+                            event(500, 'fire', [1]))
+        self.assertEqual([(e.at, e.command) for e in show.events],
+                         [(0, 'move_start'), (400, 'move_stop'), (500, 'fire'), (500, 'fire')])
+        self.assertEqual(show.tubes, [1, 2])
+        self.assertEqual(show.duration, 500)
+
+    def test_tubes_fire_once(self):
+        self.assertInvalid('not loaded or already fired', event(0, 'fire', [1]), event(10, 'fire', [1]))
+        with self.assertRaises(BadCommand):
+            compile_show({'events': [event(0, 'fire', [1])]}, self.engine, loaded=0)
+
+    def test_travel_limit(self):
+        self.assertInvalid('travel limit', event(0, 'move_start', ['up']), event(5000, 'move_stop', ['up']))
+        self.assertInvalid('at the end of the show', event(0, 'move_start', ['cw']))
+
+    def test_reversal_needs_a_stop(self):
+        self.assertInvalid('already moving', event(0, 'move_start', ['up']), event(100, 'move_start', ['down']),
+                           event(200, 'move_stop', ['down']))
+
+    def test_move_to_holds_its_axis(self):
+        self.assertInvalid('may still be driven by event 0', event(0, 'move_to', {'vertical': 5}),
+                           event(100, 'move_to', {'vertical': 10}))
+        self.assertInvalid('may still be driven', event(0, 'move_to', {'horizontal': 5}),
+                           event(100, 'move_start', ['cw']), event(200, 'move_stop', ['cw']))
+
+        show = self.compile(event(0, 'move_to', {'vertical': 5}), event(100, 'move_to', {'horizontal': 5}),
+                            event(31000, 'move_to', {'vertical': 0}))
+        self.assertEqual(len(show.events), 3)
+
+    def test_errors_are_reported_together(self):
+        with self.assertRaises(BadCommand) as e:
+            self.compile(event(0, 'fire', [99]), {'at': -1, 'command': 'fire', 'tubes': [1]}, {'command': 'spin'})
+        self.assertEqual(str(e.exception).count(';'), 2)
+
+
+class ShowRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.handler = self.engine.start(backend=SimulatedBackend())
+        self.gpio = self.handler.gpio
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def run_show(self, *events):
+        runner = start_show(self.engine, {'name': 'test', 'events': list(events)})
+        runner.thread.join(5)
+        return runner
+
+    def test_runs_the_timeline(self):
+        self.engine.load([1])
+        self.engine.arm()
+        runner = self.run_show(event(0, 'move_start', ['up']), event(50, 'move_stop', ['up']), event(60, 'fire', [1]))
+
+        report = runner.serialize()
+        self.assertEqual((report['state'], report['done']), ('done', 3))
+        self.assertLess(report['max_jitter_ms'], 50)
+        up = [value for _, _, value in self.gpio.output_trace(self.engine.pins.axes['up'])]
+        self.assertEqual(up, [1, 0])
+        deadline = time.monotonic() + 1
+        while not self.gpio.output_trace(self.engine.pins.tubes[1]) and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(self.gpio.output_trace(self.engine.pins.tubes[1])[0][2], 1)
+
+    def test_fire_needs_arm(self):
+        self.engine.load([1])
+        with self.assertRaises(Exception):
+            start_show(self.engine, {'events': [event(0, 'fire', [1])]})
+
+    def test_failed_event_aborts_through_the_emergency_stop(self):
+        self.engine.load([1])
+        self.engine.arm()
+        with mock.patch.object(self.engine, 'emergency_stop', wraps=self.engine.emergency_stop) as stop:
+            runner = start_show(self.engine, {'events': [event(0, 'move_start', ['cw']), event(100, 'fire', [1]),
+                                                         event(200, 'move_stop', ['cw'])]})
+            time.sleep(0.02)
+            self.engine.disarm()
+            runner.thread.join(5)
+
+        self.assertEqual(runner.state, 'aborted')
+        self.assertIn('event 1', runner.error)
+        stop.assert_called_once_with()
+        self.assertFalse(self.handler.moving_cw)
+        self.assertEqual(self.gpio.output_trace(self.engine.pins.tubes[1]), [])
+
+
+class DryRunTest(unittest.TestCase):
+
+    def test_jobs_run_in_accelerated_time(self):
+        # The horizontal move_to never reaches its target on the simulated
+        # backend; at speed 100 its 30 s timeout takes 0.3 s
+        events = [event(0, 'move_to', {'horizontal': 20}), event(100, 'fire', [1]),
+                  event(200, 'move_start', ['up']), event(1200, 'move_stop', ['up'])]
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'name': 'dry', 'events': events}, f)
+
+        try:
+            start = time.monotonic()
+            report = dry_run(path, 100)
+        finally:
+            os.remove(path)
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual((report['state'], report['done']), ('done', 4))
+        self.assertLess(report['duration_ms'], 1200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from store import CRC, RECORD, SLOT_OFFSETS, StateStore
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='prl2016-test-')
+        self.path = os.path.join(self.dir, 'state')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def close(self, store):
+        store.map.close()
+        store.file.close()
+
+    def reopen(self, store):
+        store.map.flush()
+        self.close(store)
+        return StateStore(self.path)
+
+    def corrupt(self, offset):
+        with open(self.path, 'r+b') as f:
+            f.seek(offset + RECORD.size - 1)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xff]))
+
+    def test_empty_file(self):
+        store = StateStore(self.path)
+        self.assertIsNone(store.recovered)
+        self.assertEqual(os.path.getsize(self.path), 4096)
+        self.close(store)
+
+    def test_recovers_the_newest_slot(self):
+        store = StateStore(self.path)
+        store.commit(False, 0b11, 5, -7)
+        store.commit(True, 0b10, 6, -8)
+
+        store = self.reopen(store)
+        self.assertEqual(store.recovered, {'seq': 2, 'armed': True, 'loaded': 0b10,
+                                           'encoders': {'vertical': 6, 'horizontal': -8}})
+        store.commit(True, 0b10, 6, -9)
+        self.assertEqual(store.seq, 3)
+        self.close(store)
+
+    def test_unchanged_record_is_not_written(self):
+        store = StateStore(self.path)
+        store.commit(True, 1, 0, 0)
+        store.commit(True, 1, 0, 0)
+        self.assertEqual((store.seq, store.commits), (1, 1))
+        self.close(store)
+
+    def test_torn_slot_falls_back_to_the_other(self):
+        store = StateStore(self.path)
+        store.commit(False, 0b1, 1, 1)
+        store.commit(True, 0b11, 2, 2)
+        # seq 2 went to the slot at SLOT_OFFSETS[0]
+        store.map.flush()
+        self.corrupt(SLOT_OFFSETS[0])
+
+        store = self.reopen(store)
+        self.assertEqual(store.recovered['seq'], 1)
+        self.assertEqual(store.recovered['loaded'], 0b1)
+        self.assertFalse(store.recovered['armed'])
+
+        # The next commit overwrites the damaged slot, never the good one
+        store.commit(True, 0b111, 3, 3)
+        store = self.reopen(store)
+        self.assertEqual((store.recovered['seq'], store.recovered['loaded']), (2, 0b111))
+        self.close(store)
+
+    def test_both_slots_bad(self):
+        store = StateStore(self.path)
+        store.commit(False, 1, 0, 0)
+        store.commit(False, 2, 0, 0)
+        store.map.flush()
+        for offset in SLOT_OFFSETS:
+            self.corrupt(offset)
+        store = self.reopen(store)
+        self.assertIsNone(store.recovered)
+        self.close(store)
+
+    def test_source_is_read_under_the_lock(self):
+        store = StateStore(self.path, flush_interval=60)
+        state = [False, 0b1, 0, 0]
+        held = []
+
+        def source():
+            held.append(store.lock.locked())
+            return tuple(state)
+
+        store.start(source)
+        state[0] = True
+        store.sync()
+        store.close()
+        self.assertEqual(held, [True] * len(held))
+
+        store = StateStore(self.path)
+        self.assertEqual((store.recovered['seq'], store.recovered['armed']), (2, True))
+        self.close(store)
+
+    def test_record_fits_a_slot(self):
+        self.assertLessEqual(RECORD.size + CRC.size, SLOT_OFFSETS[1] - SLOT_OFFSETS[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import time
+import unittest
+from threading import Event
+
+from watchdog import TravelWatchdog
+
+
+class Log:
+
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+class Handler:
+
+    def __init__(self):
+        self.log = Log()
+        self.stopped = []
+        self.event = Event()
+
+    def stop(self, axis):
+        self.stopped.append(axis)
+        self.event.set()
+
+    def stop_up(self):
+        self.stop('up')
+
+    def stop_down(self):
+        self.stop('down')
+
+    def stop_cw(self):
+        self.stop('cw')
+
+    def stop_ccw(self):
+        self.stop('ccw')
+
+
+class FastWatchdog(TravelWatchdog):
+    # A short wheel, so a limit longer than one turn needs several rounds
+    TICK = 0.005
+    SLOTS = 4
+
+
+class TravelWatchdogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = Handler()
+        self.watchdog = FastWatchdog(self.handler, {'up': 0.05, 'down': 0.01, 'cw': None, 'ccw': 0.01})
+        self.watchdog.start()
+
+    def test_expiry_stops_the_axis(self):
+        start = time.monotonic()
+        self.watchdog.arm('up')
+        self.assertTrue(self.handler.event.wait(1))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(self.handler.stopped, ['up'])
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.05 + 4 * FastWatchdog.TICK + 0.05)
+        self.assertEqual(self.watchdog.expired, 1)
+        self.assertEqual(len(self.handler.log.warnings), 1)
+        self.assertEqual(self.watchdog.serialize()['armed'], {})
+
+    def test_cancel(self):
+        self.watchdog.arm('down')
+        self.watchdog.cancel('down')
+        self.assertFalse(self.handler.event.wait(0.1))
+        self.assertEqual(self.handler.stopped, [])
+
+    def test_rearm_moves_the_deadline(self):
+        self.watchdog.arm('ccw')
+        self.watchdog.arm('up')
+        self.watchdog.arm('ccw')
+        self.watchdog.cancel('ccw')
+        self.assertTrue(self.handler.event.wait(1))
+        self.assertEqual(self.handler.stopped, ['up'])
+
+    def test_no_limit(self):
+        self.watchdog.arm('cw')
+        self.assertEqual(self.watchdog.entries, {})
+        self.assertFalse(self.handler.event.wait(0.05))
+
+
+if __name__ == '__main__':
+    unittest.main()
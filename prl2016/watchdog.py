@@ -0,0 +1,97 @@
+import math
+import time
+from threading import Condition, Thread
+
+
+class TravelWatchdog:
+    # Bounds how long any axis output may stay high. Deadlines live in a
+    # hashed timer wheel advanced by one thread: arming and cancelling are
+    # O(1), each tick only looks at one slot, and the thread sleeps on a
+    # condition while no axis is moving.
+
+    TICK = 0.05
+    SLOTS = 64
+
+    def __init__(self, handler, limits):
+        self.handler = handler
+        self.limits = dict(limits)
+        self.cond = Condition()
+        self.wheel = [set() for _ in range(self.SLOTS)]
+        self.entries = {}
+        self.cursor = 0
+        self.next_tick = None
+        self.expired = 0
+        self.thread = None
+        self.dispatch = lambda fn, *args: fn(*args)
+
+        h = handler
+        self.stops = {'up': h.stop_up, 'down': h.stop_down, 'cw': h.stop_cw, 'ccw': h.stop_ccw}
+
+    def start(self):
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def arm(self, axis):
+        limit = self.limits.get(axis)
+        if limit is None:
+            return
+
+        with self.cond:
+            self.remove(axis)
+
+            now = time.monotonic()
+            if not self.entries:
+                self.next_tick = now + self.TICK
+
+            ticks = max(1, int(math.ceil((now + limit - self.next_tick) / self.TICK)) + 1)
+            slot = (self.cursor + ticks) % self.SLOTS
+            self.entries[axis] = [slot, (ticks - 1) // self.SLOTS, now + limit]
+            self.wheel[slot].add(axis)
+            self.cond.notify()
+
+    def cancel(self, axis):
+        with self.cond:
+            self.remove(axis)
+
+    def remove(self, axis):
+        entry = self.entries.pop(axis, None)
+        if entry is not None:
+            self.wheel[entry[0]].discard(axis)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.entries:
+                    self.cond.wait()
+
+                delay = self.next_tick - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+
+                self.next_tick += self.TICK
+                self.cursor = (self.cursor + 1) % self.SLOTS
+
+                expired = []
+                for axis in list(self.wheel[self.cursor]):
+                    entry = self.entries[axis]
+                    if entry[1] > 0:
+                        entry[1] -= 1
+                    else:
+                        self.remove(axis)
+                        expired.append(axis)
+
+            for axis in expired:
+                self.expired += 1
+                self.dispatch(self.stops[axis])
+                self.handler.log.warning('Travel limit of %s s reached on %s, stopped' % (self.limits[axis], axis))
+
+    def serialize(self):
+        with self.cond:
+            now = time.monotonic()
+            return {
+                'limits': self.limits,
+                'armed': dict((axis, max(0.0, e[2] - now)) for axis, e in self.entries.items()),
+                'expired': self.expired,
+            }